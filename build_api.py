@@ -0,0 +1,69 @@
+##############################################################################
+# In-process build API.
+#
+# Builds an app from a directory, a zip/tar archive or a content source
+# (see content_source.py) inside the calling process, and streams the
+# .manifest, .dat, .index and .checksums (and .hashes with strong_hash, the
+# .zdict with compress='dict') to caller-provided sinks instead of the
+# working directory:
+#
+#   from build_api import build
+#   artifacts = build("content.tar.gz", 0x10, 5, "ABCD", sinks={'dat': sock})
+#   artifacts['manifest'], artifacts['index'], artifacts['checksums']
+#
+# A sink is anything with write() (a BytesIO, an open file, a pipe) or a
+# connected socket; sinks are written to in order and never seeked or
+# closed.  Artifacts without a sink are collected in memory and returned
+# as bytes.  Nothing is read from or written to the working directory:
+# special flags and the minfootprint list are passed in, and with the
+# default options the build keeps all of its tables in memory.
+##############################################################################
+
+import io
+
+from threaded_manifest_generator import generate_gcf
+
+ARTIFACTS = ('manifest', 'dat', 'index', 'checksums')
+
+
+class SocketSink(object):
+    """
+    File-like write() on top of a connected socket.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+        return len(data)
+
+
+def build(content, app_id, app_version, fingerprint, sinks=None, special_flags=None, minfootprint=None,
+          **options):
+    """
+    Build app_id / app_version from content and return {artifact: bytes} for
+    every artifact that sinks ({artifact: file object or socket}) does not
+    take.  special_flags ({relative path: flags}) and minfootprint
+    (relative paths of the launch files) default to none.  Other options
+    are those of generate_gcf(); options that write more files (pool_dir,
+    shards, journal, path_index, compress) use output_dir for them.
+    """
+    sinks = {kind: sink for kind, sink in (sinks or {}).items() if sink is not None}
+    kinds = ARTIFACTS + (('hashes',) if options.get('strong_hash') else ()) \
+        + (('zdict',) if options.get('compress') == 'dict' else ())
+    if options.get('pool_dir') or options.get('shard_size') is not None or options.get('shards', 1) > 1 \
+            or options.get('journal'):
+        # The payloads go to files of their own
+        kinds = tuple(kind for kind in kinds if kind != 'dat')
+    buffers = {}
+    for kind in kinds:
+        if kind not in sinks:
+            buffers[kind] = sinks[kind] = io.BytesIO()
+        elif not hasattr(sinks[kind], 'write') and hasattr(sinks[kind], 'sendall'):
+            sinks[kind] = SocketSink(sinks[kind])
+
+    generate_gcf(content, app_id, str(app_version), fingerprint, sinks=sinks,
+                 special_flags={} if special_flags is None else special_flags,
+                 minfootprint=() if minfootprint is None else minfootprint, **options)
+    return {kind: buffer.getvalue() for kind, buffer in buffers.items()}
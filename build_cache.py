@@ -0,0 +1,138 @@
+##############################################################################
+# Whole-build result cache.
+#
+# A build is keyed by a fingerprint of everything that decides its output:
+# the tree listing (relative path, size, mtime), minfootprint.txt,
+# special_file_flags.ini, app id, version, the 4 character fingerprint and
+# the build options.  When the key is already in the cache the previously
+# generated .manifest/.dat/.index/.checksums are hard-linked (or copied)
+# into place instead of building again.  Old entries are evicted least
+# recently used first once the cache grows past its size limit.
+##############################################################################
+
+import hashlib
+import os
+import shutil
+import time
+
+from content_source import open_source
+
+
+def file_digest(filename):
+    """
+    sha256 of a file's content, or of nothing if it does not exist.
+    """
+    digest = hashlib.sha256()
+    if filename and os.path.isfile(filename):
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(0x100000), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def input_fingerprint(directory_path, app_id, app_version, fingerprint, config_files=(), options=None):
+    """
+    Fast fingerprint of a build's inputs: the tree listing in walk order with
+    sizes and mtimes (file content is not read; for an archive, its own size
+    and mtime), the content of the config files, the ids and the
+    output-affecting options.  directory_path may be a content source.
+    """
+    digest = hashlib.sha256()
+    digest.update("{}\0{}\0{}\n".format(app_id, app_version, fingerprint).encode('utf-8'))
+    for name in config_files:
+        digest.update("{}\0{}\n".format(name, file_digest(name)).encode('utf-8'))
+    for name, value in sorted((options or {}).items()):
+        digest.update("{}={!r}\n".format(name, value).encode('utf-8'))
+
+    for line in open_source(directory_path).listing():
+        digest.update(line.encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Hard-link src to dst, falling back to a copy across filesystems.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class BuildCache(object):
+    """
+    Directory of cached build outputs, one sub-directory per input key.
+    max_size (bytes) bounds the total size; None means unbounded.
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def restore(self, key, dest_dir='.'):
+        """
+        Put the cached outputs for key into dest_dir.  Returns the list of
+        restored file names, or None on a cache miss.
+        """
+        entry = self.entry_dir(key)
+        if not os.path.isdir(entry):
+            return None
+        names = sorted(os.listdir(entry))
+        for name in names:
+            link_or_copy(os.path.join(entry, name), os.path.join(dest_dir, name))
+        # Mark the entry as recently used for LRU eviction
+        os.utime(entry)
+        return names
+
+    def store(self, key, filenames):
+        """
+        Add the given output files under key, then evict old entries.
+        """
+        entry = self.entry_dir(key)
+        staging = "{}.tmp-{}".format(entry, os.getpid())
+        if os.path.isdir(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        for filename in filenames:
+            link_or_copy(filename, os.path.join(staging, os.path.basename(filename)))
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.rename(staging, entry)
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        (last used, size, key) of every complete cache entry.
+        """
+        result = []
+        for key in os.listdir(self.cache_dir):
+            entry = self.entry_dir(key)
+            if '.tmp-' in key or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            result.append((os.path.getmtime(entry), size, key))
+        return result
+
+    def evict(self, keep=None):
+        """
+        Drop least recently used entries until the cache fits in max_size.
+        """
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for last_used, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_dir(key))
+            total -= size
+            print("Build cache: evicted {} ({} bytes, last used {})".format(
+                key, size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_used))))
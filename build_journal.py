@@ -0,0 +1,106 @@
+##############################################################################
+# Build journal for crash-safe checkpoint and resume.
+#
+# A journaled build appends one record per finished file payload (its
+# index entry data, chunk lengths, checksums, strong digests, and the .dat
+# end offset after it) to <app_id>_<version>.journal.  Records are only
+# made durable at a checkpoint, after the .dat itself was synced, so the
+# journal never describes payload bytes that could have been lost.
+#
+# When a build with the same input fingerprint (see build_cache.py) finds a
+# journal, it truncates the .dat to the last checkpointed offset, replays
+# the journaled files from their records instead of reading them again and
+# carries on from there; the outputs are identical to an uninterrupted run.
+##############################################################################
+
+import os
+import pickle
+import time
+
+JOURNAL_VERSION = 1
+
+
+class BuildJournal(object):
+    """
+    Append-only journal of finished payloads, checkpointed every
+    `interval` seconds.  before_checkpoint is called first to make the
+    payload data durable (StorageWriter.sync).
+    """
+
+    def __init__(self, filename, key, interval=30.0, before_checkpoint=None):
+        self.filename = filename
+        self.key = key
+        self.interval = interval
+        self.before_checkpoint = before_checkpoint
+        self.pending = []
+        self.f = None
+        self.last_checkpoint = time.monotonic()
+        self.records = 0
+
+    def load(self):
+        """
+        The journaled payloads of an interrupted build of the same inputs,
+        as {file id: payload}.  A journal of other inputs is ignored, and a
+        torn record at the end (crash during a checkpoint) is dropped.
+        """
+        records = {}
+        if not os.path.exists(self.filename):
+            return records
+        with open(self.filename, 'rb') as f:
+            try:
+                header = pickle.load(f)
+            except Exception:
+                return records
+            if header != ('journal', JOURNAL_VERSION, self.key):
+                print("Ignoring {}: it belongs to a build of other inputs".format(self.filename))
+                return records
+            while True:
+                try:
+                    _, file_id, relative_path, payload = pickle.load(f)
+                except Exception:
+                    break
+                records[file_id] = payload
+        return records
+
+    def open(self, records=None):
+        """
+        Start journaling, keeping the given (resumed) records.
+        """
+        temp_fname = self.filename + ".tmp"
+        with open(temp_fname, 'wb') as f:
+            pickle.dump(('journal', JOURNAL_VERSION, self.key), f, protocol=2)
+            for file_id, payload in (records or {}).items():
+                pickle.dump(('file', file_id, None, payload), f, protocol=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_fname, self.filename)
+        self.records = len(records or {})
+        self.f = open(self.filename, 'ab')
+
+    def add(self, file_id, relative_path, payload):
+        self.pending.append(('file', file_id, relative_path, payload))
+        if time.monotonic() - self.last_checkpoint >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.pending:
+            if self.before_checkpoint is not None:
+                self.before_checkpoint()
+            for record in self.pending:
+                pickle.dump(record, self.f, protocol=2)
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.records += len(self.pending)
+            print("Checkpoint: {} files journaled".format(self.records))
+            self.pending = []
+        self.last_checkpoint = time.monotonic()
+
+    def close(self, completed):
+        """
+        Stop journaling; a completed build no longer needs its journal.
+        """
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if completed and os.path.exists(self.filename):
+            os.remove(self.filename)
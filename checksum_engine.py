@@ -0,0 +1,269 @@
+##############################################################################
+# Single-read checksum engine.
+#
+# The toolkit needs adler32 at several granularities: per 0x8000 block
+# (pmein1 / Beta 1 storages), per 0x10000 chunk (threaded generator) and per
+# whole file (checksum_generator.py).  MultiChecksum hashes every byte once at
+# the finest (0x8000) granularity and derives the coarser checksums with
+# adler32 combination, optionally feeding a strong hash from the same data,
+# so every variant of a .checksums file costs a single read of the content.
+##############################################################################
+
+import hashlib
+import struct
+import sys
+import zlib
+from array import array
+
+ADLER_BASE = 65521
+BLOCK_SIZE = 0x8000
+GRANULARITIES = (0x8000, 0x10000, "file")
+
+
+def adler32_combine(adler1: int, adler2: int, len2: int, seed: int = 1) -> int:
+    """
+    Return the adler32 of A+B given adler32(A), adler32(B) and len(B),
+    where both checksums were started from the same seed value
+    (zlib.adler32(data, seed); 1 is zlib's default, the generators use 0).
+    """
+    a0 = seed & 0xFFFF
+    b0 = (seed >> 16) & 0xFFFF
+    a1 = adler1 & 0xFFFF
+    b1 = (adler1 >> 16) & 0xFFFF
+    a2 = adler2 & 0xFFFF
+    b2 = (adler2 >> 16) & 0xFFFF
+    rem = len2 % ADLER_BASE
+
+    a = (a1 + a2 - a0) % ADLER_BASE
+    b = (b1 + rem * a1 + b2 - b0 - rem * a0) % ADLER_BASE
+    return (b << 16) | a
+
+
+def parse_granularity(text):
+    """
+    Parse 'file', '0x8000', '32768', ... into a value from GRANULARITIES.
+    """
+    if isinstance(text, int):
+        value = text
+    elif text.strip().lower() in ("file", "whole"):
+        return "file"
+    else:
+        value = int(text, 0)
+    if value not in GRANULARITIES:
+        raise ValueError(f"Unsupported checksum granularity: {text} (use 0x8000, 0x10000 or file)")
+    return value
+
+
+class MultiChecksum(object):
+    """
+    Incremental multi-granularity checksum, fed like a hashlib object.
+
+    After finish():
+      blocks_8000  - array('I') of adler32 per 0x8000 block
+      blocks_10000 - array('I') of adler32 per 0x10000 block
+      whole        - adler32 of the whole content
+      strong       - strong hash digest (bytes) if strong_hash was given, else None
+      strong_blocks - with strong_blocks, the strong digest of every 0x8000
+                      block, concatenated (bytearray)
+      length       - number of bytes seen
+    """
+
+    def __init__(self, seed: int = 0, strong_hash: str = None, strong_blocks: bool = False):
+        self.seed = seed
+        self.strong_hash = strong_hash
+        self._strong = hashlib.new(strong_hash) if strong_hash else None
+        self.strong_blocks = bytearray() if strong_hash and strong_blocks else None
+        self._pending = bytearray()
+        self._half = None
+        self.blocks_8000 = array('I')
+        self.blocks_10000 = array('I')
+        self.whole = None
+        self.strong = None
+        self.length = 0
+
+    def update(self, data):
+        view = memoryview(data).cast('B')
+        if self._strong is not None:
+            self._strong.update(view)
+        self.length += len(view)
+
+        # Top up a partial block left over from the previous update first
+        if self._pending:
+            take = BLOCK_SIZE - len(self._pending)
+            self._pending += view[:take]
+            view = view[take:]
+            if len(self._pending) < BLOCK_SIZE:
+                return
+            self._add_block(self._pending)
+            self._pending = bytearray()
+
+        while len(view) >= BLOCK_SIZE:
+            self._add_block(view[:BLOCK_SIZE])
+            view = view[BLOCK_SIZE:]
+        if len(view):
+            self._pending += view
+
+    def add_blocks(self, data, adlers, digests=None):
+        """
+        Feed data whose per-0x8000 block adler32s (and strong block digests)
+        were already computed elsewhere (see block_checksums), e.g. by a
+        worker thread.  data must start on a block boundary (or it is
+        checksummed again), and only the last block of the whole content
+        may be short.
+        """
+        if self._pending or (self.strong_blocks is not None and digests is None):
+            self.update(data)
+            return
+        if self._strong is not None:
+            self._strong.update(data)
+        self.length += len(data)
+        if self.strong_blocks is not None:
+            self.strong_blocks += digests
+        for i, value in enumerate(adlers):
+            self._add_block_value(value, min(BLOCK_SIZE, len(data) - i * BLOCK_SIZE))
+
+    def _add_block(self, block):
+        if self.strong_blocks is not None:
+            self.strong_blocks += hashlib.new(self.strong_hash, block).digest()
+        self._add_block_value(zlib.adler32(block, self.seed) & 0xFFFFFFFF, len(block))
+
+    def _add_block_value(self, value, length):
+        self.blocks_8000.append(value)
+
+        # Two consecutive 0x8000 blocks make one 0x10000 block
+        if self._half is None:
+            self._half = value
+        else:
+            self.blocks_10000.append(adler32_combine(self._half, value, length, self.seed))
+            self._half = None
+
+        if self.whole is None:
+            self.whole = value
+        else:
+            self.whole = adler32_combine(self.whole, value, length, self.seed)
+
+    def finish(self):
+        if self._pending:
+            self._add_block(self._pending)
+            self._pending = bytearray()
+        if self._half is not None:
+            self.blocks_10000.append(self._half)
+            self._half = None
+        if self.whole is None:
+            # adler32 of no data is the seed itself
+            self.whole = self.seed & 0xFFFFFFFF
+        if self._strong is not None:
+            self.strong = self._strong.digest()
+        return self
+
+    def checksums(self, granularity):
+        """
+        The checksum list for one granularity (0x8000, 0x10000 or "file").
+        """
+        if granularity == 0x8000:
+            return self.blocks_8000
+        if granularity == 0x10000:
+            return self.blocks_10000
+        if granularity == "file":
+            return array('I', [self.whole])
+        raise ValueError(f"Unsupported checksum granularity: {granularity}")
+
+
+def block_checksums(data, seed: int = 0, strong_hash: str = None):
+    """
+    (array('I') of the adler32 of every 0x8000 block of data, concatenated
+    strong digests of those blocks or None), for MultiChecksum.add_blocks.
+    """
+    view = memoryview(data).cast('B')
+    adlers = array('I', (zlib.adler32(view[pos:pos + BLOCK_SIZE], seed) & 0xFFFFFFFF
+                         for pos in range(0, len(view), BLOCK_SIZE)))
+    digests = None
+    if strong_hash:
+        digests = b''.join(hashlib.new(strong_hash, view[pos:pos + BLOCK_SIZE]).digest()
+                           for pos in range(0, len(view), BLOCK_SIZE))
+    return adlers, digests
+
+
+def checksum_file(file_path: str, seed: int = 0, strong_hash: str = None,
+                  offset: int = 0, length: int = None, read_size: int = 0x100000) -> MultiChecksum:
+    """
+    Checksum a file (or the [offset, offset + length) range of it, e.g. one
+    entry of a .dat) at every granularity with a single read.
+    """
+    result = MultiChecksum(seed, strong_hash)
+    with open(file_path, "rb") as f:
+        checksum_stream(f, result, offset, length, read_size)
+    return result.finish()
+
+
+def checksum_stream(f, result: MultiChecksum, offset: int = 0, length: int = None,
+                    read_size: int = 0x100000) -> MultiChecksum:
+    """
+    Feed [offset, offset + length) of an open binary file into result.
+    """
+    f.seek(offset)
+    remaining = length
+    while remaining is None or remaining > 0:
+        block = f.read(read_size if remaining is None else min(read_size, remaining))
+        if not block:
+            break
+        result.update(block)
+        if remaining is not None:
+            remaining -= len(block)
+    return result
+
+
+############################################
+# Strong-hash sidecar (.hashes)
+############################################
+# Layout (little-endian):
+#   header  <4sII16sII  magic b'SHSH', version 1, file count, hash name,
+#                       digest size, block size (0x8000)
+#   table   <II per file id: block count, first block index
+#   file digests   one digest per file id (whole stored payload)
+#   block digests  one digest per 0x8000 block of stored payload
+HASHES_MAGIC = b'SHSH'
+HASHES_HEADER = "<4sII16sII"
+
+
+def write_hashes_stream(f, strong_hash, digest_size, block_counts, block_firsts, file_digests, block_digests):
+    """
+    Write a .hashes sidecar to an open binary file.  block_digests is a
+    buffer with iter_blocks() (SpillBuffer) or plain bytes.
+    """
+    entries = array('I', [0]) * (2 * len(block_counts))
+    entries[0::2] = array('I', block_counts)
+    entries[1::2] = array('I', block_firsts)
+    if sys.byteorder != 'little':
+        entries.byteswap()
+    f.write(struct.pack(HASHES_HEADER, HASHES_MAGIC, 1, len(block_counts), strong_hash.encode('ascii'),
+                        digest_size, BLOCK_SIZE))
+    f.write(entries.tobytes())
+    f.write(file_digests)
+    for block in (block_digests.iter_blocks() if hasattr(block_digests, 'iter_blocks') else [block_digests]):
+        f.write(block)
+
+
+def load_hashes(filename):
+    """
+    Read a .hashes sidecar into {'hash', 'digest_size', 'block_size',
+    'files': {file id: (file digest, [block digests])}}.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic, version, file_count, name, digest_size, block_size = struct.unpack_from(HASHES_HEADER, data, 0)
+    if magic != HASHES_MAGIC or version != 1:
+        raise ValueError("{} is not a version 1 hash sidecar".format(filename))
+    pos = struct.calcsize(HASHES_HEADER)
+    table = struct.unpack_from("<{}I".format(2 * file_count), data, pos)
+    file_digest_start = pos + 8 * file_count
+    block_start = file_digest_start + digest_size * file_count
+    files = {}
+    for i in range(file_count):
+        count, first = table[2 * i], table[2 * i + 1]
+        file_digest = data[file_digest_start + i * digest_size:file_digest_start + (i + 1) * digest_size]
+        blocks = [data[block_start + (first + j) * digest_size:block_start + (first + j + 1) * digest_size]
+                  for j in range(count)]
+        files[i + 1] = (file_digest, blocks)
+    return {'hash': name.rstrip(b'\0').decode('ascii'), 'digest_size': digest_size,
+            'block_size': block_size, 'files': files}
@@ -3,6 +3,11 @@ import zlib
 import sys
 import pickle
 import os
+from array import array
+from itertools import accumulate
+
+from checksum_engine import MultiChecksum, parse_granularity
+from storage_extract import StorageReader
 
 def calculate_chunk_checksum(data_block: bytes) -> int:
     """
@@ -12,6 +17,16 @@ def calculate_chunk_checksum(data_block: bytes) -> int:
     adler = zlib.adler32(data_block, 0) & 0xFFFFFFFF
     return adler
 
+def uint32_le_bytes(values: array) -> bytes:
+    """
+    Little-endian bytes of an array('I'), the layout of every table in the
+    .checksums file (and of the manifest's copy table).
+    """
+    if sys.byteorder != 'little':
+        values = array('I', values)
+        values.byteswap()
+    return values.tobytes()
+
 def parse_manifest_for_version(manifest_file: str) -> int:
     """
     Reads the manifest to extract the app version.
@@ -21,91 +36,115 @@ def parse_manifest_for_version(manifest_file: str) -> int:
         _, _, manif_appversion = struct.unpack("<III", data)
     return manif_appversion
 
-def create_checksums(
-    manifest_file: str,
-    index_file: str,
-    dat_file: str,
-    app_id: int,
-    app_version_str: str,
-    output_filename: str = None
-):
+def write_checksums_container(output_filename: str, manifest_appversion: int,
+                              checksum_counts: array, all_checksums: array):
     """
-    Generates a .checksums file based on the manifest, index, and dat files.
+    Writes one .checksums file from per-file checksum counts and the flat
+    checksum list.
     """
-    manifest_appversion = parse_manifest_for_version(manifest_file)
-
-    # Load the .index file
-    with open(index_file, "rb") as f_idx:
-        index_data = pickle.load(f_idx)
-
-    # Process each file in the .index and calculate checksums
-    all_checksums = []
-    file_id_entries = []
-
-    running_index = 0
-    with open(dat_file, "rb") as f_dat:
-        for file_id, info in index_data.items():
-            offset = info['offset']
-            length = info['length']
-
-            # Read the file data from the .dat file
-            f_dat.seek(offset)
-            file_data = f_dat.read(length)
-
-            # Calculate the checksum for the entire file
-            file_checksum = calculate_chunk_checksum(file_data)
-
-            # Save the checksum and update file_id entries
-            file_id_entries.append((1, running_index))  # 1 checksum for the whole file
-            all_checksums.append(file_checksum)
-            running_index += 1
-
-    # Build the .checksums file structure
     header_version = 1
     format_code = 0x14893721
     dummy0 = 1
 
-    file_id_count = len(file_id_entries)
+    # FileIdChecksumTableEntry pairs: (ChecksumCount, FirstChecksumIndex)
+    file_id_count = len(checksum_counts)
+    file_id_entries = array('I', [0]) * (2 * file_id_count)
+    file_id_entries[0::2] = checksum_counts
+    file_id_entries[1::2] = array('I', accumulate(checksum_counts, initial=0))[:file_id_count]
+
     checksum_count = len(all_checksums)
 
-    out_buf = bytearray()
+    # ChecksumSize: everything after the ChecksumDataContainer and LatestApplicationVersion
+    checksum_size = 16 + file_id_count * 8 + checksum_count * 4
 
     # 1) ChecksumDataContainer
-    out_buf += struct.pack("<II", header_version, 0)  # Placeholder for ChecksumSize
-
     # 2) LatestApplicationVersion
-    out_buf += struct.pack("<I", manifest_appversion)
-
     # 3) FileIdChecksumTableHeader
-    out_buf += struct.pack("<IIII", format_code, dummy0, file_id_count, checksum_count)
-
     # 4) FileIdChecksumTableEntry array
-    for (ccount, first_index) in file_id_entries:
-        out_buf += struct.pack("<II", ccount, first_index)
-
     # 5) ChecksumEntry array
-    for ch in all_checksums:
-        out_buf += struct.pack("<I", ch)
+    out_buf = b"".join((
+        struct.pack("<IIIIIII", header_version, checksum_size, manifest_appversion,
+                    format_code, dummy0, file_id_count, checksum_count),
+        uint32_le_bytes(file_id_entries),
+        uint32_le_bytes(all_checksums),
+    ))
 
     # The following is NOT used for Beta 1 checksum files
     """# 6) 128-byte signature placeholder
     out_buf += b'\x00' * 128"""
 
-    # Update ChecksumSize
-    checksum_size = len(out_buf) - 12
-    struct.pack_into("<I", out_buf, 4, checksum_size)
-
-    # Write the .checksums file
-    if output_filename is None:
-        output_filename = f"{app_id}_{app_version_str}.checksums"
     with open(output_filename, "wb") as fout:
         fout.write(out_buf)
 
     print(f"Checksum file generated: {output_filename}")
 
+def create_checksums(
+    manifest_file: str,
+    index_file: str,
+    dat_file: str,
+    app_id: int,
+    app_version_str: str,
+    output_filename: str = None,
+    granularities=("file",)
+):
+    """
+    Generates a .checksums file based on the manifest, index, and dat files.
+
+    granularities lists the variants to write ("file" = one checksum per file,
+    0x8000 / 0x10000 = one per block). Every variant comes from a single read
+    of each file's data. With more than one variant the granularity is added
+    to the output name, e.g. 16_5_8000.checksums.
+    """
+    manifest_appversion = parse_manifest_for_version(manifest_file)
+    granularities = [parse_granularity(g) for g in granularities]
+
+    # Load the .index file
+    with open(index_file, "rb") as f_idx:
+        index_data = pickle.load(f_idx)
+
+    # Per variant: checksum count per file and the flat checksum list
+    checksum_counts = {g: array('I') for g in granularities}
+    all_checksums = {g: array('I') for g in granularities}
+
+    # The reader handles chunk-aligned and sharded storages
+    reader = StorageReader(index_data, dat_file)
+    try:
+        # Table entries follow file id order, which need not be .dat order
+        for file_id in sorted(index_data):
+            # Read the file data from the .dat file once, for every variant
+            result = MultiChecksum(seed=0)
+            for block in reader.iter_file_blocks(file_id):
+                result.update(block)
+            result.finish()
+
+            for g in granularities:
+                file_checksums = result.checksums(g)
+                checksum_counts[g].append(len(file_checksums))
+                all_checksums[g].extend(file_checksums)
+    finally:
+        reader.close()
+
+    if output_filename is None:
+        output_filename = f"{app_id}_{app_version_str}.checksums"
+
+    for g in granularities:
+        if len(granularities) == 1:
+            variant_filename = output_filename
+        else:
+            base, ext = os.path.splitext(output_filename)
+            variant_filename = f"{base}_{g if g == 'file' else format(g, 'x')}{ext}"
+        write_checksums_container(variant_filename, manifest_appversion, checksum_counts[g], all_checksums[g])
+
 def main():
-    if len(sys.argv) < 5:
-        print("Usage: python checksum_generator.py <manifest_file> <index_file> <dat_file> <app_id> <app_version_str> [<output_checksum_file>]")
+    # Optional "--granularity=file,0x8000,0x10000" anywhere on the command line
+    granularities = ["file"]
+    for arg in list(sys.argv):
+        if arg.startswith("--granularity="):
+            granularities = arg.split("=", 1)[1].split(",")
+            sys.argv.remove(arg)
+
+    if len(sys.argv) < 6:
+        print("Usage: python checksum_generator.py <manifest_file> <index_file> <dat_file> <app_id> <app_version_str> [<output_checksum_file>] [--granularity=file,0x8000,0x10000]")
         sys.exit(1)
 
     manifest_file = sys.argv[1]
@@ -136,7 +175,8 @@ def main():
         dat_file=dat_file,
         app_id=app_id,
         app_version_str=app_version_str,
-        output_filename=output_file
+        output_filename=output_file,
+        granularities=granularities
     )
 
 if __name__ == "__main__":
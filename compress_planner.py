@@ -0,0 +1,131 @@
+##############################################################################
+# Sampling compress-or-store planner.
+#
+# Before a file is written to the .dat the planner reads a few sample blocks
+# spread over it and zlib-compresses them at each candidate level.  A file
+# whose best level saves less than min_saving is stored as is (already
+# compressed assets: .wav, .bik, archives, ...); otherwise it gets the
+# cheapest level within level_slack of the best ratio.  Once enough files
+# of an extension agreed on a decision, the rest of that extension reuse it
+# without sampling.  The build records what each file actually cost and
+# saved, and the planner writes that out as a CSV report plus a summary.
+##############################################################################
+
+import csv
+import os
+import time
+import zlib
+
+# Decisions: 0 = store, 1..9 = zlib level
+STORE = 0
+
+
+def sample_ranges(size, sample_size, samples):
+    """
+    (offset, length) of the sample blocks of a file: the whole file when it
+    is small, otherwise `samples` blocks spread evenly over it.
+    """
+    if size <= sample_size * samples:
+        return [(0, size)] if size else []
+    step = (size - sample_size) // (samples - 1) if samples > 1 else 0
+    return [(i * step, sample_size) for i in range(samples)]
+
+
+class CompressionPlanner(object):
+    """
+    Decides per file whether to compress it and at what zlib level, and
+    keeps the per-file report of the build.
+    """
+
+    def __init__(self, levels=(1, 6, 9), min_saving=0.05, level_slack=0.01, sample_size=0x10000, samples=4,
+                 extension_files=8):
+        self.levels = levels
+        self.min_saving = min_saving
+        self.level_slack = level_slack
+        self.sample_size = sample_size
+        self.samples = samples
+        self.extension_files = extension_files
+        self.extension_decisions = {}
+        self.rows = []
+        self.planning_seconds = 0.0
+
+    def plan(self, relative_path, size, read_ranges):
+        """
+        Returns (decision, how it was decided, estimated ratio) for a file.
+        read_ranges(ranges) yields the file's data at each (offset, length),
+        e.g. content_source.DirectorySource.read_ranges.
+        """
+        extension = os.path.splitext(relative_path)[1].lower()
+        decisions = self.extension_decisions.get(extension, [])
+        if len(decisions) >= self.extension_files and len(set(decisions)) == 1:
+            return decisions[0], "extension", None
+
+        start = time.thread_time()
+        raw = 0
+        compressed = dict.fromkeys(self.levels, 0)
+        for sample in read_ranges(sample_ranges(size, self.sample_size, self.samples)):
+            raw += len(sample)
+            for level in self.levels:
+                compressed[level] += len(zlib.compress(sample, level))
+        self.planning_seconds += time.thread_time() - start
+
+        if not raw:
+            decision, ratio = STORE, 1.0
+        else:
+            ratios = {level: compressed[level] / raw for level in self.levels}
+            best = min(ratios.values())
+            if 1.0 - best < self.min_saving:
+                decision, ratio = STORE, best
+            else:
+                decision = min(level for level in self.levels if ratios[level] <= best + self.level_slack)
+                ratio = ratios[decision]
+        if raw:
+            self.extension_decisions.setdefault(extension, []).append(decision)
+        return decision, "sampled", ratio
+
+    def record(self, relative_path, decision, planned_by, estimated_ratio, size, stored, cpu_seconds):
+        self.rows.append((relative_path, size, decision, planned_by, estimated_ratio, stored, cpu_seconds))
+
+    def replay(self, relative_path, decision, planned_by, estimated_ratio, size, stored, cpu_seconds):
+        """
+        Re-apply a decision made before a build was interrupted (see
+        build_journal.py), so the files after it are planned the same way.
+        """
+        if planned_by == "sampled" and size:
+            extension = os.path.splitext(relative_path)[1].lower()
+            self.extension_decisions.setdefault(extension, []).append(decision)
+        self.record(relative_path, decision, planned_by, estimated_ratio, size, stored, cpu_seconds)
+
+    def write_report(self, filename):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(("path", "size", "decision", "planned_by", "estimated_ratio", "stored_size",
+                             "compress_cpu_ms", "saved_bytes"))
+            for path, size, decision, planned_by, ratio, stored, cpu_seconds in self.rows:
+                writer.writerow((path, size, "store" if decision == STORE else "zlib-{}".format(decision),
+                                 planned_by, "" if ratio is None else "{:.4f}".format(ratio), stored,
+                                 "{:.3f}".format(cpu_seconds * 1000), size - stored))
+
+    def print_summary(self):
+        raw = sum(row[1] for row in self.rows)
+        stored = sum(row[5] for row in self.rows)
+        cpu_seconds = sum(row[6] for row in self.rows)
+        compressed_files = sum(1 for row in self.rows if row[2] != STORE)
+        print("Compression plan: {} files compressed, {} stored; {} -> {} bytes ({} saved)".format(
+            compressed_files, len(self.rows) - compressed_files, raw, stored, raw - stored))
+        print("  CPU: {:.3f}s compressing, {:.3f}s sampling; {:.1f} MB saved per CPU second".format(
+            cpu_seconds, self.planning_seconds,
+            (raw - stored) / 1048576.0 / (cpu_seconds + self.planning_seconds)
+            if cpu_seconds + self.planning_seconds else 0.0))
+
+        by_extension = {}
+        for path, size, decision, _, _, stored_size, seconds in self.rows:
+            totals = by_extension.setdefault(os.path.splitext(path)[1].lower() or "(none)", [0, 0, 0.0, set()])
+            totals[0] += size
+            totals[1] += stored_size
+            totals[2] += seconds
+            totals[3].add("store" if decision == STORE else "zlib-{}".format(decision))
+        for extension, (size, stored_size, seconds, decisions) in sorted(
+                by_extension.items(), key=lambda item: -item[1][0])[:10]:
+            print("  {:<10} {:>12} -> {:>12} bytes, {:.3f}s CPU, {}".format(
+                extension, size, stored_size, seconds, "/".join(sorted(decisions))))
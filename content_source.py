@@ -0,0 +1,328 @@
+##############################################################################
+# Content sources for the generator.
+#
+# A content source lists the tree to build and reads its files:
+#   DirectorySource - a directory on disk (os.walk order, as always)
+#   ZipSource       - a .zip archive, read member by member
+#   TarSource       - a .tar archive; a plain .tar is read at the members'
+#                     data offsets, a compressed one (.tar.gz, .tar.bz2,
+#                     .tar.xz, ...) is streamed once from start to end
+# so content that arrives as an archive is built without unpacking it.
+#
+# Every source yields the walk events of walk_tree(): ('dir', relative path)
+# for a directory before anything inside it, and ('file', relative path,
+# ref) for a file, where ref is what size() / iter_chunks() / read_ranges()
+# / locate() take.  Archives have their directories in the order of the
+# first member below them, with missing directory entries filled in.
+# locate() gives the (path, offset) of a file's bytes when they are stored
+# as is in a file on disk, so very large files can be read in parallel
+# ranges with os.pread; None otherwise.
+#
+# A `sequential` source (compressed tar) can only be read in event order,
+# and each file only while its event is current; it has no random access,
+# so the payload layouts and sampling compression planner do not apply.
+##############################################################################
+
+import os
+import posixpath
+import tarfile
+import zipfile
+
+
+def iter_file_chunks(file_path, chunk_size):
+    """
+    Yield a file's chunks one at a time, for builds that must not hold a
+    whole file in memory.
+    """
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def walk_tree(directory_path):
+    """
+    Walk the content tree in os.walk order, yielding ('dir', relative path)
+    for every directory followed by ('file', relative path, full path) for
+    each of its files.
+    """
+    for root, dirs, files in os.walk(directory_path):
+        yield ('dir', os.path.relpath(root, directory_path))
+        for file in files:
+            file_path = os.path.join(root, file)
+            yield ('file', os.path.relpath(file_path, directory_path), file_path)
+
+
+def member_path(name):
+    """
+    Archive member name as a relative path ('' for the root), or None for
+    names that would leave the tree.
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if '..' in parts:
+        return None
+    return '/'.join(parts)
+
+
+def native_path(path):
+    # Archive paths use '/', walk events use os.sep like os.walk
+    return path.replace('/', os.sep) if path else "."
+
+
+def archive_walk(entries):
+    """
+    Walk events for a listed archive: entries are (path, is_dir, ref) in
+    archive order.  Like os.walk, each directory comes with its files,
+    then its subdirectories depth first.
+    """
+    tree = {'': ([], [])}   # directory -> (subdirectories, files)
+
+    def add_dir(path):
+        if path not in tree:
+            parent = posixpath.dirname(path)
+            add_dir(parent)
+            tree[path] = ([], [])
+            tree[parent][0].append(path)
+
+    seen = set()
+    for path, is_dir, ref in entries:
+        if is_dir:
+            add_dir(path)
+        elif path in seen or path in tree:
+            print("Warning: skipping duplicate archive member {}".format(path))
+        else:
+            seen.add(path)
+            add_dir(posixpath.dirname(path))
+            tree[posixpath.dirname(path)][1].append((path, ref))
+
+    pending = ['']
+    while pending:
+        path = pending.pop()
+        subdirs, files = tree[path]
+        yield ('dir', native_path(path))
+        for file_path, ref in files:
+            yield ('file', native_path(file_path), ref)
+        pending.extend(reversed(subdirs))
+
+
+def open_source(path):
+    """
+    The content source for a directory, .zip or .tar(.gz/.bz2/.xz) path; a
+    source object is returned as is.
+    """
+    if not isinstance(path, str):
+        return path
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    if not os.path.isfile(path):
+        raise ValueError("Content source {} does not exist".format(path))
+    if zipfile.is_zipfile(path):
+        return ZipSource(path)
+    if tarfile.is_tarfile(path):
+        return TarSource(path)
+    raise ValueError("Content source {} is neither a directory nor a zip or tar archive".format(path))
+
+
+class DirectorySource(object):
+    """
+    A content tree on disk; refs are the files' full paths.
+    """
+    sequential = False
+
+    def __init__(self, directory_path):
+        self.path = directory_path
+
+    def events(self):
+        return walk_tree(self.path)
+
+    def listing(self):
+        """
+        Lines describing the tree for the input fingerprint (build_cache.py):
+        the listing in walk order with sizes and mtimes.
+        """
+        for root, dirs, files in os.walk(self.path):
+            yield "D\0{}\n".format(os.path.relpath(root, self.path))
+            for file in files:
+                st = os.stat(os.path.join(root, file))
+                yield "F\0{}\0{}\0{}\n".format(file, st.st_size, st.st_mtime_ns)
+
+    def size(self, ref):
+        return os.path.getsize(ref)
+
+    def locate(self, ref):
+        return ref, 0
+
+    def iter_chunks(self, ref, chunk_size):
+        with open(ref, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def read_ranges(self, ref, ranges):
+        with open(ref, 'rb') as f:
+            for offset, length in ranges:
+                f.seek(offset)
+                yield f.read(length)
+
+    def close(self):
+        pass
+
+
+class ArchiveSource(object):
+    """
+    Common part of the archive sources: the archive file's size and mtime
+    stand for its whole content in the input fingerprint.
+    """
+    sequential = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def listing(self):
+        st = os.stat(self.path)
+        yield "A\0{}\0{}\0{}\n".format(os.path.basename(self.path), st.st_size, st.st_mtime_ns)
+
+    def locate(self, ref):
+        return None
+
+
+class ZipSource(ArchiveSource):
+    """
+    A .zip archive; refs are ZipInfo.  Members are inflated as they are
+    read, and several members can be read at once from separate threads.
+    """
+
+    def __init__(self, path):
+        ArchiveSource.__init__(self, path)
+        self.zip = zipfile.ZipFile(path)
+
+    def events(self):
+        entries = []
+        for info in self.zip.infolist():
+            path = member_path(info.filename)
+            if path is None:
+                print("Warning: skipping archive member outside the tree: {}".format(info.filename))
+            elif path:
+                entries.append((path, info.is_dir(), info))
+        return archive_walk(entries)
+
+    def size(self, ref):
+        return ref.file_size
+
+    def iter_chunks(self, ref, chunk_size):
+        with self.zip.open(ref) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def read_ranges(self, ref, ranges):
+        with self.zip.open(ref) as f:
+            for offset, length in ranges:
+                f.seek(offset)
+                yield f.read(length)
+
+    def close(self):
+        self.zip.close()
+
+
+class TarSource(ArchiveSource):
+    """
+    A tar archive; refs are TarInfo.  An uncompressed tar is listed from its
+    headers and its members are read straight from their data offsets with
+    their own file handles, so they read in parallel like plain files.  A
+    compressed tar is read as a stream: members come in archive order and
+    the data of each is only readable while its event is current.
+    Links and special files are skipped.
+    """
+
+    def __init__(self, path):
+        ArchiveSource.__init__(self, path)
+        try:
+            self.tar = tarfile.open(path, 'r:')
+        except tarfile.ReadError:
+            self.tar = tarfile.open(path, 'r|*')
+            self.sequential = True
+
+    def members(self):
+        for member in self.tar:
+            path = member_path(member.name)
+            if path is None:
+                print("Warning: skipping archive member outside the tree: {}".format(member.name))
+            elif not member.isdir() and not member.isreg():
+                print("Warning: skipping archive member that is not a regular file: {}".format(member.name))
+            elif member.issparse():
+                raise ValueError("Sparse archive member {} is not supported".format(member.name))
+            elif path:
+                yield path, member.isdir(), member
+
+    def events(self):
+        if not self.sequential:
+            return archive_walk(self.members())
+        return self.stream_events()
+
+    def stream_events(self):
+        # Directories are emitted as soon as the first member below them
+        # is seen, files in archive order
+        dirs = {''}
+        files = set()
+        yield ('dir', ".")
+        for path, is_dir, member in self.members():
+            parent = path if is_dir else posixpath.dirname(path)
+            missing = []
+            while parent not in dirs:
+                missing.append(parent)
+                parent = posixpath.dirname(parent)
+            for dir_path in reversed(missing):
+                dirs.add(dir_path)
+                yield ('dir', native_path(dir_path))
+            if is_dir:
+                continue
+            if path in files or path in dirs:
+                print("Warning: skipping duplicate archive member {}".format(path))
+                continue
+            files.add(path)
+            yield ('file', native_path(path), member)
+
+    def size(self, ref):
+        return ref.size
+
+    def locate(self, ref):
+        return None if self.sequential else (self.path, ref.offset_data)
+
+    def iter_chunks(self, ref, chunk_size):
+        if self.sequential:
+            f = self.tar.extractfile(ref)
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(ref.offset_data)
+            remaining = ref.size
+            while remaining:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError("{} ends inside member {}".format(self.path, ref.name))
+                remaining -= len(chunk)
+                yield chunk
+
+    def read_ranges(self, ref, ranges):
+        if self.sequential:
+            raise ValueError("{} is a compressed tar, its members can only be read in order".format(self.path))
+        with open(self.path, 'rb') as f:
+            for offset, length in ranges:
+                f.seek(ref.offset_data + offset)
+                yield f.read(max(0, min(length, ref.size - offset)))
+
+    def close(self):
+        self.tar.close()
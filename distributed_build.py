@@ -0,0 +1,308 @@
+##############################################################################
+# Distributed build: plan, parts, merge.
+#
+# Splits one build over several processes or hosts that see the content and
+# the output directory under the same paths (e.g. a shared filesystem):
+#
+#   python distributed_build.py plan <content> <app_id> <app version> <fingerprint> --parts=<n> [options]
+#       walks the tree once and writes <app_id>_<version>.plan: the build's
+#       inputs and options, the special flags and minfootprint of the
+#       working directory, and n contiguous file id ranges of about equal
+#       bytes (file ids and node numbers are those of the walk)
+#   python distributed_build.py part <plan file> <part number>
+#       reads, compresses and checksums the files of one range into
+#       <base>.part<first>.dat and <base>.part<first>.payloads
+#   python distributed_build.py merge <plan file>
+#       concatenates the parts into <base>.dat and writes the .manifest,
+#       .index and .checksums (and the requested sidecars), byte-identical
+#       to a single-machine build with the same options
+#   python distributed_build.py local <content> <app_id> <app version> <fingerprint> --parts=<n> [options]
+#       all of it on this host, with each part in a process of its own
+#
+# The parts and the merge re-walk the tree and refuse to run when its input
+# fingerprint (listing, sizes, mtimes, options, generator version; see
+# build_cache.py) differs from the plan's, so every step numbers the files
+# the same way.  Parts can run in any order and be re-run on failure.
+##############################################################################
+
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+
+import threaded_manifest_generator
+from build_cache import file_digest, input_fingerprint
+from checksum_engine import parse_granularity
+from content_source import open_source
+from threaded_manifest_generator import (expand_wildcards_in_minfootprint, generate_gcf, load_special_flags,
+                                         open_output, parse_cli_options, parse_minfootprint_file, parse_size)
+
+PLAN_VERSION = 1
+
+# Per-file cost in bytes when balancing the parts, so many small files weigh
+# more than their size
+FILE_OVERHEAD = 0x1000
+
+
+def partition(sizes, parts):
+    """
+    Split file ids 1..len(sizes) into at most `parts` contiguous (first,
+    last) ranges of about the same bytes.
+    """
+    weights = [size + FILE_OVERHEAD for size in sizes]
+    total = sum(weights)
+    ranges = []
+    first = 1
+    done = 0
+    for file_id, weight in enumerate(weights, 1):
+        done += weight
+        if len(ranges) < parts - 1 and done * parts >= total * (len(ranges) + 1):
+            ranges.append((first, file_id))
+            first = file_id + 1
+    if first <= len(weights) or not ranges:
+        ranges.append((first, len(weights)))
+    return ranges
+
+
+def base_name(plan):
+    return os.path.join(plan['output_dir'], "{}_{}".format(plan['app_id'], plan['app_version']))
+
+
+def plan_key(source, plan):
+    return input_fingerprint(source, plan['app_id'], plan['app_version'], plan['fingerprint'], options={
+        'generator': file_digest(threaded_manifest_generator.__file__),
+        'options': sorted(plan['options'].items()),
+        'special_flags': sorted(plan['special_flags'].items()),
+        'minfootprint': sorted(plan['minfootprint']),
+    })
+
+
+def write_pickle(filename, value):
+    # Written in full before it replaces an earlier file of the same name
+    temp_fname = filename + ".tmp"
+    with open(temp_fname, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_fname, filename)
+
+
+def load_plan(plan_file):
+    with open(plan_file, 'rb') as f:
+        plan = pickle.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError("{} is not a build plan of this version".format(plan_file))
+    return plan
+
+
+def open_planned_source(plan):
+    """
+    The plan's content source, checked against the plan's fingerprint.
+    """
+    source = open_source(plan['content'])
+    if plan_key(source, plan) != plan['key']:
+        source.close()
+        raise ValueError("{} changed since the build was planned".format(plan['content']))
+    return source
+
+
+def plan_build(content, app_id, app_version, fingerprint, parts, output_dir=None, special_flags=None,
+               minfootprint=None, **options):
+    """
+    Walk the content and write the plan of a build in `parts` parts.
+    special_flags and minfootprint default to special_file_flags.ini and
+    minfootprint(_temp).txt of the working directory; the other options
+    are those of generate_gcf().  Returns the plan's filename.
+    """
+    if options.get('layout', 'walk') != 'walk' or options.get('compress') in ('auto', 'dict') or \
+            options.get('shards', 1) > 1 or options.get('sinks') or \
+            any(options.get(name) not in (None, False)
+                for name in ('pool_dir', 'shard_size', 'journal', 'cache_dir')):
+        raise ValueError("A distributed build needs the 'walk' layout, a single .dat and no cache, journal, sinks "
+                         "or compress='auto'/'dict'")
+    if special_flags is None:
+        special_flags = load_special_flags()
+    if minfootprint is None:
+        if os.path.isfile("minfootprint_temp.txt"):
+            minfootprint = parse_minfootprint_file("minfootprint_temp.txt")
+        else:
+            minfootprint = parse_minfootprint_file()
+    plan = {
+        'version': PLAN_VERSION,
+        'content': os.path.abspath(content),
+        'app_id': app_id,
+        'app_version': app_version,
+        'fingerprint': fingerprint,
+        'output_dir': os.path.abspath(output_dir or '.'),
+        'options': options,
+        'special_flags': dict(special_flags),
+        'minfootprint': list(minfootprint),
+    }
+    source = open_source(content)
+    try:
+        if source.sequential:
+            raise ValueError("{} can only be read in order, it cannot be built in parts".format(content))
+        plan['key'] = plan_key(source, plan)
+        sizes = [source.size(event[2]) for event in source.events() if event[0] == 'file']
+    finally:
+        source.close()
+    plan['parts'] = partition(sizes, parts)
+
+    plan_fname = base_name(plan) + ".plan"
+    write_pickle(plan_fname, plan)
+    print("Planned {} files ({} bytes) in {} parts:".format(len(sizes), sum(sizes), len(plan['parts'])))
+    for number, (first, last) in enumerate(plan['parts']):
+        print("  part {}: files {}-{}, {} bytes".format(number, first, last, sum(sizes[first - 1:last])))
+    print("Plan written to {}".format(plan_fname))
+    return plan_fname
+
+
+def build_part(plan_file, number):
+    """
+    Build one part of a plan: its .dat fragment and its payload records.
+    Returns the two filenames.
+    """
+    plan = load_plan(plan_file)
+    first, last = plan['parts'][number]
+    source = open_planned_source(plan)
+    records = {}
+    try:
+        generate_gcf(source, plan['app_id'], plan['app_version'], plan['fingerprint'],
+                     output_dir=plan['output_dir'], special_flags=plan['special_flags'],
+                     minfootprint=plan['minfootprint'], part=(first, last), payload_records=records,
+                     **plan['options'])
+    finally:
+        source.close()
+    if set(records) != set(range(first, last + 1)):
+        raise ValueError("Part {} wrote {} payloads instead of {}".format(number, len(records), last - first + 1))
+
+    part_fname = "{}.part{}".format(base_name(plan), first)
+    write_pickle(part_fname + ".payloads", {'key': plan['key'], 'part': (first, last), 'records': records})
+    return [part_fname + ".dat", part_fname + ".payloads"]
+
+
+def merge_build(plan_file, keep_parts=False):
+    """
+    Stitch the parts of a plan into the final outputs, then remove the
+    parts (unless keep_parts).  Returns the list of written output files.
+    """
+    plan = load_plan(plan_file)
+    base_fname = base_name(plan)
+    part_fnames = ["{}.part{}".format(base_fname, first) for first, last in plan['parts']]
+    source = open_planned_source(plan)
+    try:
+        records = {}
+        for part_fname, (first, last) in zip(part_fnames, plan['parts']):
+            if not os.path.exists(part_fname + ".payloads"):
+                raise ValueError("Part {}-{} has not been built ({}.payloads is missing)".format(
+                    first, last, part_fname))
+            with open(part_fname + ".payloads", 'rb') as f:
+                part = pickle.load(f)
+            if part['key'] != plan['key'] or part['part'] != (first, last):
+                raise ValueError("{}.payloads belongs to another plan".format(part_fname))
+            records.update(part['records'])
+
+        # The parts' payloads follow each other in the .dat: shift their
+        # offsets (and padding counts) by everything before them
+        padding = 0
+        with open_output(base_fname + ".dat") as dat:
+            for part_fname, (first, last) in zip(part_fnames, plan['parts']):
+                offset = dat.tell()
+                payload_bytes = 0
+                for file_id in range(first, last + 1):
+                    payload = records[file_id]
+                    payload['offset'] += offset
+                    payload['end'] += offset
+                    payload['padding_bytes'] += padding
+                    payload_bytes += payload['length']
+                with open(part_fname + ".dat", 'rb') as f:
+                    shutil.copyfileobj(f, dat, 0x100000)
+                padding += dat.tell() - offset - payload_bytes
+        print("Merged {} parts into {}.dat ({} bytes)".format(len(part_fnames), base_fname,
+                                                            os.path.getsize(base_fname + ".dat")))
+
+        outputs = generate_gcf(source, plan['app_id'], plan['app_version'], plan['fingerprint'],
+                               output_dir=plan['output_dir'], special_flags=plan['special_flags'],
+                               minfootprint=plan['minfootprint'], payload_records=records, **plan['options'])
+    finally:
+        source.close()
+
+    if not keep_parts:
+        for part_fname in part_fnames:
+            os.remove(part_fname + ".dat")
+            os.remove(part_fname + ".payloads")
+    return outputs
+
+
+def build_local(content, app_id, app_version, fingerprint, parts, output_dir=None, **options):
+    """
+    Plan, build every part in a process of its own and merge, on this host.
+    """
+    plan_fname = plan_build(content, app_id, app_version, fingerprint, parts, output_dir, **options)
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "part", plan_fname, str(number)])
+                 for number in range(len(load_plan(plan_fname)['parts']))]
+    failed = [number for number, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError("Parts {} failed".format(", ".join(str(number) for number in failed)))
+    return merge_build(plan_fname)
+
+
+if __name__ == "__main__":
+    sys.argv, cli_options = parse_cli_options(sys.argv)
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if not (command in ("plan", "local") and len(sys.argv) >= 6) and \
+            not (command == "part" and len(sys.argv) >= 4) and not (command == "merge" and len(sys.argv) >= 3):
+        print("Usage: python distributed_build.py plan <directory_path> <app_id> <app version> <fingerprint> --parts=<n> [options]")
+        print("       python distributed_build.py part <plan file> <part number>")
+        print("       python distributed_build.py merge <plan file> [--keep-parts]")
+        print("       python distributed_build.py local <directory_path> <app_id> <app version> <fingerprint> --parts=<n> [options]")
+        print("Options:")
+        print(" --parts=<n>            Number of parts (default 4)")
+        print(" --output-dir=<dir>     Where the plan, the parts and the outputs go (default: the working directory)")
+        print(" --checksum-granularity=<0x10000|0x8000|file>")
+        print(" --compress=<off|on>    zlib-compress every file (--compress-level=<n>, default 6)")
+        print(" --strong-hash=<sha1|sha256|blake2b|...>")
+        print(" --align=<size>         Start every file payload in the .dat on a multiple of <size> (--align-chunks: every chunk)")
+        print(" --path-index           Also write the .paths sidecar")
+        print(" --dedupe-names         Store each distinct name once in the manifest's filename table")
+        print(" --memory-limit=<size>  Memory-bounded build tables (see threaded_manifest_generator.py)")
+        print(" --split-size=<size>    Files of at least <size> are read in parallel block ranges (default 64M)")
+        sys.exit(1)
+
+    if command == "part":
+        build_part(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+    if command == "merge":
+        merge_build(sys.argv[2], keep_parts="keep_parts" in cli_options)
+        sys.exit(0)
+
+    build_options = {}
+    if "checksum_granularity" in cli_options:
+        build_options["checksum_granularity"] = parse_granularity(cli_options["checksum_granularity"])
+    if "compress" in cli_options:
+        build_options["compress"] = cli_options["compress"].lower()
+    if "compress_level" in cli_options:
+        build_options["compress_level"] = int(cli_options["compress_level"])
+    if "strong_hash" in cli_options:
+        build_options["strong_hash"] = cli_options["strong_hash"].lower()
+    if "align" in cli_options:
+        build_options["align"] = parse_size(cli_options["align"])
+    if "align_chunks" in cli_options:
+        build_options["align_chunks"] = True
+    if "path_index" in cli_options:
+        build_options["path_index"] = True
+    if "dedupe_names" in cli_options:
+        build_options["dedupe_names"] = True
+    if "memory_limit" in cli_options:
+        build_options["memory_limit"] = parse_size(cli_options["memory_limit"])
+    if "split_size" in cli_options:
+        build_options["split_size"] = parse_size(cli_options["split_size"])
+
+    directory_path = sys.argv[2]
+    if os.path.isdir(directory_path):
+        expand_wildcards_in_minfootprint(directory_path)
+    app_version = "".join(c for c in sys.argv[4] if c.isdigit())
+    run = plan_build if command == "plan" else build_local
+    run(directory_path, int(sys.argv[3], 16), app_version, sys.argv[5], int(cli_options.get("parts", 4)),
+        cli_options.get("output_dir"), **build_options)
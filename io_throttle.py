@@ -0,0 +1,216 @@
+##############################################################################
+# I/O rate limiting and low-priority builds.
+#
+# For builds on a host that is serving storages at the same time:
+#   - read and write bandwidth and I/O operations are capped with token
+#     buckets (a caller that overdraws a bucket sleeps until it is repaid)
+#   - with drop_cache the content that was read and the .dat that was
+#     written are dropped from the page cache (posix_fadvise DONTNEED) as
+#     the build goes, so they do not evict the served storages; written
+#     output is synced first every drop_window bytes, as dirty pages cannot
+#     be dropped
+#   - nice lowers the CPU (and on Linux, by default, the I/O) priority of
+#     the building thread and every thread it starts afterwards.  On Linux
+#     this is per thread and cannot be undone without privileges: run an
+#     in-process build (build_api.py) in a thread of its own.
+##############################################################################
+
+import os
+import threading
+import time
+
+DROP_WINDOW = 0x1000000
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket of `rate` tokens per second holding at most
+    `burst` (default: one second's worth).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def consume(self, amount):
+        """
+        Take amount tokens, sleeping as long as the bucket is in debt.
+        Returns the time slept.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def sync_data(fd):
+    if hasattr(os, 'fdatasync'):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def drop_cache(fd, offset=0, length=0):
+    """
+    Drop a file range from the page cache (length 0: to the end), where
+    posix_fadvise is available.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+
+class IOThrottle(object):
+    """
+    The I/O budget of one build.  read_rate / write_rate are bytes per
+    second, iops read and write calls (chunks) per second; None is
+    unlimited.
+    """
+
+    def __init__(self, read_rate=None, write_rate=None, iops=None, drop_cache=False, nice=None,
+                 drop_window=DROP_WINDOW):
+        self.read_bucket = TokenBucket(read_rate) if read_rate else None
+        self.write_bucket = TokenBucket(write_rate) if write_rate else None
+        self.ops_bucket = TokenBucket(iops) if iops else None
+        self.drop_cache = drop_cache
+        self.nice = nice
+        self.drop_window = drop_window
+        self.lock = threading.Lock()
+        self.written_files = {}     # fd -> [written, dropped up to]
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def lower_priority(self):
+        if self.nice:
+            try:
+                os.nice(self.nice)
+            except (AttributeError, OSError) as e:
+                print("Warning: could not lower the build priority: {}".format(e))
+
+    def read(self, length):
+        with self.lock:
+            self.bytes_read += length
+        if self.ops_bucket is not None:
+            self.ops_bucket.consume(1)
+        if self.read_bucket is not None:
+            self.read_bucket.consume(length)
+
+    def write(self, length):
+        with self.lock:
+            self.bytes_written += length
+        if self.ops_bucket is not None:
+            self.ops_bucket.consume(1)
+        if self.write_bucket is not None:
+            self.write_bucket.consume(length)
+
+    def consumed(self, fd, offset, length):
+        """
+        With drop_cache, drop a range of input that was read and is not
+        needed again.
+        """
+        if self.drop_cache:
+            drop_cache(fd, offset, length)
+
+    def wrote(self, f, length):
+        """
+        Account for length bytes appended to the open output f, and with
+        drop_cache sync and drop every full drop_window of it.
+        """
+        if not self.drop_cache:
+            return
+        fd = f.fileno()
+        with self.lock:
+            state = self.written_files.setdefault(fd, [f.tell() - length] * 2)
+            state[0] += length
+            if state[0] - state[1] < self.drop_window:
+                return
+            start, end = state[1], state[0]
+            state[1] = end
+        f.flush()
+        sync_data(fd)
+        drop_cache(fd, start, end - start)
+
+    def closing(self, f):
+        """
+        Drop what is left of an output that is about to be closed.
+        """
+        if not self.drop_cache:
+            return
+        with self.lock:
+            state = self.written_files.pop(f.fileno(), None)
+        if state is not None:
+            f.flush()
+            sync_data(f.fileno())
+            drop_cache(f.fileno(), state[1], 0)
+
+    def throttled_seconds(self):
+        return sum(bucket.waited for bucket in (self.read_bucket, self.write_bucket, self.ops_bucket)
+                   if bucket is not None)
+
+    def print_summary(self, elapsed):
+        print("I/O throttle: {} bytes read, {} bytes written in {:.2f}s ({:.1f} / {:.1f} MB/s), {:.2f}s spent "
+              "waiting for the budget".format(self.bytes_read, self.bytes_written, elapsed,
+                                              self.bytes_read / 1048576.0 / elapsed if elapsed else 0.0,
+                                              self.bytes_written / 1048576.0 / elapsed if elapsed else 0.0,
+                                              self.throttled_seconds()))
+
+
+class ThrottledSource(object):
+    """
+    Wraps a content source (content_source.py) so that every chunk read
+    from it is charged to an IOThrottle, and with drop_cache the files it
+    can locate on disk leave the page cache once they are read.
+    """
+
+    def __init__(self, source, throttle):
+        self.source = source
+        self.throttle = throttle
+        self.sequential = source.sequential
+
+    def events(self):
+        return self.source.events()
+
+    def listing(self):
+        return self.source.listing()
+
+    def size(self, ref):
+        return self.source.size(ref)
+
+    def locate(self, ref):
+        return self.source.locate(ref)
+
+    def iter_chunks(self, ref, chunk_size):
+        location = self.source.locate(ref) if self.throttle.drop_cache else None
+        fd = os.open(location[0], os.O_RDONLY) if location is not None else None
+        try:
+            consumed = 0
+            dropped = 0
+            for chunk in self.source.iter_chunks(ref, chunk_size):
+                self.throttle.read(len(chunk))
+                consumed += len(chunk)
+                yield chunk
+                if fd is not None and consumed - dropped >= self.throttle.drop_window:
+                    self.throttle.consumed(fd, location[1] + dropped, consumed - dropped)
+                    dropped = consumed
+            if fd is not None and consumed > dropped:
+                self.throttle.consumed(fd, location[1] + dropped, consumed - dropped)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def read_ranges(self, ref, ranges):
+        for data in self.source.read_ranges(ref, ranges):
+            self.throttle.read(len(data))
+            yield data
+
+    def close(self):
+        self.source.close()
@@ -0,0 +1,217 @@
+##############################################################################
+# Load-generation harness for storage serving.
+#
+# Simulates N concurrent clients downloading an application from a generated
+# storage and reports throughput and block/file latency percentiles, to
+# compare layouts, alignment, sharding and compression with numbers.
+#
+# Every client fetches whole files as a sequence of 0x8000 block requests
+# (like the Steam client does), in one of these access patterns:
+#   random       - files in random order
+#   sequential   - files in file id order (a full install)
+#   minfootprint - the manifest's copy table (minfootprint) files first,
+#                  then the rest in file id order (an application launch)
+# Blocks are read with pread straight from the .dat / shards / pack (see
+# storage_extract.StorageReader), or fetched over HTTP from a serving
+# endpoint given as a URL template, e.g.
+#   --url=http://127.0.0.1:8080/storage/{app_id}/{version}/{file_id}/{block}
+##############################################################################
+
+import math
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import urllib.request
+
+from storage_extract import StorageReader
+from threaded_manifest_generator import parse_cli_options
+
+BLOCK_SIZE = 0x8000
+PATTERNS = ("random", "sequential", "minfootprint")
+
+
+def read_manifest_info(manifest_fname):
+    """
+    (app id, app version, file count, file ids in copy table order) of a .manifest.
+    """
+    with open(manifest_fname, 'rb') as f:
+        data = f.read()
+    header = struct.unpack_from("<14I", data, 0)
+    app_id, app_version, node_count, file_count = header[1], header[2], header[3], header[4]
+    dirname_size, info1_count, copy_count = header[7], header[8], header[9]
+    copy_start = 0x38 + node_count * 0x1c + dirname_size + (info1_count + node_count) * 4
+    copy_nodes = struct.unpack_from("<{}I".format(copy_count), data, copy_start)
+    copy_files = [struct.unpack_from("<I", data, 0x38 + node * 0x1c + 8)[0] for node in copy_nodes]
+    return app_id, app_version, file_count, copy_files
+
+
+def file_blocks(reader, file_id):
+    """
+    The (source, offset, length) of every 0x8000 block of a file's payload.
+    """
+    blocks = []
+    for source, offset, length in reader.file_ranges(file_id):
+        for start in range(0, length, BLOCK_SIZE):
+            blocks.append((source, offset + start, min(BLOCK_SIZE, length - start)))
+    return blocks
+
+
+def access_order(pattern, file_ids, copy_files, rng):
+    if pattern == "random":
+        order = list(file_ids)
+        rng.shuffle(order)
+        return order
+    if pattern == "sequential":
+        return list(file_ids)
+    if pattern == "minfootprint":
+        known = set(file_ids)
+        first = [file_id for file_id in copy_files if file_id in known]
+        seen = set(first)
+        return first + [file_id for file_id in file_ids if file_id not in seen]
+    raise ValueError("Unknown access pattern: {}".format(pattern))
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)]
+
+
+class LoadTest(object):
+    """
+    One load test run against a storage (or an HTTP endpoint serving it).
+    """
+
+    def __init__(self, manifest_fname, index_fname, dat_fname, url=None):
+        self.app_id, self.app_version, self.file_count, self.copy_files = read_manifest_info(manifest_fname)
+        self.index_fname = index_fname
+        self.dat_fname = dat_fname
+        self.url = url
+        reader = StorageReader.from_files(index_fname, dat_fname)
+        self.index_data = reader.index_data
+        self.blocks = {file_id: file_blocks(reader, file_id) for file_id in sorted(self.index_data)}
+        self.sources = sorted({block[0] for blocks in self.blocks.values() for block in blocks}, key=str)
+        self.source_paths = {source: reader.source_path(source) for source in self.sources}
+        reader.close()
+
+    def drop_cache(self):
+        """
+        Ask the kernel to drop the storage from the page cache, for cold runs.
+        """
+        if not hasattr(os, 'posix_fadvise'):
+            print("Warning: posix_fadvise is not available, the page cache is not dropped")
+            return
+        for path in self.source_paths.values():
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+    def fetch(self, fds, file_id, block_index, block):
+        if self.url is not None:
+            url = self.url.format(app_id=self.app_id, version=self.app_version, file_id=file_id, block=block_index)
+            with urllib.request.urlopen(url) as response:
+                return len(response.read())
+        source, offset, length = block
+        if hasattr(os, 'pread'):
+            return len(os.pread(fds[source], length, offset))
+        os.lseek(fds[source], offset, os.SEEK_SET)
+        return len(os.read(fds[source], length))
+
+    def client(self, order, deadline, result):
+        fds = {} if self.url is not None else \
+            {source: os.open(path, os.O_RDONLY) for source, path in self.source_paths.items()}
+        try:
+            # One pass over the files, or passes until the deadline
+            while True:
+                for file_id in order:
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return
+                    file_start = time.perf_counter()
+                    for block_index, block in enumerate(self.blocks[file_id]):
+                        start = time.perf_counter()
+                        result['bytes'] += self.fetch(fds, file_id, block_index, block)
+                        result['block_latencies'].append(time.perf_counter() - start)
+                    result['file_latencies'].append(time.perf_counter() - file_start)
+                if deadline is None or not order:
+                    return
+        except Exception as e:
+            result['errors'].append("{}: {}".format(type(e).__name__, e))
+        finally:
+            for fd in fds.values():
+                os.close(fd)
+
+    def run(self, pattern, clients, duration=None, seed=0):
+        file_ids = sorted(self.index_data)
+        rng = random.Random(seed)
+        results = [{'bytes': 0, 'block_latencies': [], 'file_latencies': [], 'errors': []} for _ in range(clients)]
+        orders = [access_order(pattern, file_ids, self.copy_files, rng) for _ in range(clients)]
+        start = time.perf_counter()
+        deadline = start + duration if duration else None
+        threads = [threading.Thread(target=self.client, args=(orders[i], deadline, results[i]))
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        block_latencies = sorted(latency for result in results for latency in result['block_latencies'])
+        file_latencies = sorted(latency for result in results for latency in result['file_latencies'])
+        total_bytes = sum(result['bytes'] for result in results)
+        return {
+            'pattern': pattern,
+            'clients': clients,
+            'elapsed': elapsed,
+            'bytes': total_bytes,
+            'blocks': len(block_latencies),
+            'files': len(file_latencies),
+            'throughput': total_bytes / elapsed if elapsed else 0.0,
+            'block_latency': [percentile(block_latencies, p) for p in (50, 95, 99)],
+            'file_latency': [percentile(file_latencies, p) for p in (50, 95, 99)],
+            'errors': [error for result in results for error in result['errors']],
+        }
+
+
+def print_report(report):
+    print("Pattern {pattern}, {clients} clients: {files} files / {blocks} blocks, {mb:.1f} MB in {elapsed:.2f}s".format(
+        mb=report['bytes'] / 1048576.0, **report))
+    print("  Throughput: {:.1f} MB/s, {:.0f} blocks/s".format(
+        report['throughput'] / 1048576.0, report['blocks'] / report['elapsed'] if report['elapsed'] else 0.0))
+    print("  Block latency p50/p95/p99: {:.3f} / {:.3f} / {:.3f} ms".format(
+        *[latency * 1000 for latency in report['block_latency']]))
+    print("  File latency  p50/p95/p99: {:.3f} / {:.3f} / {:.3f} ms".format(
+        *[latency * 1000 for latency in report['file_latency']]))
+    if report['errors']:
+        print("  {} client errors, first: {}".format(len(report['errors']), report['errors'][0]))
+
+
+if __name__ == "__main__":
+    args, options = parse_cli_options(sys.argv[1:])
+    if len(args) != 3:
+        print("Usage: python load_test.py <manifest_file> <index_file> <dat_file> [options]")
+        print("Options:")
+        print(" --clients=<n>          Concurrent clients (default 16)")
+        print(" --pattern=<random|sequential|minfootprint|all>  Access pattern (default all)")
+        print(" --duration=<seconds>   Keep clients fetching for this long (default: one pass over every file)")
+        print(" --cold                 Drop the storage from the page cache before every run")
+        print(" --url=<template>       Fetch blocks over HTTP instead of reading the .dat, e.g.")
+        print("                        http://127.0.0.1:8080/storage/{app_id}/{version}/{file_id}/{block}")
+        print(" --seed=<n>             Random seed for the random pattern (default 0)")
+        sys.exit(1)
+
+    test = LoadTest(args[0], args[1], args[2], url=options.get("url"))
+    pattern = options.get("pattern", "all")
+    for name in (PATTERNS if pattern == "all" else (pattern,)):
+        if "cold" in options and test.url is None:
+            test.drop_cache()
+        print_report(test.run(name, int(options.get("clients", 16)),
+                              float(options["duration"]) if "duration" in options else None,
+                              int(options.get("seed", 0))))
@@ -0,0 +1,246 @@
+##############################################################################
+# Structural .manifest validator.
+#
+# Checks a generated manifest before it is shipped, in one linear pass:
+#   - header totals: manif_totalsize against the section sizes and the file
+#     size, node count, dirnamesize, copy count
+#   - the fingerprint and the adler32 at 0x30
+#   - parent / next / child links: every node is reached exactly once by
+#     walking the child chains from the root (no cycles, no orphans, no
+#     shared siblings), lists the right parent and matches its child count
+#   - name offsets inside the filename table, NUL terminated and at the
+#     start of a name (nodes may share one, see --dedupe-names)
+#   - file ids unique and in 1..file count
+#   - copy table entries referencing file nodes
+# The manifest is mmapped and the node table read as one array('I'), so a
+# 1M-node manifest validates in about a second.
+#
+# read_manifest_paths() reads a manifest back into the relative path of
+# every node, e.g. to compare two builds of the same tree.
+#
+# Usage: python manifest_validator.py <manifest_file> [more manifests...]
+#        python manifest_validator.py --paths <manifest_file>
+##############################################################################
+
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+
+NO_INDEX = 0xffffffff
+MAX_REPORTED = 20
+
+
+class ManifestErrors(object):
+    """
+    Collects validation errors, keeping the first MAX_REPORTED of each kind.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.messages = []
+
+    def add(self, kind, message):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if self.counts[kind] <= MAX_REPORTED:
+            self.messages.append("{}: {}".format(kind, message))
+
+    def __bool__(self):
+        return bool(self.counts)
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+def read_uint32_array(data, offset, count):
+    values = array('I')
+    values.frombytes(data[offset:offset + count * 4])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def validate_manifest(filename):
+    """
+    Validate one manifest.  Returns (ManifestErrors, header dict).
+    """
+    errors = ManifestErrors()
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return errors, _validate(data, errors)
+    finally:
+        data.close()
+
+
+def _validate(data, errors):
+    if len(data) < 0x38:
+        errors.add("header", "file is {} bytes, shorter than the 0x38 byte header".format(len(data)))
+        return {}
+
+    fields = struct.unpack_from("<14I", data, 0)
+    field_names = ("version", "app_id", "app_version", "node_count", "file_count", "compressed_block_size",
+                   "total_size", "dirname_size", "info1_count", "copy_count", "local_count", "unknown",
+                   "fingerprint", "checksum")
+    header = dict(zip(field_names, fields))
+    node_count = header["node_count"]
+    dirname_size = header["dirname_size"]
+
+    # Header totals
+    if header["version"] != 3:
+        errors.add("header", "manifest version {} (expected 3)".format(header["version"]))
+    nodes_start = 0x38
+    names_start = nodes_start + node_count * 0x1c
+    hash_start = names_start + dirname_size
+    copy_start = hash_start + (header["info1_count"] + node_count) * 4
+    local_start = copy_start + header["copy_count"] * 4
+    expected_size = local_start + header["local_count"] * 4
+    if header["total_size"] != expected_size:
+        errors.add("header", "manif_totalsize is {:#x} but the sections add up to {:#x}".format(
+            header["total_size"], expected_size))
+    if len(data) != header["total_size"]:
+        errors.add("header", "file is {:#x} bytes but manif_totalsize is {:#x}".format(len(data), header["total_size"]))
+    if node_count == 0:
+        errors.add("header", "no nodes (the root directory is missing)")
+    if dirname_size % 4:
+        errors.add("header", "dirnamesize {:#x} is not a multiple of 4".format(dirname_size))
+    if len(data) < local_start:
+        errors.add("header", "file ends inside the sections the header describes")
+        return header
+
+    # Fingerprint and checksum: adler32 (seed 0) of the manifest with 0x30..0x38 zeroed
+    if data[0x30:0x34] == b"\0\0\0\0":
+        errors.add("checksum", "fingerprint at 0x30 is empty")
+    adler = zlib.adler32(data[:0x30], 0)
+    adler = zlib.adler32(b"\0" * 8, adler)
+    adler = zlib.adler32(memoryview(data)[0x38:], adler) & 0xFFFFFFFF
+    if adler != header["checksum"]:
+        errors.add("checksum", "adler32 at 0x34 is {:#010x}, content gives {:#010x}".format(header["checksum"], adler))
+    if not node_count:
+        return header
+
+    # Node table as columns: name offset, child count, file id, flags, parent, next, child
+    nodes = read_uint32_array(data, nodes_start, node_count * 7)
+    name_offsets, child_counts, file_ids = nodes[0::7], nodes[1::7], nodes[2::7]
+    parents, nexts, children = nodes[4::7], nodes[5::7], nodes[6::7]
+    del nodes
+
+    if parents[0] != NO_INDEX:
+        errors.add("links", "root node has parent {}".format(parents[0]))
+    if file_ids[0] != NO_INDEX:
+        errors.add("links", "root node is not a directory")
+
+    # Walk every directory's child chain from the root, once per node
+    visited = bytearray(node_count)
+    visited[0] = 1
+    pending = [0]
+    while pending:
+        dir_index = pending.pop()
+        count = 0
+        child = children[dir_index]
+        while child:
+            if child >= node_count:
+                errors.add("links", "node {} links to node {} past the node count".format(dir_index, child))
+                break
+            if visited[child]:
+                errors.add("links", "node {} is reached twice (cycle or shared sibling chain)".format(child))
+                break
+            visited[child] = 1
+            count += 1
+            if parents[child] != dir_index:
+                errors.add("links", "node {} is in the child list of {} but lists parent {}".format(
+                    child, dir_index, parents[child]))
+            if file_ids[child] == NO_INDEX:
+                pending.append(child)
+            elif children[child]:
+                errors.add("links", "file node {} has a child index {}".format(child, children[child]))
+            child = nexts[child]
+        if count != child_counts[dir_index]:
+            errors.add("links", "directory {} has child count {} but {} children are linked".format(
+                dir_index, child_counts[dir_index], count))
+    unreached = node_count - sum(visited)
+    if unreached:
+        errors.add("links", "{} nodes are not reachable from the root, first: {}".format(
+            unreached, visited.index(0)))
+
+    # Name offsets, and file ids
+    names = data[names_start:hash_start]
+    file_count = 0
+    seen_ids = bytearray(header["file_count"] + 1)
+    for index in range(node_count):
+        offset = name_offsets[index]
+        if offset >= dirname_size or names.find(b"\0", offset) < 0:
+            errors.add("names", "node {} name offset {:#x} is outside the filename table".format(index, offset))
+        elif offset and names[offset - 1]:
+            errors.add("names", "node {} name offset {:#x} points inside another name".format(index, offset))
+        file_id = file_ids[index]
+        if file_id == NO_INDEX:
+            continue
+        file_count += 1
+        if not 1 <= file_id <= header["file_count"]:
+            errors.add("file ids", "node {} has file id {} outside 1..{}".format(index, file_id, header["file_count"]))
+        elif seen_ids[file_id]:
+            errors.add("file ids", "file id {} is used twice (node {})".format(file_id, index))
+        else:
+            seen_ids[file_id] = 1
+    if file_count != header["file_count"]:
+        errors.add("header", "file count is {} but {} file nodes exist".format(header["file_count"], file_count))
+
+    # Copy table
+    copy_nodes = read_uint32_array(data, copy_start, header["copy_count"])
+    if len(set(copy_nodes)) != len(copy_nodes):
+        errors.add("copy table", "{} duplicate entries".format(len(copy_nodes) - len(set(copy_nodes))))
+    for node in copy_nodes:
+        if node >= node_count:
+            errors.add("copy table", "entry {} is past the node count".format(node))
+        elif file_ids[node] == NO_INDEX:
+            errors.add("copy table", "entry {} is a directory".format(node))
+
+    return header
+
+
+def read_manifest_paths(filename, sep="/"):
+    """
+    Read a (valid) manifest back into [(node index, relative path, file id)]
+    in node order, the root being ''; file id is None for directories.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    node_count, dirname_size = struct.unpack_from("<I", data, 12)[0], struct.unpack_from("<I", data, 28)[0]
+    names_start = 0x38 + node_count * 0x1c
+    names = data[names_start:names_start + dirname_size]
+    nodes = read_uint32_array(data, 0x38, node_count * 7)
+    paths = []
+    for index in range(node_count):
+        offset, file_id, parent = nodes[index * 7], nodes[index * 7 + 2], nodes[index * 7 + 4]
+        name = names[offset:names.index(b"\0", offset)].decode("utf-8", "surrogateescape")
+        # Directories come before their children, so the parent's path is known
+        path = name if parent in (NO_INDEX, 0) else paths[parent][1] + sep + name
+        paths.append((index, path if parent != NO_INDEX else "", None if file_id == NO_INDEX else file_id))
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python manifest_validator.py <manifest_file> [more manifests...]")
+        print("       python manifest_validator.py --paths <manifest_file>")
+        sys.exit(1)
+
+    if sys.argv[1] == "--paths":
+        for index, path, file_id in read_manifest_paths(sys.argv[2]):
+            print("{}\t{}\t{}".format(index, "-" if file_id is None else file_id, path))
+        sys.exit(0)
+
+    failed = False
+    for manifest_fname in sys.argv[1:]:
+        errors, header = validate_manifest(manifest_fname)
+        if errors:
+            failed = True
+            print("{}: {} errors".format(manifest_fname, errors.total()))
+            for message in errors.messages:
+                print("  " + message)
+        else:
+            print("{}: OK ({} nodes, {} files, {} copy table entries)".format(
+                manifest_fname, header["node_count"], header["file_count"], header["copy_count"]))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,142 @@
+##############################################################################
+# Sorted path -> file id sidecar (.paths) for fast name resolution.
+#
+# Layout (little-endian):
+#   header   <4sIII  magic b'PIDX', version 1, entry count, path blob size
+#   records  <IIIIIIQQQ per file, sorted by normalized path:
+#            path offset, path length (into the blob), node index, file id,
+#            shard, flags, file size, .dat offset, stored length
+#   blob     the normalized paths (utf-8), back to back
+#
+# Paths are normalized to lower case with '/' separators, so lookups are
+# case-insensitive like the Windows clients.  The file is used through mmap
+# with binary search: a lookup touches log2(n) records and never parses the
+# manifest.
+##############################################################################
+
+import bisect
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b'PIDX'
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+RECORD = struct.Struct("<IIIIIIQQQ")
+FIELDS = ('path', 'node_index', 'file_id', 'shard', 'flags', 'size', 'offset', 'length')
+
+
+def normalize_path(path):
+    """
+    Normalized form of a relative path: '/' separators, lower case, no leading slash.
+    """
+    return path.replace('\\', '/').replace(os.sep, '/').lstrip('/').lower()
+
+
+def write_path_index(filename, entries):
+    """
+    Write a .paths file from (relative path, node index, file id, shard,
+    flags, size, offset, length) tuples in any order.  The file is replaced
+    atomically, so readers that still have the old one mapped are unaffected.
+    """
+    keyed = sorted((normalize_path(entry[0]).encode('utf-8'),) + tuple(entry[1:]) for entry in entries)
+    blob_size = sum(len(entry[0]) for entry in keyed)
+    temp_fname = filename + ".tmp"
+    with open(temp_fname, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(keyed), blob_size))
+        path_offset = 0
+        for entry in keyed:
+            f.write(RECORD.pack(path_offset, len(entry[0]), *entry[1:]))
+            path_offset += len(entry[0])
+        for entry in keyed:
+            f.write(entry[0])
+    os.replace(temp_fname, filename)
+
+
+class _SortedPaths(object):
+    """
+    Sequence view of the normalized paths, for bisect.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, i):
+        return self.index.path_bytes(i)
+
+
+class PathIndex(object):
+    """
+    Memory-mapped reader of a .paths file.
+    lookup() returns a dict with the FIELDS of one file (or None) and
+    prefix() every file under a path prefix, in sorted order.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, blob_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} path index".format(filename, VERSION))
+        self.blob_start = HEADER.size + self.count * RECORD.size
+        if len(self.map) < self.blob_start + blob_size:
+            raise ValueError("{} is truncated".format(filename))
+        self.paths = _SortedPaths(self)
+
+    def __len__(self):
+        return self.count
+
+    def path_bytes(self, i):
+        path_offset, path_length = struct.unpack_from("<II", self.map, HEADER.size + i * RECORD.size)
+        start = self.blob_start + path_offset
+        return self.map[start:start + path_length]
+
+    def record(self, i):
+        values = RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size)
+        start = self.blob_start + values[0]
+        path = self.map[start:start + values[1]].decode('utf-8')
+        return dict(zip(FIELDS, (path,) + values[2:]))
+
+    def lookup(self, path):
+        key = normalize_path(path).encode('utf-8')
+        i = bisect.bisect_left(self.paths, key)
+        if i < self.count and self.path_bytes(i) == key:
+            return self.record(i)
+        return None
+
+    def prefix(self, prefix):
+        key = normalize_path(prefix).encode('utf-8')
+        i = bisect.bisect_left(self.paths, key)
+        while i < self.count:
+            path = self.path_bytes(i)
+            if not path.startswith(key):
+                return
+            yield self.record(i)
+            i += 1
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python path_index.py <paths_file> <relative path | prefix/*>")
+        sys.exit(1)
+
+    index = PathIndex(sys.argv[1])
+    query = sys.argv[2]
+    if query.endswith('*'):
+        for entry in index.prefix(query[:-1]):
+            print(entry)
+    else:
+        entry = index.lookup(query)
+        if entry is None:
+            print("Not found: {}".format(query))
+            sys.exit(1)
+        print(entry)
+    index.close()
@@ -7,9 +7,15 @@
 
 import os
 import struct
+import sys
 import zlib
 import pickle
 import re
+from array import array
+
+# The .checksums table helpers are shared with the generators one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from checksum_generator import uint32_le_bytes
 
 ##############################################################################
 # Extra function to handle the actual creation of the .checksums file.
@@ -45,9 +51,10 @@ def write_checksums_file(
 
     CHUNK_SIZE = 0x8000
 
-    # Let's build a dictionary for fileid => list of (chunkStart, chunkChecksum)
+    # Let's build a dictionary for fileid => array of chunk checksums,
     # because we apparently need to hold your hand through even the simplest tasks.
     checksums = {}
+    dat_view = memoryview(dat_file_data)
 
     # First, figure out all the chunk checksums for actual files
     for file_id in sorted(index_data.keys()):
@@ -55,65 +62,42 @@ def write_checksums_file(
         offset = info['offset']
         length = info['length']
 
-        file_bytes = dat_file_data[offset : offset + length]
-
-        # Build the chunk list for this file_id
-        chunk_list = []
-        chunk_start = 0
+        file_bytes = dat_view[offset : offset + length]
 
-        while chunk_start < length:
-            chunk_end = min(chunk_start + CHUNK_SIZE, length)
-            chunk_data = file_bytes[chunk_start : chunk_end]
-            chunk_crc = adler_crc32(chunk_data)
-            # Store (chunkOffset, chunkChecksum) ? the offset is optional, but we'll keep it
-            chunk_list.append((chunk_start, struct.pack("<I", chunk_crc)))
-            chunk_start += CHUNK_SIZE
+        # Build the chunk list for this file_id, kept as plain ints
+        chunk_list = array('I')
+        for chunk_start in range(0, length, CHUNK_SIZE):
+            chunk_list.append(adler_crc32(file_bytes[chunk_start : chunk_start + CHUNK_SIZE]))
 
         checksums[file_id] = chunk_list
 
     # Now find the max ID we encountered, so we know how far to iterate
     last_id = max(checksums.keys()) if checksums else 0
 
-    # We have to build the header, the index table, and the checksum table
-    # in a separate pass. That?s because we are incompetent if we try to do it
-    # in one go, right? Or is that just you?
     format_code    = 0x14893721
     dummy0         = 0
 
-    # We'll build them in separate bytearrays
-    indextable = bytearray()
-    checksumtable = bytearray()
-
-    # We'll keep track of how many checksums we have total, and a running offset
-    checksumoffset = 0
-
-    # For every fileid from 0 to last_id (inclusive),
-    # if the fileid doesn?t exist, we store 0,0
-    # else store the chunk count and offset, then the actual checksums
-    for fileid in range(last_id + 1):
-        if fileid not in checksums:
-            # no such file => write 0,0
-            indextable += struct.pack("<II", 0, 0)
-        else:
-            numchecksums = len(checksums[fileid])
-            # store the number of checksums for this fileid, plus offset
-            indextable += struct.pack("<II", numchecksums, checksumoffset)
-            # For each chunk, add the CRC to the table
-            for _, chksum_bytes in checksums[fileid]:
-                checksumtable += chksum_bytes
-            # bump our offset by however many we just wrote
-            checksumoffset += numchecksums
-
-    # Now the total number of fileIDs is last_id + 1
+    # The index table starts out zero-filled, so every fileid that doesn't
+    # exist is already (0, 0) and only real files need their entry set
     file_id_count = last_id + 1
-    checksum_count = checksumoffset  # total number of chunk checksums
-
-    out_buf = bytearray()
-    out_buf += struct.pack("<IIII", format_code, dummy0, file_id_count, checksum_count)
-    # Then we embed the fileId => (numchecksums, firstchecksumoffset) table
-    out_buf += indextable
-    # Then we append the actual checksums
-    out_buf += checksumtable
+    indextable = array('I', [0]) * (2 * file_id_count)
+    checksumtable = array('I')
+
+    for fileid, chunk_list in checksums.items():
+        # store the number of checksums for this fileid, plus offset
+        indextable[2 * fileid] = len(chunk_list)
+        indextable[2 * fileid + 1] = len(checksumtable)
+        checksumtable.extend(chunk_list)
+
+    checksum_count = len(checksumtable)  # total number of chunk checksums
+
+    out_buf = b"".join((
+        struct.pack("<IIII", format_code, dummy0, file_id_count, checksum_count),
+        # Then we embed the fileId => (numchecksums, firstchecksumoffset) table
+        uint32_le_bytes(indextable),
+        # Then we append the actual checksums
+        uint32_le_bytes(checksumtable),
+    ))
 
     checksums_filename = f"{app_id}_{app_version}.checksums"
     with open(checksums_filename, "wb") as f_chk:
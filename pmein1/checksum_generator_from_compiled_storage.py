@@ -6,6 +6,11 @@ import os
 import struct
 import pickle
 import zlib
+from array import array
+
+# The .checksums table helpers are shared with the generators one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from checksum_generator import uint32_le_bytes
 
 ##############################################################################
 # This script:
@@ -73,52 +78,36 @@ def generate_32kb_checksums(app_id: str, app_version: str):
     sorted_ids = sorted(index_data.keys())
     highest_id = max(sorted_ids)
 
-    checksums_dict = {}  # { file_id: [list_of_4byte_crc_structs] }
+    dat_view = memoryview(dat_content)
+
+    # 4) Zero-filled index table, so missing IDs from 0..highest_id are (0, 0),
+    #    and one flat array of checksums filled file by file
+    file_id_count = highest_id + 1
+    indextable = array('I', [0]) * (2 * file_id_count)
+    checksumtable = array('I')
 
     for file_id in sorted_ids:
         info = index_data[file_id]
         offset = info["offset"]
         length = info["length"]
 
-        file_bytes = dat_content[offset : offset + length]
+        file_bytes = dat_view[offset : offset + length]
 
-        chunk_list = []
+        indextable[2 * file_id + 1] = len(checksumtable)
         for chunk_start in range(0, length, CHUNK_SIZE):
-            chunk_end = min(chunk_start + CHUNK_SIZE, length)
-            chunk_data = file_bytes[chunk_start : chunk_end]
-            csum_val = adler_crc32(chunk_data)
-            csum_bytes = struct.pack("<I", csum_val)
-            chunk_list.append(csum_bytes)
+            checksumtable.append(adler_crc32(file_bytes[chunk_start : chunk_start + CHUNK_SIZE]))
+        indextable[2 * file_id] = len(checksumtable) - indextable[2 * file_id + 1]
 
-        checksums_dict[file_id] = chunk_list
-
-    # 4) Fill in missing IDs from 0..highest_id with zero
-    file_id_count = highest_id + 1
-    indextable = bytearray()
-    checksumtable = bytearray()
-    running_offset = 0
-
-    for fid in range(file_id_count):
-        if fid not in checksums_dict:
-            # missing => (0, 0)
-            indextable += struct.pack("<II", 0, 0)
-        else:
-            chunk_list = checksums_dict[fid]
-            chunk_count = len(chunk_list)
-            indextable += struct.pack("<II", chunk_count, running_offset)
-            for csum_b in chunk_list:
-                checksumtable += csum_b
-            running_offset += chunk_count
-
-    checksum_count = running_offset
+    checksum_count = len(checksumtable)
 
     # 5) Build the final .checksums file
     format_code = 0x14893721
     dummy0 = 0
-    out_buf = bytearray()
-    out_buf += struct.pack("<IIII", format_code, dummy0, file_id_count, checksum_count)
-    out_buf += indextable
-    out_buf += checksumtable
+    out_buf = b"".join((
+        struct.pack("<IIII", format_code, dummy0, file_id_count, checksum_count),
+        uint32_le_bytes(indextable),
+        uint32_le_bytes(checksumtable),
+    ))
 
     with open(checksums_file, "wb") as f_out:
         f_out.write(out_buf)
@@ -1,54 +1,215 @@
+import os
 import pickle
+import zlib
+from array import array
+from itertools import accumulate
+
+# Chunk size used when an index entry does not say otherwise
+DEFAULT_CHUNK_SIZE = 0x10000
+
+
+def shard_path(dat_file, shard):
+    """
+    Path of one shard of a sharded storage: shard 0 is the .dat itself,
+    shard N is <name>.N.dat next to it.
+    """
+    if not shard:
+        return dat_file
+    base, ext = os.path.splitext(dat_file)
+    return "{}.{}{}".format(base, shard, ext)
+
+
+def chunk_lengths(file_info):
+    """
+    Stored length of every chunk of a file.  Only compressed files carry
+    their lengths in the index; otherwise every chunk is chunk_size bytes
+    except the last.
+    """
+    if 'chunk_lengths' in file_info:
+        return file_info['chunk_lengths']
+    chunk_size = file_info.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    lengths = array('I', [chunk_size]) * (file_info['length'] // chunk_size)
+    if file_info['length'] % chunk_size:
+        lengths.append(file_info['length'] % chunk_size)
+    return lengths
+
+
+def chunk_offsets(file_info):
+    """
+    Position of every chunk of a file in its .dat (or shard).
+    """
+    lengths = chunk_lengths(file_info)
+    align = file_info.get('chunk_align')
+    steps = (length + (-length % align) for length in lengths) if align else lengths
+    return array('Q', accumulate(steps, initial=file_info['offset']))[:len(lengths)]
+
+
+def chunk_location(file_info, chunk_id):
+    """
+    (offset, length) of one chunk; O(1) when the chunk layout is implicit.
+    """
+    if 'chunk_lengths' in file_info:
+        return chunk_offsets(file_info)[chunk_id], chunk_lengths(file_info)[chunk_id]
+    chunk_size = file_info.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    align = file_info.get('chunk_align')
+    length = min(chunk_size, file_info['length'] - chunk_id * chunk_size)
+    if chunk_id < 0 or length <= 0:
+        raise IndexError("chunk {} out of range".format(chunk_id))
+    step = chunk_size + (-chunk_size % align) if align else chunk_size
+    return file_info['offset'] + chunk_id * step, length
+
+
+class StorageReader(object):
+    """
+    Reads file payloads back out of a storage, whatever layout the generator
+    used: plain, chunk-aligned (padding between chunks), sharded over
+    several .dat files or pooled in a shared pack (see storage_pool.py).
+    Files compressed against a shared dictionary need that dictionary
+    (zdict, the .zdict next to the index; see zlib_dictionary.py).
+    """
+
+    def __init__(self, index_data, dat_file, zdict=None):
+        self.index_data = index_data
+        self.dat_file = dat_file
+        self.zdict = zdict
+        self.handles = {}
+        self.chunk_tables = {}
+
+    @classmethod
+    def from_files(cls, index_file, dat_file):
+        with open(index_file, 'rb') as f:
+            index_data = pickle.load(f)
+        zdict = None
+        zdict_file = os.path.splitext(index_file)[0] + ".zdict"
+        if os.path.exists(zdict_file):
+            with open(zdict_file, 'rb') as f:
+                zdict = f.read()
+        return cls(index_data, dat_file, zdict)
+
+    def source_path(self, source):
+        """
+        Path of a payload source: a shard number, or the pack file of a
+        pooled storage (relative to the .dat's directory).
+        """
+        if isinstance(source, str):
+            return os.path.join(os.path.dirname(self.dat_file), source)
+        return shard_path(self.dat_file, source)
+
+    def _handle(self, source):
+        if source not in self.handles:
+            self.handles[source] = open(self.source_path(source), 'rb')
+        return self.handles[source]
+
+    def file_ranges(self, file_id):
+        """
+        The (source, offset, length) pieces that make up a file's payload, in
+        order; source is a shard number or a pack file (see source_path).
+        """
+        file_info = self.index_data[file_id]
+        source = file_info.get('pack', file_info.get('shard', 0))
+        if file_info.get('chunk_align'):
+            return [(source, offset, length)
+                    for offset, length in zip(chunk_offsets(file_info), chunk_lengths(file_info))]
+        return [(source, file_info['offset'], file_info['length'])]
+
+    def chunk_location(self, file_id, chunk_id):
+        """
+        (source, offset, length) of one chunk of a file.  Chunk tables that
+        have to be computed (compressed files) are built once and cached.
+        """
+        file_info = self.index_data[file_id]
+        source = file_info.get('pack', file_info.get('shard', 0))
+        if 'chunk_lengths' not in file_info:
+            return (source,) + chunk_location(file_info, chunk_id)
+        if file_id not in self.chunk_tables:
+            self.chunk_tables[file_id] = (chunk_offsets(file_info), chunk_lengths(file_info))
+        offsets, lengths = self.chunk_tables[file_id]
+        return source, offsets[chunk_id], lengths[chunk_id]
+
+    def read_chunk(self, file_id, chunk_id):
+        source, offset, length = self.chunk_location(file_id, chunk_id)
+        f = self._handle(source)
+        f.seek(offset)
+        return f.read(length)
+
+    def iter_file_blocks(self, file_id, read_size=0x100000):
+        """
+        Yield a file's stored payload in blocks of at most read_size bytes.
+        """
+        for source, offset, length in self.file_ranges(file_id):
+            f = self._handle(source)
+            f.seek(offset)
+            while length > 0:
+                block = f.read(min(read_size, length))
+                if not block:
+                    raise IOError("Storage is truncated: {} ends before offset {}".format(
+                        self.source_path(source), offset))
+                length -= len(block)
+                offset += len(block)
+                yield block
+
+    def read_file(self, file_id):
+        return b''.join(self.iter_file_blocks(file_id))
+
+    def iter_file_data(self, file_id):
+        """
+        Yield a file's original content: the stored blocks, or for files the
+        generator compressed (index entry 'compressed'), each chunk inflated,
+        with the shared dictionary when the entry has 'zdict'.
+        """
+        file_info = self.index_data[file_id]
+        if not file_info.get('compressed'):
+            yield from self.iter_file_blocks(file_id)
+            return
+        if 'zdict' in file_info:
+            if self.zdict is None or zlib.adler32(self.zdict) != file_info['zdict']:
+                raise ValueError("File {} needs the compression dictionary {:#010x}".format(
+                    file_id, file_info['zdict']))
+            for chunk_id in range(file_info['total_chunks']):
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS, self.zdict)
+                yield decompressor.decompress(self.read_chunk(file_id, chunk_id)) + decompressor.flush()
+            return
+        for chunk_id in range(file_info['total_chunks']):
+            yield zlib.decompress(self.read_chunk(file_id, chunk_id))
+
+    def read_file_data(self, file_id):
+        return b''.join(self.iter_file_data(file_id))
+
+    def close(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles = {}
 
 
 def extract_and_decompress(file_count, index_file, dat_file):
     # Load the index
-    with open(index_file, 'rb') as f:
-        index_data = pickle.load(f)
+    reader = StorageReader.from_files(index_file, dat_file)
 
     # Get file information from the index
-    if file_count not in index_data:
+    if file_count not in reader.index_data:
         print("Error: File count not found in index.")
         return None
 
-    file_info = index_data[file_count]
-    offset, size = file_info['offset'], file_info['size']
-
-    # Check if the file consists of multiple chunks
-    if 'chunks_info' in file_info:
-        chunks_info = file_info['chunks_info']
-        decompressed_data = bytearray()
-
-        with open(dat_file, 'rb') as f:
-            for chunk_id in range(chunks_info['total_chunks']):
-                chunk_info = chunks_info['chunks_info'][chunk_id]
-                chunk_offset, chunk_size = chunk_info['offset'], chunk_info['length']
-
-                f.seek(chunk_offset)
-                compressed_chunk_data = f.read(chunk_size)
-                # NOTE: UNCOMMENT TO ENABLE COMPRESSION/DECOMPRESSION
-                # decompressed_chunk_data = zlib.decompress(compressed_chunk_d2ata)
-                decompressed_data.extend(compressed_data)
-    else:
-        # File is not chunked, decompress the entire file
-        with open(dat_file, 'rb') as f:
-            f.seek(offset)
-            compressed_data = f.read(size)
-            decompressed_data = compressed_data  # zlib.decompress(compressed_data)
+    # The reader puts chunk-aligned and sharded files back together and
+    # inflates the chunks of compressed files
+    try:
+        decompressed_data = reader.read_file_data(file_count)
+    finally:
+        reader.close()
 
     return decompressed_data
 
 
 if __name__ == "__main__":
-    FILE_COUNT = int(raw_input("Enter the file count number: "))
+    FILE_COUNT = int(input("Enter the file count number: "))
     INDEX_FILE = "app_id.index"
     DAT_FILE = "app_id.dat"
 
     data = extract_and_decompress(FILE_COUNT, INDEX_FILE, DAT_FILE)
-    if data:
+    if data is not None:
         output_filename = "output_file"
         with open(output_filename, 'wb') as output_file:
             output_file.write(data)
         print("Successfully extracted and decompressed the file to '{}'.".format(output_filename))
     else:
-        print("Failed to extract or decompress the file.")
\ No newline at end of file
+        print("Failed to extract or decompress the file.")
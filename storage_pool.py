@@ -0,0 +1,241 @@
+##############################################################################
+# Cross-version shared storage pool.
+#
+# Instead of a full <app_id>_<version>.dat per version, pooled builds append
+# file payloads to one content-addressed pack per app, <pool>/<app_id>.pack,
+# and each version's .index points into it (index entries carry 'pack', the
+# pack path relative to the .index).  A payload whose sha256 is already in
+# the pack is not written again, so a new version only adds the files that
+# changed.  <pool>/<app_id>.keys is the append-only list of
+# (sha256, offset, length) records of the pack.
+#
+# Versions that are no longer needed are dropped with compaction, which
+# rewrites the pack with only the payloads the retained versions' .index
+# files reference, and updates those indexes (and their .paths sidecars):
+#
+#   python storage_pool.py compact <pool dir> <app_id> <retained .index files...>
+##############################################################################
+
+import hashlib
+import os
+import pickle
+import struct
+import sys
+import tempfile
+
+from path_index import FIELDS, PathIndex, write_path_index
+
+try:
+    import fcntl
+except ImportError:  # Windows: no pool locking
+    fcntl = None
+
+KEY_RECORD = struct.Struct("<32sQQ")
+
+
+def pool_paths(pool_dir, app_id):
+    """
+    (pack, keys, lock) file paths of an app's pool.
+    """
+    base = os.path.join(pool_dir, str(app_id))
+    return base + ".pack", base + ".keys", base + ".lock"
+
+
+def load_keys(keys_fname):
+    """
+    sha256 -> (offset, length) of every payload in a pack.
+    """
+    keys = {}
+    if os.path.exists(keys_fname):
+        with open(keys_fname, 'rb') as f:
+            data = f.read()
+        # A torn record at the end (interrupted build) is ignored
+        for pos in range(0, len(data) - KEY_RECORD.size + 1, KEY_RECORD.size):
+            digest, offset, length = KEY_RECORD.unpack_from(data, pos)
+            keys[digest] = (offset, length)
+    return keys
+
+
+class PoolLock(object):
+    """
+    Exclusive lock on an app's pool for the duration of a build or compaction.
+    """
+
+    def __init__(self, lock_fname):
+        self.lock_fname = lock_fname
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.lock_fname, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+        self.f = None
+
+
+class PooledStorageWriter(object):
+    """
+    Drop-in for threaded_manifest_generator.StorageWriter that writes into
+    an app's pack.  Each file's payload is staged in a spooled temporary
+    file (in memory up to stage_size) while its sha256 is computed;
+    end_file() then appends it to the pack unless the pack already has it,
+    and returns the payload's offset in the pack.
+    """
+    sharded = False
+
+    def __init__(self, pool_dir, app_id, index_dir='.', stage_size=0x1000000, spill_dir=None):
+        os.makedirs(pool_dir, exist_ok=True)
+        self.pack_fname, self.keys_fname, lock_fname = pool_paths(pool_dir, app_id)
+        self.pack_ref = os.path.relpath(self.pack_fname, index_dir)
+        self.lock = PoolLock(lock_fname).__enter__()
+        self.keys = load_keys(self.keys_fname)
+        self.pack = open(self.pack_fname, 'ab')
+        self.keys_file = open(self.keys_fname, 'ab')
+        self.stage_size = stage_size
+        self.spill_dir = spill_dir
+        self.stage = None
+        self.digest = None
+        self.padding_bytes = 0
+        self.shard_sizes = []
+        self.new_files = 0
+        self.new_bytes = 0
+        self.reused_files = 0
+        self.reused_bytes = 0
+
+    @property
+    def offset(self):
+        # Only known once the payload has been deduplicated (end_file)
+        return None
+
+    def begin_file(self, size):
+        self.stage = tempfile.SpooledTemporaryFile(self.stage_size, dir=self.spill_dir)
+        self.digest = hashlib.sha256()
+        return 0
+
+    def write(self, data):
+        self.stage.write(data)
+        self.digest.update(data)
+
+    def pad(self, boundary):
+        raise ValueError("Pooled storage does not support alignment")
+
+    def end_file(self):
+        digest = self.digest.digest()
+        length = self.stage.tell()
+        if digest in self.keys:
+            offset = self.keys[digest][0]
+            self.reused_files += 1
+            self.reused_bytes += length
+        else:
+            offset = self.pack.seek(0, os.SEEK_END)
+            self.stage.seek(0)
+            for block in iter(lambda: self.stage.read(0x100000), b''):
+                self.pack.write(block)
+            # The pack data goes out before the key that points to it
+            self.pack.flush()
+            self.keys_file.write(KEY_RECORD.pack(digest, offset, length))
+            self.keys[digest] = (offset, length)
+            self.new_files += 1
+            self.new_bytes += length
+        self.stage.close()
+        self.stage = None
+        return offset
+
+    def close(self):
+        if self.lock is None:
+            return
+        self.pack.close()
+        self.keys_file.close()
+        self.lock.__exit__()
+        self.lock = None
+        print("Storage pool {}: {} new files ({} bytes) appended, {} files ({} bytes) shared with earlier versions"
+              .format(self.pack_fname, self.new_files, self.new_bytes, self.reused_files, self.reused_bytes))
+
+    def shard_files(self):
+        return [self.pack_fname, self.keys_fname]
+
+
+def compact(pool_dir, app_id, index_files):
+    """
+    Rewrite an app's pack with only the payloads referenced by index_files
+    (the retained versions) and point those indexes, and the .paths
+    sidecars next to them (see path_index.py), at the new offsets.
+    Everything else in the pack is dropped.
+    """
+    pack_fname, keys_fname, lock_fname = pool_paths(pool_dir, app_id)
+    with PoolLock(lock_fname):
+        indexes = {}
+        live = set()
+        for index_fname in index_files:
+            with open(index_fname, 'rb') as f:
+                index_data = pickle.load(f)
+            pack_ref = os.path.relpath(pack_fname, os.path.dirname(index_fname) or '.')
+            for file_info in index_data.values():
+                if file_info.get('pack') == pack_ref:
+                    live.add((file_info['offset'], file_info['length']))
+            indexes[index_fname] = (index_data, pack_ref)
+
+        # Copy the live payloads in pack order
+        moved = {}
+        new_offset = 0
+        with open(pack_fname, 'rb') as old_pack, open(pack_fname + ".compact", 'wb') as new_pack:
+            for offset, length in sorted(live):
+                old_pack.seek(offset)
+                remaining = length
+                while remaining:
+                    block = old_pack.read(min(0x100000, remaining))
+                    if not block:
+                        raise IOError("{} is shorter than its indexes".format(pack_fname))
+                    new_pack.write(block)
+                    remaining -= len(block)
+                moved[(offset, length)] = new_offset
+                new_offset += length
+            old_size = old_pack.seek(0, os.SEEK_END)
+
+        with open(keys_fname + ".compact", 'wb') as f:
+            for digest, (offset, length) in load_keys(keys_fname).items():
+                if (offset, length) in moved:
+                    f.write(KEY_RECORD.pack(digest, moved[(offset, length)], length))
+
+        rewritten = []
+        for index_fname, (index_data, pack_ref) in indexes.items():
+            for file_info in index_data.values():
+                if file_info.get('pack') == pack_ref:
+                    file_info['offset'] = moved[(file_info['offset'], file_info['length'])]
+            with open(index_fname + ".compact", 'wb') as f:
+                pickle.dump(index_data, f, protocol=2)
+            rewritten.append(index_fname)
+
+            paths_fname = os.path.splitext(index_fname)[0] + ".paths"
+            if os.path.exists(paths_fname):
+                path_index = PathIndex(paths_fname)
+                try:
+                    entries = [path_index.record(i) for i in range(len(path_index))]
+                finally:
+                    path_index.close()
+                for entry in entries:
+                    file_info = index_data.get(entry['file_id'])
+                    if file_info is not None and file_info.get('pack') == pack_ref:
+                        entry['offset'] = file_info['offset']
+                write_path_index(paths_fname + ".compact", ([entry[field] for field in FIELDS] for entry in entries))
+                rewritten.append(paths_fname)
+
+        os.replace(pack_fname + ".compact", pack_fname)
+        os.replace(keys_fname + ".compact", keys_fname)
+        for fname in rewritten:
+            os.replace(fname + ".compact", fname)
+
+    print("Compacted {}: {} payloads kept ({} bytes), {} bytes dropped".format(
+        pack_fname, len(live), new_offset, old_size - new_offset))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5 or sys.argv[1] != "compact":
+        print("Usage: python storage_pool.py compact <pool dir> <app_id> <retained .index files...>")
+        print("Drops every payload of <app_id>.pack that none of the given indexes reference.")
+        sys.exit(1)
+
+    compact(sys.argv[2], int(sys.argv[3], 16), sys.argv[4:])
@@ -0,0 +1,119 @@
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+# The generator modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checksum_generator import create_checksums  # noqa: E402
+from manifest_validator import read_manifest_paths, validate_manifest  # noqa: E402
+from storage_extract import StorageReader  # noqa: E402
+from threaded_manifest_generator import generate_gcf  # noqa: E402
+
+APP_ID = 7
+APP_VERSION = "3"
+FINGERPRINT = "abcd"
+
+
+def write_tree(root, files):
+    """
+    Create {relative path: content} under root.
+    """
+    for relative_path, data in files.items():
+        path = os.path.join(root, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return str(root)
+
+
+def sample_files(seed=1):
+    """
+    A small tree with text that compresses, random data that does not,
+    multi-chunk files, empty files and names shared between directories.
+    """
+    rnd = random.Random(seed)
+    text = b"".join(b"line %d of some repetitive content\n" % i for i in range(6000))
+    files = {
+        "readme.txt": b"hello\n",
+        "empty.dat": b"",
+        "bin/game.exe": bytes(rnd.getrandbits(8) for _ in range(0x10000)),
+        "bin/readme.txt": b"another readme\n",
+        "data/text.cfg": text,
+        "data/maps/readme.txt": text[:1000],
+        "data/maps/level1.bsp": bytes(rnd.getrandbits(8) for _ in range(150000)) + text,
+        "data/sound/blip.wav": bytes(rnd.getrandbits(8) for _ in range(777)),
+    }
+    for i in range(12):
+        files["data/small/s{}.txt".format(i)] = b"small file %d " % i * rnd.randrange(1, 40)
+    return files
+
+
+@pytest.fixture
+def content(tmp_path):
+    files = sample_files()
+    return write_tree(tmp_path / "content", files), files
+
+
+@pytest.fixture
+def build(tmp_path):
+    """
+    Run generate_gcf into a fresh output directory, without the config
+    files of the working directory; returns (output dir, result).
+    """
+    builds = []
+
+    def run(source, output_dir=None, **options):
+        output_dir = output_dir or str(tmp_path / "out{}".format(len(builds)))
+        os.makedirs(output_dir, exist_ok=True)
+        options.setdefault('special_flags', {})
+        options.setdefault('minfootprint', [])
+        builds.append(output_dir)
+        return output_dir, generate_gcf(source, APP_ID, APP_VERSION, FINGERPRINT, output_dir=output_dir, **options)
+
+    return run
+
+
+def base_name(output_dir):
+    return os.path.join(output_dir, "{}_{}".format(APP_ID, APP_VERSION))
+
+
+def read_back(output_dir, files, dat_file=None, checksum_granularity=0x10000):
+    """
+    Validate the manifest of a build, check that every file reads back
+    from its storage as the original content and that the .checksums match
+    the stored payloads.
+    """
+    base = base_name(output_dir)
+    errors, header = validate_manifest(base + ".manifest")
+    assert not errors, errors.messages
+    assert header["file_count"] == len(files)
+    reader = StorageReader.from_files(base + ".index", dat_file or base + ".dat")
+    try:
+        for _, path, file_id in read_manifest_paths(base + ".manifest"):
+            if file_id is not None:
+                assert reader.read_file_data(file_id) == files[path], path
+    finally:
+        reader.close()
+
+    expected = base + ".expected.checksums"
+    create_checksums(base + ".manifest", base + ".index", dat_file or base + ".dat", APP_ID, APP_VERSION,
+                     expected, granularities=(checksum_granularity,))
+    assert read_checksums(base + ".checksums") == read_checksums(expected)
+    os.remove(expected)
+
+
+def read_checksums(filename):
+    """
+    Per file id checksum lists of a .checksums file (the tables may store
+    them in any order).
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    file_id_count, checksum_count = struct.unpack_from("<II", data, 20)
+    entries = struct.unpack_from("<{}I".format(2 * file_id_count), data, 28)
+    checksums = struct.unpack_from("<{}I".format(checksum_count), data, 28 + 8 * file_id_count)
+    return [checksums[first:first + count] for count, first in zip(entries[0::2], entries[1::2])]
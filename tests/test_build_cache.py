@@ -0,0 +1,30 @@
+import os
+import shutil
+
+from conftest import read_back
+
+
+def test_cache_hit_restores_every_output(tmp_path, content, build):
+    source, files = content
+    cache_dir = str(tmp_path / "cache")
+    output_dir, built = build(source, cache_dir=cache_dir, compress='auto', path_index=True)
+    assert any(name.endswith(".compression.csv") for name in built)
+    with open(os.path.join(output_dir, "7_3.compression.csv"), 'rb') as f:
+        report = f.read()
+
+    shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    _, restored = build(source, output_dir=output_dir, cache_dir=cache_dir, compress='auto', path_index=True)
+    assert sorted(restored) == sorted(built)
+    with open(os.path.join(output_dir, "7_3.compression.csv"), 'rb') as f:
+        assert f.read() == report
+    read_back(output_dir, files)
+
+
+def test_cache_miss_on_changed_options(tmp_path, content, build):
+    source, files = content
+    cache_dir = str(tmp_path / "cache")
+    build(source, cache_dir=cache_dir)
+    output_dir, _ = build(source, cache_dir=cache_dir, checksum_granularity=0x8000)
+    assert len(os.listdir(cache_dir)) == 2
+    read_back(output_dir, files, checksum_granularity=0x8000)
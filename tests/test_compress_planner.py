@@ -0,0 +1,42 @@
+import os
+
+from compress_planner import STORE, CompressionPlanner, sample_ranges
+from zlib_dictionary import deflate_with_dictionary, inflate_with_dictionary, train_dictionary
+
+
+def reader(data):
+    return lambda ranges: (data[offset:offset + length] for offset, length in ranges)
+
+
+def test_sample_ranges_cover_small_files_and_spread_over_large_ones():
+    assert sample_ranges(0, 0x10000, 4) == []
+    assert sample_ranges(1000, 0x10000, 4) == [(0, 1000)]
+    ranges = sample_ranges(0x100000, 0x10000, 4)
+    assert ranges[0] == (0, 0x10000) and ranges[-1] == (0x100000 - 0x10000, 0x10000)
+
+
+def test_plan_stores_noise_and_compresses_text():
+    planner = CompressionPlanner()
+    noise = os.urandom(200000)
+    text = b"some very compressible text " * 10000
+    assert planner.plan("sound.wav", len(noise), reader(noise))[0] == STORE
+    level, planned_by, ratio = planner.plan("config.cfg", len(text), reader(text))
+    assert level != STORE and planned_by == "sampled" and ratio < 0.1
+
+
+def test_extension_decision_is_reused():
+    planner = CompressionPlanner(extension_files=2)
+    noise = os.urandom(5000)
+    for _ in range(2):
+        planner.plan("a.wav", len(noise), reader(noise))
+    assert planner.plan("b.wav", 1, None) == (STORE, "extension", None)
+
+
+def test_dictionary_round_trip():
+    samples = [b'{"name": "item%d", "weight": %d, "kind": "weapon"}' % (i, i * 7) for i in range(200)]
+    zdict = train_dictionary(samples, 0x1000)
+    assert 0 < len(zdict) <= 0x1000
+    data = b'{"name": "item999", "weight": 12, "kind": "weapon"}'
+    deflated = deflate_with_dictionary(data, 9, zdict)
+    assert inflate_with_dictionary(deflated, zdict) == data
+    assert len(deflated) < len(deflate_with_dictionary(data, 9, b""))
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from conftest import APP_ID, APP_VERSION, FINGERPRINT, base_name, read_back
+from distributed_build import build_local, plan_build
+
+
+def test_merge_matches_single_build(tmp_path, content, build):
+    source, files = content
+    single_dir, _ = build(source, align=0x1000, compress='on')
+    output_dir = str(tmp_path / "distributed")
+    os.makedirs(output_dir)
+    outputs = build_local(source, APP_ID, APP_VERSION, FINGERPRINT, 3, output_dir, special_flags={}, minfootprint=[],
+                          align=0x1000, compress='on')
+    for kind in ('manifest', 'dat', 'index', 'checksums'):
+        with open(base_name(single_dir) + "." + kind, 'rb') as f, open(base_name(output_dir) + "." + kind, 'rb') as g:
+            assert f.read() == g.read(), kind
+    assert not [name for name in os.listdir(output_dir) if ".part" in name]
+    assert all(os.path.exists(name) for name in outputs)
+    read_back(output_dir, files)
+
+
+@pytest.mark.parametrize("options", [{'compress': 'auto'}, {'layout': 'directory'}, {'shards': 2},
+                                     {'journal': True}, {'sinks': {'index': None}}])
+def test_plan_rejects_unsupported_options(tmp_path, content, options):
+    source, _ = content
+    with pytest.raises(ValueError):
+        plan_build(source, APP_ID, APP_VERSION, FINGERPRINT, 2, str(tmp_path), special_flags={}, minfootprint=[],
+                   **options)
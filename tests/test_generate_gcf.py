@@ -0,0 +1,220 @@
+import hashlib
+import os
+import tarfile
+import zipfile
+
+import io
+
+import pytest
+
+from build_api import build as build_in_process
+from checksum_engine import load_hashes
+from conftest import APP_ID, APP_VERSION, FINGERPRINT, base_name, read_back, write_tree
+from content_source import DirectorySource
+from manifest_validator import read_manifest_paths
+from path_index import PathIndex
+from storage_extract import StorageReader
+
+OPTIONS = {
+    'default': {},
+    'inline reads': {'prefetch_workers': 0},
+    'compress on': {'compress': 'on'},
+    'compress level 9': {'compress': 'on', 'compress_level': 9},
+    'compress auto': {'compress': 'auto'},
+    'compress dict': {'compress': 'dict'},
+    'split': {'split_size': 0x8000, 'split_workers': 3},
+    'split compressed': {'split_size': 0x8000, 'split_workers': 3, 'compress': 'on'},
+    'align': {'align': 0x1000},
+    'align chunks': {'align': 0x1000, 'align_chunks': True, 'compress': 'on'},
+    'shards': {'shards': 3, 'shard_size': 0x20000},
+    'shards aligned compressed': {'shards': 2, 'shard_size': 0x10000, 'align': 0x1000, 'compress': 'on'},
+    'memory limit': {'memory_limit': 0x10000},
+    'directory layout': {'layout': 'directory'},
+    'dedupe names': {'dedupe_names': True},
+    'path index': {'path_index': True},
+    'strong hash': {'strong_hash': 'sha256'},
+    'throttled': {'read_rate': 1 << 30, 'write_rate': 1 << 30, 'iops': 1 << 20},
+}
+
+
+@pytest.mark.parametrize("options", list(OPTIONS.values()), ids=list(OPTIONS))
+def test_round_trip(content, build, options):
+    source, files = content
+    output_dir, outputs = build(source, **options)
+    read_back(output_dir, files)
+    assert all(os.path.exists(name) for name in outputs)
+
+
+@pytest.mark.parametrize("granularity", [0x8000, 'file'])
+def test_checksum_granularity(content, build, granularity):
+    source, files = content
+    output_dir, _ = build(source, checksum_granularity=granularity)
+    read_back(output_dir, files, checksum_granularity=granularity)
+
+
+def artifacts(output_dir):
+    result = {}
+    for kind in ('manifest', 'index', 'checksums', 'dat'):
+        with open(base_name(output_dir) + "." + kind, 'rb') as f:
+            result[kind] = f.read()
+    return result
+
+
+def test_read_pipelines_write_identical_outputs(content, build):
+    source, _ = content
+    expected = artifacts(build(source)[0])
+    for options in ({'prefetch_workers': 0}, {'memory_limit': 0x10000}, {'split_size': 0x8000},
+                    {'read_rate': 1 << 30}):
+        assert artifacts(build(source, **options)[0]) == expected, options
+
+
+def test_dedupe_names_shrinks_the_manifest(content, build):
+    source, files = content
+    plain_dir, _ = build(source)
+    dedupe_dir, _ = build(source, dedupe_names=True)
+    assert os.path.getsize(base_name(dedupe_dir) + ".manifest") < os.path.getsize(base_name(plain_dir) + ".manifest")
+    assert read_manifest_paths(base_name(dedupe_dir) + ".manifest") == \
+        read_manifest_paths(base_name(plain_dir) + ".manifest")
+
+
+def test_path_index_matches_manifest(content, build):
+    source, files = content
+    output_dir, _ = build(source, path_index=True, shards=2, shard_size=0x20000)
+    base = base_name(output_dir)
+    paths = PathIndex(base + ".paths")
+    reader = StorageReader.from_files(base + ".index", base + ".dat")
+    try:
+        for node_index, path, file_id in read_manifest_paths(base + ".manifest"):
+            if file_id is None:
+                continue
+            entry = paths.lookup(path.upper())
+            assert (entry['node_index'], entry['file_id'], entry['size']) == (node_index, file_id, len(files[path]))
+            file_info = reader.index_data[file_id]
+            assert (entry['shard'], entry['offset'], entry['length']) == \
+                (file_info.get('shard', 0), file_info['offset'], file_info['length'])
+        assert [entry['path'] for entry in paths.prefix("data/maps/")] == ["data/maps/level1.bsp",
+                                                                          "data/maps/readme.txt"]
+    finally:
+        paths.close()
+        reader.close()
+
+
+def test_strong_hashes_cover_files_and_blocks(content, build):
+    source, files = content
+    output_dir, _ = build(source, strong_hash='sha1', split_size=0x8000)
+    base = base_name(output_dir)
+    hashes = load_hashes(base + ".hashes")
+    for _, path, file_id in read_manifest_paths(base + ".manifest"):
+        if file_id is None:
+            continue
+        data = files[path]
+        file_digest, block_digests = hashes['files'][file_id]
+        assert file_digest == hashlib.sha1(data).digest()
+        assert block_digests == [hashlib.sha1(data[i:i + hashes['block_size']]).digest()
+                                 for i in range(0, len(data), hashes['block_size'])]
+
+
+@pytest.mark.parametrize("archive", ["content.zip", "content.tar", "content.tar.gz"])
+def test_archive_sources(tmp_path, content, build, archive):
+    source, files = content
+    archive_path = str(tmp_path / archive)
+    if archive.endswith(".zip"):
+        with zipfile.ZipFile(archive_path, 'w') as z:
+            for relative_path, data in files.items():
+                z.writestr(relative_path, data)
+    else:
+        with tarfile.open(archive_path, 'w:gz' if archive.endswith(".gz") else 'w') as t:
+            t.add(source, arcname=".")
+    output_dir, _ = build(archive_path, compress='on', split_size=0x8000)
+    read_back(output_dir, files)
+
+
+def test_sequential_archive_rejects_random_access(tmp_path, content, build):
+    source, _ = content
+    archive_path = str(tmp_path / "content.tar.gz")
+    with tarfile.open(archive_path, 'w:gz') as t:
+        t.add(source, arcname=".")
+    for options in ({'compress': 'auto'}, {'layout': 'directory'}, {'dry_run': 'sample', 'compress': 'on'}):
+        with pytest.raises(ValueError):
+            build(archive_path, **options)
+
+
+class InterruptedSource(DirectorySource):
+    """
+    Fails while reading one file, like a build killed halfway.
+    """
+
+    def __init__(self, directory_path, fail_name):
+        DirectorySource.__init__(self, directory_path)
+        self.fail_name = fail_name
+
+    def iter_chunks(self, ref, chunk_size):
+        if os.path.basename(ref) == self.fail_name:
+            raise KeyboardInterrupt
+        return DirectorySource.iter_chunks(self, ref, chunk_size)
+
+
+def test_journal_resumes_interrupted_build(content, build, capsys):
+    source, files = content
+    expected = artifacts(build(source)[0])
+    output_dir = os.path.join(os.path.dirname(source), "resumed")
+    with pytest.raises(KeyboardInterrupt):
+        build(InterruptedSource(source, "level1.bsp"), output_dir=output_dir, journal=True, checkpoint_interval=0,
+              prefetch_workers=0)
+    assert os.path.exists(base_name(output_dir) + ".journal")
+    capsys.readouterr()
+    build(source, output_dir=output_dir, journal=True, checkpoint_interval=0)
+    assert "Resuming from checkpoint" in capsys.readouterr().out
+    assert artifacts(output_dir) == expected
+    read_back(output_dir, files)
+
+
+@pytest.mark.parametrize("options", [{}, {'align': 0x1000, 'align_chunks': True},
+                                     {'shards': 3, 'shard_size': 0x20000},
+                                     {'dedupe_names': True, 'strong_hash': 'sha256'},
+                                     {'checksum_granularity': 'file', 'layout': 'directory'}])
+def test_dry_run_sizes_are_exact_without_compression(content, build, options):
+    source, _ = content
+    _, estimate = build(source, dry_run=True, **options)
+    output_dir, outputs = build(source, **options)
+    base = base_name(output_dir)
+    assert estimate['artifacts']['dat'] == sum(os.path.getsize(name) for name in outputs if name.endswith(".dat"))
+    for kind in ('manifest', 'index', 'checksums', 'hashes'):
+        if kind in estimate['artifacts']:
+            assert estimate['artifacts'][kind] == os.path.getsize(base + "." + kind), kind
+
+
+def test_dry_run_writes_nothing(content, build):
+    source, _ = content
+    output_dir, estimate = build(source, dry_run='sample', compress='on')
+    assert os.listdir(output_dir) == []
+    assert estimate['files'] == 20 and estimate['directories'] == 6
+
+
+def test_build_api_streams_to_sinks(tmp_path, content, build):
+    source, _ = content
+    output_dir, _ = build(source, compress='on')
+    dat = io.BytesIO()
+    # The compression report is not an artifact and still goes to output_dir
+    result = build_in_process(source, APP_ID, APP_VERSION, FINGERPRINT, sinks={'dat': dat}, compress='on',
+                              output_dir=str(tmp_path))
+    assert dat.getvalue() == artifacts(output_dir)['dat']
+    for kind in ('manifest', 'index', 'checksums'):
+        assert result[kind] == artifacts(output_dir)[kind], kind
+
+
+def test_empty_tree(tmp_path, build):
+    source = str(tmp_path / "empty")
+    os.makedirs(source)
+    output_dir, _ = build(source)
+    read_back(output_dir, {})
+
+
+def test_changed_file_changes_outputs(content, build):
+    source, files = content
+    first = artifacts(build(source)[0])
+    files = dict(files, **{"readme.txt": b"changed\n"})
+    write_tree(source, {"readme.txt": files["readme.txt"]})
+    output_dir, _ = build(source)
+    assert artifacts(output_dir)['dat'] != first['dat']
+    read_back(output_dir, files)
@@ -0,0 +1,10 @@
+from load_test import percentile
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 151))
+    assert percentile(values, 99) == 149
+    assert percentile(values, 50) == 75
+    assert percentile(values, 100) == 150
+    assert percentile(values, 0) == 1
+    assert percentile([], 99) == 0.0
@@ -0,0 +1,26 @@
+import struct
+
+from conftest import base_name
+from manifest_validator import validate_manifest
+
+
+def test_built_manifest_is_valid(content, build):
+    source, files = content
+    output_dir, _ = build(source, dedupe_names=True, minfootprint=["readme.txt", "bin/game.exe"])
+    errors, header = validate_manifest(base_name(output_dir) + ".manifest")
+    assert not errors, errors.messages
+    assert (header["file_count"], header["copy_count"]) == (len(files), 2)
+
+
+def test_broken_links_and_checksum_are_reported(content, build):
+    source, _ = content
+    output_dir, _ = build(source)
+    manifest_fname = base_name(output_dir) + ".manifest"
+    with open(manifest_fname, 'r+b') as f:
+        # Parent index of node 1 points past the node table
+        f.seek(0x38 + 0x1c + 16)
+        f.write(struct.pack("<I", 1000))
+    errors, _ = validate_manifest(manifest_fname)
+    assert errors
+    assert any("checksum" in message for message in errors.messages)
+    assert len(errors.messages) > 1
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from conftest import base_name, read_back, write_tree
+from storage_extract import StorageReader
+
+
+@pytest.mark.parametrize("size", [100, 0xfff0, 0x10000])
+@pytest.mark.parametrize("options", [{'compress': 'on'}, {'compress': 'on', 'split_size': 0x10000},
+                                     {'compress': 'on', 'align': 0x1000, 'align_chunks': True}])
+def test_compressed_incompressible_single_chunk(tmp_path, build, size, options):
+    # An incompressible chunk deflates to more than chunk_size bytes, so
+    # its stored length cannot be derived from the chunk layout
+    files = {"noise.bin": os.urandom(size)}
+    output_dir, _ = build(write_tree(tmp_path / "content", files), **options)
+    read_back(output_dir, files)
+
+
+def test_chunk_location_matches_stored_chunks(content, build):
+    source, files = content
+    output_dir, _ = build(source, compress='on', align=0x1000, align_chunks=True)
+    base = base_name(output_dir)
+    reader = StorageReader.from_files(base + ".index", base + ".dat")
+    try:
+        for file_id, file_info in reader.index_data.items():
+            chunks = [reader.read_chunk(file_id, chunk_id) for chunk_id in range(file_info['total_chunks'])]
+            assert b"".join(chunks) == reader.read_file(file_id)
+    finally:
+        reader.close()
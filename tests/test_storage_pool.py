@@ -0,0 +1,45 @@
+import os
+
+from conftest import APP_ID, base_name, read_back, write_tree
+from path_index import PathIndex
+from storage_pool import compact, pool_paths
+
+
+def check_paths(output_dir, files, pack_fname):
+    # Every path resolves through the .paths sidecar to its bytes in the pack
+    paths = PathIndex(base_name(output_dir) + ".paths")
+    try:
+        assert len(paths) == len(files)
+        with open(pack_fname, 'rb') as pack:
+            for relative_path, data in files.items():
+                entry = paths.lookup(relative_path)
+                assert entry is not None and entry['size'] == len(data), relative_path
+                pack.seek(entry['offset'])
+                assert pack.read(entry['length']) == data, relative_path
+    finally:
+        paths.close()
+
+
+def test_pool_shares_payloads_and_compacts(tmp_path, content, build):
+    source, files = content
+    pool_dir = str(tmp_path / "pool")
+    pack_fname = pool_paths(pool_dir, APP_ID)[0]
+    v1_dir, _ = build(source, pool_dir=pool_dir, path_index=True)
+    size_v1 = os.path.getsize(pack_fname)
+
+    changed = dict(files)
+    changed["data/text.cfg"] = files["data/text.cfg"] + b"patched\n"
+    del changed["bin/game.exe"]
+    changed["bin/new.dll"] = os.urandom(5000)
+    v2_source = write_tree(tmp_path / "content2", changed)
+    v2_dir, _ = build(v2_source, pool_dir=pool_dir, path_index=True)
+    # Only the new content was appended
+    assert os.path.getsize(pack_fname) == size_v1 + len(changed["data/text.cfg"]) + 5000
+    read_back(v1_dir, files, dat_file=base_name(v1_dir) + ".dat")
+    read_back(v2_dir, changed, dat_file=base_name(v2_dir) + ".dat")
+
+    # Dropping version 1 moves the shared payloads to new offsets
+    compact(pool_dir, APP_ID, [base_name(v2_dir) + ".index"])
+    assert os.path.getsize(pack_fname) == sum(len(data) for data in set(changed.values()))
+    read_back(v2_dir, changed, dat_file=base_name(v2_dir) + ".dat")
+    check_paths(v2_dir, changed, pack_fname)
@@ -0,0 +1,34 @@
+import os
+
+from conftest import APP_ID, APP_VERSION, FINGERPRINT, read_back, write_tree
+from watch_build import WatchBuilder
+
+
+def test_refresh_follows_the_tree(tmp_path, content, monkeypatch):
+    source, files = content
+    output_dir = tmp_path / "watch"
+    output_dir.mkdir()
+    # Watch builds write to (and read their config files from) the working directory
+    monkeypatch.chdir(output_dir)
+    builder = WatchBuilder(source, APP_ID, APP_VERSION, FINGERPRINT, compact_ratio=0.1)
+    assert builder.refresh()
+    read_back(str(output_dir), files)
+    manifest = (output_dir / "7_3.manifest").read_bytes()
+
+    # A content edit re-emits the index and checksums but not the manifest
+    files["data/text.cfg"] = b"edited\n" * 5000
+    write_tree(source, {"data/text.cfg": files["data/text.cfg"]})
+    assert builder.refresh({"data/text.cfg"}, structural=False)
+    read_back(str(output_dir), files)
+    assert (output_dir / "7_3.manifest").read_bytes() == manifest
+    assert not builder.refresh(set(), structural=False)
+
+    # New and deleted files change the manifest; the garbage gets compacted
+    files["data/new.txt"] = b"new file\n"
+    write_tree(source, {"data/new.txt": files["data/new.txt"]})
+    os.remove(os.path.join(source, "bin", "game.exe"))
+    del files["bin/game.exe"]
+    assert builder.refresh()
+    read_back(str(output_dir), files)
+    assert builder.garbage_bytes == 0
+    assert os.path.getsize(output_dir / "7_3.dat") == sum(len(data) for data in files.values())
@@ -5,18 +5,45 @@
 # Modified: 10/27/2023
 # version: Beta 2 (threaded)
 
+import contextlib
 import glob
 import os
 import pickle
+import queue
 import struct
+import sys
+import tempfile
+import threading
+import time
 import zlib
-from multiprocessing import Pool
+from array import array
+from collections import deque
+from itertools import accumulate
 import re
 import hashlib
 
-
-def expand_wildcards_in_minfootprint():
-    filename = 'minfootprint.txt'
+from checksum_engine import MultiChecksum, block_checksums, parse_granularity, write_hashes_stream
+from checksum_generator import uint32_le_bytes
+from storage_extract import shard_path
+from build_cache import BuildCache, file_digest, input_fingerprint
+from build_journal import BuildJournal
+from content_source import DirectorySource, open_source
+from io_throttle import IOThrottle, ThrottledSource
+from path_index import write_path_index
+from storage_pool import PooledStorageWriter
+from compress_planner import STORE, CompressionPlanner
+from zlib_dictionary import (MAX_DICTIONARY_SIZE, deflate_with_dictionary, dictionary_id, sample_small_files,
+                             train_dictionary)
+
+
+def expand_wildcards_in_minfootprint(directory_path, filename='minfootprint.txt',
+                                     output_filename='minfootprint_temp.txt'):
+    """
+    Expand the wildcard (*) lines of minfootprint.txt against the content
+    directory into output_filename, as paths relative to directory_path.
+    """
+    if not os.path.isfile(filename):
+        return
     non_wildcard_lines = []
     wildcard_lines = []
 
@@ -32,8 +59,9 @@ def expand_wildcards_in_minfootprint():
     # Expand wildcard lines
     expanded_lines = []
     for line in wildcard_lines:
-        path_pattern = os.path.join(directory_path, line)  # Assuming directory_path is defined globally or passed as a parameter
-        expanded_lines.extend(glob.glob(path_pattern, recursive=True))
+        path_pattern = os.path.join(glob.escape(directory_path), line)
+        expanded_lines.extend(os.path.relpath(path, directory_path)
+                              for path in glob.glob(path_pattern, recursive=True) if os.path.isfile(path))
 
     # Sort expanded lines
     expanded_lines.sort()
@@ -42,7 +70,7 @@ def expand_wildcards_in_minfootprint():
     all_lines = non_wildcard_lines + expanded_lines
 
     # Write merged lines back to file
-    with open('minfootprint_temp.txt', 'w') as file:
+    with open(output_filename, 'w') as file:
         for line in all_lines:
             file.write(line + '\n')
 
@@ -87,19 +115,6 @@ def parse_minfootprint_file(filename='minfootprint.txt'):
     return file_paths
 
 
-def process_file_chunk(args):
-    file_path, chunk_size = args
-    compressed_chunks = []
-    with open(file_path, 'rb') as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            # NOTE: UNCOMMENT TO ENABLE COMPRESSION/DECOMPRESSION
-            compressed_chunk = chunk  # zlib.compress(chunk)
-            compressed_chunks.append(compressed_chunk)
-    return compressed_chunks
-
 ############################################
 # NEW FUNCTION for calculating chunk checksums
 ############################################
@@ -112,6 +127,671 @@ def calculate_chunk_checksum(data_block):
     adler = zlib.adler32(data_block, 0) & 0xFFFFFFFF
     return adler
 
+############################################
+# Spill-to-disk buffers for memory-bounded builds
+############################################
+class SpillBuffer(object):
+    """
+    Append-only byte buffer that keeps at most `limit` bytes in memory and
+    moves everything older to an anonymous temporary file.
+    Bytes that were already appended can still be patched in place, and the
+    whole content is streamed back out with iter_blocks().
+    With limit=None nothing is ever spilled (the old all-in-memory behaviour).
+    """
+
+    def __init__(self, limit=None, spill_dir=None):
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.memory = bytearray()
+        self.spill_file = None
+        self.spilled = 0
+
+    def __len__(self):
+        return self.spilled + len(self.memory)
+
+    def append(self, data):
+        self.memory += data
+        if self.limit is not None and len(self.memory) > self.limit:
+            self.flush()
+
+    def flush(self):
+        if not self.memory:
+            return
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+        self.spill_file.seek(self.spilled)
+        self.spill_file.write(self.memory)
+        self.spilled += len(self.memory)
+        self.memory = bytearray()
+
+    def patch(self, offset, data):
+        # The part of the patch that falls in the spilled region goes to the
+        # temp file, the rest goes to the in-memory tail
+        split = max(0, min(len(data), self.spilled - offset))
+        if split:
+            self.spill_file.seek(offset)
+            self.spill_file.write(data[:split])
+        if split < len(data):
+            start = offset + split - self.spilled
+            self.memory[start:start + len(data) - split] = data[split:]
+
+    def iter_blocks(self, block_size=0x100000):
+        if self.spill_file is not None:
+            self.spill_file.seek(0)
+            remaining = self.spilled
+            while remaining:
+                block = self.spill_file.read(min(block_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+        if self.memory:
+            yield bytes(self.memory)
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.memory = bytearray()
+
+
+class StreamingDictPickler(object):
+    """
+    Writes a pickled dict one item at a time into a SpillBuffer, so the
+    .index never has to exist as a full dict in memory.
+    The result loads with a plain pickle.load().
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pending = 0
+        # PROTO 2, EMPTY_DICT
+        self.buffer.append(b'\x80\x02}')
+
+    def add(self, key, value):
+        if self.pending == 0:
+            self.buffer.append(b'(')  # MARK
+        # Strip PROTO (2 bytes) and STOP (1 byte) from each fragment
+        self.buffer.append(pickle.dumps(key, protocol=2)[2:-1] + pickle.dumps(value, protocol=2)[2:-1])
+        self.pending += 1
+        if self.pending == self.BATCH_SIZE:
+            self.buffer.append(b'u')  # SETITEMS
+            self.pending = 0
+
+    def finish(self):
+        if self.pending:
+            self.buffer.append(b'u')
+            self.pending = 0
+        self.buffer.append(b'.')  # STOP
+
+
+def payload_index_entry(offset, length, chunk_lengths, chunk_size, chunk_align=None, compressed=0):
+    """
+    The .index entry of a payload at offset in its .dat, stored as
+    chunk_lengths (chunk_align padding before every chunk).  Chunk i of a
+    stored payload starts i * chunk_size into it (rounded up to chunk_align
+    per chunk), so only compressed payloads, whose chunks can come out of
+    zlib at any length (more than chunk_size when incompressible), need
+    their chunk lengths stored.  compressed is the zlib level of a
+    compressed payload.
+    """
+    index_entry = {
+        'offset': offset,
+        'length': length,
+        'total_chunks': len(chunk_lengths),
+        'chunk_size': chunk_size
+    }
+    if compressed or any(chunk_length != chunk_size for chunk_length in chunk_lengths[:-1]):
+        index_entry['chunk_lengths'] = chunk_lengths
+    if chunk_align:
+        index_entry['chunk_align'] = chunk_align
+    if compressed:
+        index_entry['compressed'] = compressed
+    return index_entry
+
+
+def open_output(filename):
+    """
+    Open an output file for writing as a brand new file, so a hard-linked
+    copy of an earlier output (e.g. in the build cache) is never overwritten
+    in place.
+    """
+    if os.path.lexists(filename):
+        os.remove(filename)
+    return open(filename, 'wb')
+
+
+def parse_size(text):
+    """
+    Parse a size like '4G', '512M', '65536' or '0x10000' into a byte count.
+    """
+    text = text.strip().upper()
+    multipliers = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if text.endswith('B') and len(text) > 1 and text[-2] in multipliers:
+        text = text[:-1]
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text, 0)
+
+
+def load_access_profile(filename):
+    """
+    Load an access-frequency profile and return it as a dictionary of
+    relative path -> hit count.  One "<relative path>=<hits>" per line,
+    the same layout as special_file_flags.ini.
+    """
+    profile = {}
+    if filename and os.path.exists(filename):
+        with open(filename, 'r') as f:
+            for line in f:
+                parts = line.strip().split('=')
+                if len(parts) == 2 and not parts[0].startswith('#'):
+                    profile[parts[0].strip()] = int(parts[1], 0)
+    return profile
+
+
+# Flag bits that mark a file as needed to start the application
+LAUNCH_FLAGS = 0x800 | 0x2  # Executable_File | Launch_File
+
+
+class PrefetchReader(object):
+    """
+    Bounded read-ahead stage of the build pipeline.
+
+    A scanner thread runs the walk_tree() events and queues every file for
+    the reader threads, which read it in chunks from the content source into
+    a small per-file queue (with a POSIX_FADV_SEQUENTIAL hint for plain
+    files).  A sequential source (compressed tar) is read by the scanner
+    itself, each file before the next event.  run() hands the
+    events back in their original order, each file with an iterator over its
+    chunks, so the disk keeps reading the next files while the caller
+    checksums and writes the current one.  At most `files_ahead` files and
+    `depth` chunks per file are buffered at any time.
+    """
+
+    def __init__(self, chunk_size, workers=2, files_ahead=32, depth=16, source=None):
+        self.source = source if source is not None else DirectorySource(None)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.files_ahead = files_ahead
+        self.depth = depth
+
+    def run(self, events):
+        ordered = queue.Queue(self.files_ahead * 4)
+        jobs = queue.Queue()
+        ahead = threading.Semaphore(self.files_ahead)
+        stop = threading.Event()
+
+        def put(q, item):
+            # Blocking put that gives up once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def scan():
+            try:
+                for event in events:
+                    if event[0] == 'file':
+                        while not ahead.acquire(timeout=0.1):
+                            if stop.is_set():
+                                return
+                        chunks = queue.Queue(self.depth)
+                        if self.source.sequential:
+                            if not put(ordered, (event, chunks)) or not fill(event[2], chunks):
+                                return
+                            continue
+                        jobs.put((event[2], chunks))
+                        if not put(ordered, (event, chunks)):
+                            return
+                    elif not put(ordered, (event, None)):
+                        return
+            except Exception as e:
+                put(ordered, e)
+            finally:
+                for _ in range(self.workers):
+                    jobs.put(None)
+                put(ordered, None)
+
+        def fill(ref, chunks):
+            try:
+                for chunk in self.source.iter_chunks(ref, self.chunk_size):
+                    if not put(chunks, chunk):
+                        return False
+                return put(chunks, None)
+            except Exception as e:
+                return put(chunks, e)
+
+        def read():
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                if not fill(*job):
+                    return
+
+        def consume(chunks):
+            try:
+                while True:
+                    item = chunks.get()
+                    if item is None:
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                ahead.release()
+
+        threads = [threading.Thread(target=scan, daemon=True)]
+        threads += [threading.Thread(target=read, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = ordered.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                event, chunks = item
+                yield event, (consume(chunks) if chunks is not None else None)
+        finally:
+            stop.set()
+
+
+class BlockRangeReader(object):
+    """
+    Intra-file parallel stage for very large files.
+
+    The file is split into chunk_size ranges that `workers` threads read
+    with os.pread (one shared descriptor), compress and, when stored as is,
+    checksum per 0x8000 block (see checksum_engine.block_checksums); run()
+    hands the results back in file order.  At most `window` chunks are in
+    flight, so memory stays bounded whatever the file size.  Reads are
+    charged to throttle (an io_throttle.IOThrottle) where one is given.
+    """
+
+    def __init__(self, chunk_size, workers=4, window=None, strong_hash=None, throttle=None):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.window = window or workers * 4
+        self.strong_hash = strong_hash
+        self.throttle = throttle
+
+    def run(self, path, offset, size, level):
+        """
+        Yield (stored chunk, raw length, compression CPU seconds, block
+        checksums or None) for every chunk of size bytes at offset of path.
+        """
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        jobs = queue.Queue()
+        chunk_count = (size + self.chunk_size - 1) // self.chunk_size
+
+        def read_range(f, position, length):
+            if self.throttle is not None:
+                self.throttle.read(length)
+            if f is None:
+                data = os.pread(fd, length, position)
+            else:
+                f.seek(position)
+                data = f.read(length)
+            if self.throttle is not None:
+                self.throttle.consumed(fd, position, length)
+            return data
+
+        def work():
+            # Without os.pread (Windows) every worker seeks its own handle
+            f = None if hasattr(os, 'pread') else open(path, 'rb')
+            try:
+                while True:
+                    job = jobs.get()
+                    if job is None:
+                        return
+                    index, slot = job
+                    try:
+                        start = index * self.chunk_size
+                        length = min(self.chunk_size, size - start)
+                        data = read_range(f, offset + start, length)
+                        if len(data) != length:
+                            raise IOError("{} changed while it was read".format(path))
+                        cpu_start = time.thread_time()
+                        stored = zlib.compress(data, level) if level else data
+                        cpu_seconds = time.thread_time() - cpu_start
+                        blocks = None if level else block_checksums(stored, 0, self.strong_hash)
+                        slot.put((stored, length, cpu_seconds, blocks))
+                    except Exception as e:
+                        slot.put(e)
+            finally:
+                if f is not None:
+                    f.close()
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            pending = deque()
+            next_index = 0
+            while next_index < chunk_count or pending:
+                while next_index < chunk_count and len(pending) < self.window:
+                    slot = queue.Queue(1)
+                    jobs.put((next_index, slot))
+                    pending.append(slot)
+                    next_index += 1
+                item = pending.popleft().get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Drop the jobs that were not started, then let the workers go
+            try:
+                while True:
+                    jobs.get_nowait()
+            except queue.Empty:
+                pass
+            for _ in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+            if self.throttle is not None:
+                # Readahead of one worker can bring back ranges another already dropped
+                self.throttle.consumed(fd, offset, size)
+            os.close(fd)
+
+
+class StorageWriter(object):
+    """
+    Writes file payloads into the .dat, or with shard_size / shards into
+    several .dat shards (see storage_extract.shard_path).
+
+    In sharded mode up to `shards` shards are open at once, each with its own
+    writer thread fed through a bounded queue, and every file goes to the
+    least filled one.  A shard that a file would push past shard_size is
+    finished and replaced by a new one (a single file larger than shard_size
+    gets a shard of its own).  With align every shard's end is padded to
+    the boundary when it is finished.
+
+    Unsharded storage can go to a caller's writable file object (dat_file,
+    left open) instead of dat_fname.  Writes are charged to throttle (an
+    io_throttle.IOThrottle) where one is given.
+    """
+
+    def __init__(self, dat_fname, shard_size=None, shards=1, align=None, queue_depth=64, resume_offset=None,
+                 dat_file=None, throttle=None):
+        self.dat_fname = dat_fname
+        self.dat_file = dat_file
+        self.throttle = throttle
+        self.shard_size = shard_size
+        self.align = align
+        self.padding_bytes = 0
+        self.max_open = max(1, shards)
+        self.queue_depth = queue_depth
+        self.sharded = shard_size is not None or shards > 1
+        self.shard_sizes = []
+        self.open_shards = []
+        self.writers = {}
+        self.error = None
+        self.current = None
+        if not self.sharded:
+            self.current = self._open_shard(resume_offset)
+
+    @property
+    def offset(self):
+        return self.shard_sizes[self.current]
+
+    def _open_shard(self, resume_offset=None):
+        shard = len(self.shard_sizes)
+        self.shard_sizes.append(0)
+        if self.dat_file is not None:
+            f = self.dat_file
+        elif resume_offset is not None:
+            # Carry on after the last checkpointed payload of an interrupted build
+            f = open(shard_path(self.dat_fname, shard), 'r+b')
+            f.truncate(resume_offset)
+            f.seek(resume_offset)
+            self.shard_sizes[shard] = resume_offset
+        else:
+            f = open_output(shard_path(self.dat_fname, shard))
+        if self.sharded:
+            q = queue.Queue(self.queue_depth)
+            thread = threading.Thread(target=self._write_loop, args=(f, q), daemon=True)
+            thread.start()
+            self.writers[shard] = (f, q, thread)
+        else:
+            self.writers[shard] = (f, None, None)
+        self.open_shards.append(shard)
+        return shard
+
+    def _write_loop(self, f, q):
+        while True:
+            data = q.get()
+            if data is None:
+                return
+            if self.error is None:
+                try:
+                    self._write_file(f, data)
+                except Exception as e:
+                    self.error = e
+
+    def _write_file(self, f, data):
+        if self.throttle is not None:
+            self.throttle.write(len(data))
+        f.write(data)
+        if self.throttle is not None and f is not self.dat_file:
+            self.throttle.wrote(f, len(data))
+
+    def _finish_shard(self, shard):
+        if self.align:
+            self.current = shard
+            self.pad(self.align)
+        f, q, thread = self.writers.pop(shard)
+        if q is not None:
+            q.put(None)
+            thread.join()
+        if f is not self.dat_file:
+            if self.throttle is not None:
+                self.throttle.closing(f)
+            f.close()
+        self.open_shards.remove(shard)
+
+    def begin_file(self, size):
+        """
+        Pick the shard for the next file of about `size` bytes and make it current.
+        """
+        if self.sharded:
+            if len(self.open_shards) < self.max_open:
+                self._open_shard()
+            shard = min(self.open_shards, key=lambda s: self.shard_sizes[s])
+            if self.shard_size is not None and self.shard_sizes[shard] and \
+                    self.shard_sizes[shard] + size > self.shard_size:
+                self._finish_shard(shard)
+                shard = self._open_shard()
+            self.current = shard
+        return self.current
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        f, q, _ = self.writers[self.current]
+        if q is None:
+            self._write_file(f, data)
+        else:
+            q.put(bytes(data))
+        self.shard_sizes[self.current] += len(data)
+
+    def pad(self, boundary):
+        """
+        Zero-fill the current shard up to the next multiple of boundary;
+        returns the number of padding bytes.
+        """
+        padding = -self.offset % boundary
+        if padding:
+            self.write(bytes(padding))
+            self.padding_bytes += padding
+        return padding
+
+    def sync(self):
+        """
+        Make everything written so far durable (unsharded storage only).
+        """
+        f, q, _ = self.writers[self.current]
+        f.flush()
+        os.fsync(f.fileno())
+
+    def close(self):
+        for shard in list(self.open_shards):
+            self._finish_shard(shard)
+        if self.error is not None:
+            raise self.error
+
+    def shard_files(self):
+        if self.dat_file is not None:
+            return []
+        return [shard_path(self.dat_fname, shard) for shard in range(len(self.shard_sizes))]
+
+
+class SizingStorage(StorageWriter):
+    """
+    Stands in for StorageWriter in a dry run: places files in shards the
+    same way and keeps the offsets, padding and size of every shard, but
+    writes nothing.
+    """
+    pack_ref = None
+
+    def __init__(self, shard_size=None, shards=1, align=None):
+        StorageWriter.__init__(self, None, shard_size, shards, align)
+
+    @property
+    def size(self):
+        return sum(self.shard_sizes)
+
+    def _open_shard(self, resume_offset=None):
+        shard = len(self.shard_sizes)
+        self.shard_sizes.append(0)
+        self.open_shards.append(shard)
+        return shard
+
+    def _finish_shard(self, shard):
+        # Like StorageWriter, the end of every shard of an aligned .dat is padded
+        if self.align:
+            self.current = shard
+            self.pad(self.align)
+        self.open_shards.remove(shard)
+
+    def write(self, data):
+        self.shard_sizes[self.current] += len(data)
+
+    def reserve(self, length):
+        self.shard_sizes[self.current] += length
+
+    def sync(self):
+        pass
+
+    def shard_files(self):
+        return []
+
+
+class ByteCounter(object):
+    """
+    Write-only sink that counts what is written to it (dry runs).
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return len(data)
+
+
+# Dry-run time estimate assumptions, where nothing was measured
+DRY_RUN_READ_SPEED = 200 * 1048576
+DRY_RUN_WRITE_SPEED = 200 * 1048576
+DRY_RUN_ZLIB_SPEED = 40 * 1048576
+DRY_RUN_FILE_SECONDS = 0.0002   # open, pipeline hand-off and log lines per file
+DRY_RUN_SAMPLES = 32            # compression sample blocks per file
+
+
+def measure_speed(function, data):
+    start = time.perf_counter()
+    function(data)
+    return len(data) / max(time.perf_counter() - start, 1e-6)
+
+
+def estimate_build_seconds(scan_seconds, files, chunks, content_bytes, stored_bytes, compressed_bytes,
+                           samples=None, compress_level=6, strong_hash=None, read_rate=None, write_rate=None,
+                           iops=None):
+    """
+    Rough wall-clock estimate of a build, as {part: seconds}.  Reading is
+    overlapped with checksumming/compression and writing (PrefetchReader),
+    so the slowest of them counts, on top of the tree scan and a fixed
+    cost per file.  Checksum and hash speeds are measured here, zlib's on
+    the sampled content when there is some.
+    """
+    data = bytes(samples) if samples else os.urandom(0x100000)
+    cpu = stored_bytes / measure_speed(zlib.adler32, data)
+    if strong_hash:
+        cpu += stored_bytes / measure_speed(lambda block: hashlib.new(strong_hash, block).digest(), data)
+    if compressed_bytes:
+        zlib_speed = measure_speed(lambda block: zlib.compress(block, compress_level), data) if samples \
+            else DRY_RUN_ZLIB_SPEED
+        cpu += compressed_bytes / zlib_speed
+    reads = content_bytes / (read_rate or DRY_RUN_READ_SPEED)
+    writes = stored_bytes / (write_rate or DRY_RUN_WRITE_SPEED)
+    if iops:
+        # One bucket for chunk reads and writes
+        reads = max(reads, 2 * chunks / iops)
+    estimate = {
+        'scan': scan_seconds,
+        'files': files * DRY_RUN_FILE_SECONDS,
+        'reads': reads,
+        'cpu': cpu,
+        'writes': writes,
+    }
+    estimate['total'] = scan_seconds + estimate['files'] + max(reads, cpu, writes)
+    return estimate
+
+
+def print_dry_run(estimate):
+    artifacts = estimate['artifacts']
+    print("Dry run: nothing was read or written")
+    print("  tree        {} directories, {} files, {} nodes, {} copy table entries".format(
+        estimate['directories'], estimate['files'], estimate['nodes'], estimate['copy_entries']))
+    print("  content     {} bytes in {} chunks".format(estimate['content_bytes'], estimate['chunks']))
+    print("  .manifest   {} bytes (filename table {} bytes)".format(artifacts['manifest'],
+                                                                 estimate['filename_table_bytes']))
+    print("  .dat        {} bytes ({} padding), {}".format(artifacts['dat'], estimate['padding_bytes'],
+                                                          estimate['dat_estimate']))
+    print("  .index      {} bytes".format(artifacts['index']))
+    print("  .checksums  {} bytes, {} checksum entries ({})".format(
+        artifacts['checksums'], estimate['checksum_entries'], estimate['checksum_granularity']
+        if estimate['checksum_granularity'] == "file" else hex(estimate['checksum_granularity'])))
+    if 'hashes' in artifacts:
+        print("  .hashes     {} bytes".format(artifacts['hashes']))
+    seconds = estimate['seconds']
+    print("  build time  ~{:.1f}s (scan {:.1f}s, per file {:.1f}s, then the slowest of reads {:.1f}s, "
+          "CPU {:.1f}s, writes {:.1f}s)".format(seconds['total'], seconds['scan'], seconds['files'],
+                                               seconds['reads'], seconds['cpu'], seconds['writes']))
+
+
+def checksum_table_entries(checksum_counts, checksum_firsts=None):
+    """
+    Build the FileIdChecksumTableEntry array (ChecksumCount, FirstChecksumIndex
+    pairs) from the per-file checksum counts in one bulk operation.
+    """
+    file_id_count = len(checksum_counts)
+    entries = array('I', [0]) * (2 * file_id_count)
+    entries[0::2] = array('I', checksum_counts)
+    if checksum_firsts is None:
+        entries[1::2] = array('I', accumulate(checksum_counts, initial=0))[:file_id_count]
+    else:
+        entries[1::2] = array('I', checksum_firsts)
+    return entries
+
+
 ############################################
 # NEW FUNCTION for writing the .checksums file
 ############################################
@@ -125,255 +805,95 @@ def write_checksums_file(app_id, app_version, file_index_list, chunk_checksum_ma
       - ChecksumEntry array
       - 128-byte signature (placeholder)
     """
-    # We'll gather all checksums in a single list:
-    all_checksums = []
-    file_id_entries = []
+    checksum_counts = array('I')
+    all_checksums = array('I')
 
     # Build up our per-file records
     for file_id in file_index_list:
         # Retrieve the chunk checksums for this file from chunk_checksum_map
         chunk_list = chunk_checksum_map.get(file_id, [])
-        file_id_entries.append((len(chunk_list), len(all_checksums)))  # (ChecksumCount, FirstChecksumIndex)
+        checksum_counts.append(len(chunk_list))
         all_checksums.extend(chunk_list)
 
+    checksum_buffer = SpillBuffer()
+    checksum_buffer.append(uint32_le_bytes(all_checksums))
+    write_checksums_stream(app_id, app_version, checksum_counts, checksum_buffer, manifest_app_version)
+
+
+def write_checksums_stream(app_id, app_version, checksum_counts, checksum_buffer, manifest_app_version,
+                           checksum_firsts=None, output=None):
+    """
+    Streams a .checksums file from per-file checksum counts and a buffer of
+    packed ChecksumEntry values, without building the whole file in memory.
+    checksum_firsts gives each file's FirstChecksumIndex when the checksums
+    are not stored in file id order; by default they are consecutive.
+    output is the file name (default <app_id>_<version>.checksums) or a
+    writable file object, which is left open.
+    """
     # HeaderVersion = 1
     header_version = 1
-    # We'll figure out the ChecksumSize after we build the entire structure
 
     # For the table header
     format_code = 0x14893721
     dummy0 = 0x00000001
-    file_id_count = len(file_id_entries)
-    checksum_count = len(all_checksums)
-
-    # Build the container in memory
-    buffer = bytearray()
-
-    # 1) ChecksumDataContainer
-    #    struct { uint32_t HeaderVersion; uint32_t ChecksumSize; }
-    buffer += struct.pack("<II", header_version, 0)  # We'll patch ChecksumSize later
-
-    # 2) LatestApplicationVersion (because HeaderVersion != 0)
-    #    struct { uint32_t ApplicationVersion; }
-    buffer += struct.pack("<I", manifest_app_version)
-
-    # 3) FileIdChecksumTableHeader
-    buffer += struct.pack("<IIII", format_code, dummy0, file_id_count, checksum_count)
-
-    # 4) FileIdChecksumTableEntry array
-    #    struct { uint32_t ChecksumCount; uint32_t FirstChecksumIndex; }
-    for (c_count, first_idx) in file_id_entries:
-        buffer += struct.pack("<II", c_count, first_idx)
-
-    # 5) ChecksumEntry array
-    #    struct { uint32_t Checksum; }
-    for chk in all_checksums:
-        buffer += struct.pack("<I", chk)
+    file_id_count = len(checksum_counts)
+    checksum_count = len(checksum_buffer) // 4
+
+    # ChecksumSize is the # of bytes in the checksum section
+    # (excluding the ChecksumDataContainer *and* the following LatestApplicationVersion structure),
+    # so it is the table header plus both arrays.
+    checksum_size = 16 + file_id_count * 8 + checksum_count * 4
+
+    if output is None:
+        output = f"{app_id}_{app_version}.checksums"
+    with open_output(output) if isinstance(output, str) else contextlib.nullcontext(output) as f_out:
+        # 1) ChecksumDataContainer
+        #    struct { uint32_t HeaderVersion; uint32_t ChecksumSize; }
+        # 2) LatestApplicationVersion (because HeaderVersion != 0)
+        #    struct { uint32_t ApplicationVersion; }
+        # 3) FileIdChecksumTableHeader
+        # 4) FileIdChecksumTableEntry array
+        #    struct { uint32_t ChecksumCount; uint32_t FirstChecksumIndex; }
+        f_out.write(struct.pack("<IIIIIII", header_version, checksum_size, manifest_app_version,
+                                format_code, dummy0, file_id_count, checksum_count)
+                    + uint32_le_bytes(checksum_table_entries(checksum_counts, checksum_firsts)))
+
+        # 5) ChecksumEntry array
+        #    struct { uint32_t Checksum; }
+        for block in checksum_buffer.iter_blocks():
+            f_out.write(block)
 
     # The following is NOT used for Beta 1 checksums
     """# 6) 128-byte signature (placeholder)
     #    struct ChecksumSignature { uint8_t Signature[0x80]; }
     buffer += b'\x00' * 128"""
 
-    # Now patch the ChecksumSize in the container's first 8 bytes
-    # ChecksumSize = size of everything AFTER the ChecksumDataContainer + LatestApplicationVersion
-    # (which is 8 bytes + 4 bytes = 12 bytes total for those two),
-    # so basically len(buffer) - 8 (since the first 8 are: (HeaderVersion, ChecksumSize) )
-    # BUT we must not forget the 4 bytes for LatestApplicationVersion if we?re including that in the container.
-    # The C description says:
-    #   ChecksumSize is the # of bytes in the checksum section
-    #   (excluding this structure *and* the following LatestApplicationVersion structure).
-    # So we can skip the first 12 bytes in the calculation.
-    checksum_size = len(buffer) - 12
-
-    # Patch that in
-    struct.pack_into("<I", buffer, 4, checksum_size)
-
-    # Finally, write the buffer to a .checksums file
-    checksums_filename = f"{app_id}_{app_version}.checksums"
-    with open(checksums_filename, "wb") as f_out:
-        f_out.write(buffer)
-
-def generate_gcf(directory_path, app_id, app_version, fingerprint):
-    special_flags = load_special_flags()
-    manifest_data = bytearray()
-    filename_string = ""  # Root directory always starts with '00'
-    node_index = 0  # Initialize node index (0 is reserved for root)
-    file_count = 0  # Initialize file count
-    dat_file_data = []
-    index_data = {}
-    file_index = []
-    gcfdircopytable = bytearray()
-    hex_fingerprint = struct.pack('4s', fingerprint.encode('ascii'))
-
-    # Load the list of file paths from "minfootprint.txt"
-    # First check to see if there is an expanded wildcard temporary footprint file
-    if os.path.isfile("minfootprint_temp.txt"):
-        minfootprint_file_paths = parse_minfootprint_file("minfootprint_temp.txt")
-    else:
-        minfootprint_file_paths = parse_minfootprint_file()
-
-    # Define a structure to hold directory and file data
-    items = []
-
-    for root, dirs, files in os.walk(directory_path):
-        if root == directory_path:
-            parent_index = 0xffffffff
-        else:
-            parent_index = 0 if os.path.dirname(root) == directory_path else [item['index'] for item in items if item['path'] == os.path.relpath(os.path.dirname(root), directory_path)][0]
-
-        relative_root = os.path.relpath(root, directory_path)
 
-
-        items.append({
-            'type': 'dir',
-            'path': relative_root,
-            'parent': parent_index,
-            'index': node_index,
-        })
-        node_index += 1
-
-        for file in files:
-            relative_path = os.path.relpath(os.path.join(root, file), directory_path)
-            items.append({
-                'type': 'file',
-                'path': relative_path,
-                'parent': [item['index'] for item in items if item['path'] == os.path.relpath(root, directory_path)][0],
-                'index': node_index,
-            })
-            node_index += 1
-
-    # For checksums, we'll store them in chunk_checksum_map keyed by the file's index
-    chunk_checksum_map = {}
-
-    # Process items and generate manifest
-    for item in items:
-        parent_index = item['parent']
-        siblings = [i for i in items if i['parent'] == parent_index]
-        current_index = item['index']
-
-        next_index = 0
-        for idx, sibling in enumerate(siblings):
-            if sibling['index'] == current_index and idx < len(siblings) - 1:
-                next_index = siblings[idx + 1]['index']
-                break
-
-        if item['type'] == 'dir':
-            current_dir_index = item['index']
-
-            # Child count
-            child_count = sum(1 for i in items if i['parent'] == current_dir_index)
-
-            # Child index
-            children = [i for i in items if i['parent'] == current_dir_index]
-            child_index = children[0]['index'] if children else 0
-
-            # Add directory to manifest
-            manifest_data += struct.pack("<IIIIIII",
-                                         len(filename_string),
-                                         child_count,
-                                         0xffffffff,
-                                         0x00000000,
-                                         parent_index,
-                                         next_index,
-                                         child_index)
-
-            # Add directory to filename string
-            if item['path'] != ".":
-                directory_name = item['path'].split(os.sep)[-1]
-                filename_string += directory_name + "\x00"
-            else:
-                filename_string = "\x00"
-
-            print("Processed directory: {}, Index: {}, Parent Index: {}, Next Index: {}, Child Index: {}".format(
-                item['path'], current_dir_index, parent_index, next_index, child_index))
-
-        elif item['type'] == 'file':
-            file_count += 1
-            file_index.append(item['index'])
-            flag = special_flags.get(item['path'], 0x0000400a)
-
-            # Processing for gcfdircopytable
-            if item['path'] in minfootprint_file_paths:
-                print("file {} added to minfootprint table!".format(item['path']))
-                gcfdircopytable += struct.pack("<I", item['index'])
-
-            # Add file to manifest using the special flag
-            manifest_data += struct.pack("<IIIIIII",
-                                         len(filename_string),
-                                         0,
-                                         file_count,
-                                         flag,
-                                         parent_index,
-                                         next_index,
-                                         0)
-
-            print("Processing file: {}, Index: {}, Parent Index: {}, File Count: {}, Next File Index: {}".format(
-                item['path'], item['index'], parent_index, file_count, next_index))
-
-            # Process the file in chunks and compress each chunk
-            file_path = os.path.join(directory_path, item['path'])
-            content_size = os.path.getsize(file_path)
-            chunk_size = 0x10000
-            pool = Pool()
-            compressed_chunks = pool.map(process_file_chunk, [(file_path, chunk_size)])
-            pool.close()
-            pool.join()
-
-            # Flatten the list of compressed chunks
-            compressed_data = ''.join(compressed_chunks[0])
-
-            # Update index data
-            index_data[file_count] = {
-                'total_chunks': len(compressed_chunks[0]),
-                'chunks_info': [
-                    {'chunkID': i, 'offset': i * chunk_size, 'length': len(chunk)}
-                    for i, chunk in enumerate(compressed_chunks[0])
-                ]
-            }
-
-            dat_file_data.append(compressed_data)
-
-            # Calculate the per-chunk checksums for the .checksums file
-            file_chunk_checksums = []
-            for each_chunk in compressed_chunks[0]:
-                file_chunk_checksums.append(calculate_chunk_checksum(each_chunk))
-
-            # Save these checksums to chunk_checksum_map
-            # We'll look them up by file index
-            chunk_checksum_map[item['index']] = file_chunk_checksums
-
-            print("Processed {} chunks for file: {}".format(
-                len(compressed_chunks[0]), item['path']))
-
-            # Add file to filename string
-            filename_string += item['path'].split(os.sep)[-1] + "\x00"
-
-    # After processing all the chunks, concatenate them into a single string
-    dat_file_data = ''.join(dat_file_data)
-
-    if not gcfdircopytable:
-        for i in range(file_count):
-            gcfdircopytable += struct.pack("<I", file_index[i])
-
-    filename_string = filename_string.encode("utf-8")
-
-    while len(filename_string) % 4 != 0:
-        filename_string += b"\x00"
+def write_manifest(manifest_fname, app_id, app_version, fingerprint, node_count, file_count,
+                   node_records, filename_table, gcfdircopytable):
+    """
+    Stream a .manifest out of its sections (SpillBuffers of packed node
+    records, the 4-byte padded filename table and the copy table), computing
+    its checksum on the way.  manifest_fname may also be a writable file
+    object (left open); as it need not be seekable (a socket), the checksum
+    is then computed in a first pass over the sections instead.
+    """
+    hex_fingerprint = struct.pack('4s', fingerprint.encode('ascii'))
 
     # generate header of manifest file
     manif_version = 3  # Manifest Version
     manif_appid = app_id  # application id
     manif_appversion = int(app_version)  # application version
-    manif_num_nodes = item['index'] + 1  # total node count
-    manif_file_count = len(file_index)  # total file count
-    manif_dirnamesize = len(filename_string)  # total size of the filename string with the null bytes
+    manif_num_nodes = node_count  # total node count
+    manif_file_count = file_count  # total file count
+    manif_dirnamesize = len(filename_table)  # total size of the filename string with the null bytes
     manif_info1count = 1  # ymgve: 1, just 1
-    manif_copycount = len(file_index)  # Files that should be copied from the cache to the local drive
+    manif_copycount = len(gcfdircopytable) // 4  # Files that should be copied from the cache to the local drive
     manif_localcount = 0  # also known as user config files / files that should not be written over using cache files
     manif_compressedblocksize = 0x8000  # 8 byte compressed blocks
     manif_totalsize = 0x38 + manif_num_nodes * 0x1c + manif_dirnamesize + (manif_info1count + manif_num_nodes) * 4 + manif_copycount * 4 + manif_localcount * 4
 
+    # Fingerprint and checksum (0x30..0x38) are zero while the adler32 is computed
     manif = struct.pack("<IIIIIIIIIIIIII",
                         manif_version,
                         manif_appid,
@@ -390,45 +910,1161 @@ def generate_gcf(directory_path, app_id, app_version, fingerprint):
                         0,
                         0)
 
-    manif = manif[:0x1c] + struct.pack("<I", len(filename_string)) + manif[0x20:]
+    def iter_hashtable():
+        hashtable = array('I', [1])
+        for idx in range(manif_num_nodes - 1):
+            hashtable.append(idx)
+            if len(hashtable) >= 0x40000:
+                yield hashtable.tobytes()
+                hashtable = array('I')
+        hashtable.append((manif_num_nodes - 1) | 0x80000000)
+        yield hashtable.tobytes()
+
+    def iter_sections():
+        for section in (node_records.iter_blocks(), filename_table.iter_blocks(), iter_hashtable(),
+                        gcfdircopytable.iter_blocks()):
+            yield from section
+
+    if not isinstance(manifest_fname, str):
+        manifest_adler = zlib.adler32(manif, 0)
+        for block in iter_sections():
+            manifest_adler = zlib.adler32(block, manifest_adler)
+        manifest_fname.write(manif[:0x30] + hex_fingerprint + struct.pack("<I", manifest_adler & 0xFFFFFFFF))
+        for block in iter_sections():
+            manifest_fname.write(block)
+        return
+
+    # Stream the manifest out, computing its checksum on the way
+    with open_output(manifest_fname) as f:
+        manifest_adler = zlib.adler32(manif, 0)
+        f.write(manif)
+        for block in iter_sections():
+            manifest_adler = zlib.adler32(block, manifest_adler)
+            f.write(block)
+
+        # Checksums for manifest itself (no file checksums):
+        f.seek(0x30)
+        f.write(hex_fingerprint + struct.pack("<I", manifest_adler & 0xFFFFFFFF))
+
+
+class ManifestTables(object):
+    """
+    The node table, filename table and copy table of a .manifest, built
+    from a tree walk's events in order (every directory before its
+    entries, as walk_tree() and the content sources list them).  Nodes
+    are linked to their parent and previous sibling as they are added;
+    finish() patches the directories and pads the tables for
+    write_manifest().
+
+    The tables are SpillBuffers, given by the caller for memory-bounded
+    builds.  dedupe_names interns node names in the filename table: every
+    node with the same name points at a single copy of it.
+    """
+
+    def __init__(self, node_records=None, filename_table=None, gcfdircopytable=None, dedupe_names=False):
+        self.node_records = SpillBuffer() if node_records is None else node_records
+        self.filename_table = SpillBuffer() if filename_table is None else filename_table
+        self.gcfdircopytable = SpillBuffer() if gcfdircopytable is None else gcfdircopytable
+        self.node_count = 0
+        self.file_nodes = array('I')
+        # Relative path -> node index, and node index -> [child count, first child, last child]
+        self.dir_nodes = {}
+        self.dir_children = {}
+        self.name_offsets = {} if dedupe_names else None
+        self.distinct_names = 0
+        self.shared_names = 0
+        self.shared_name_bytes = 0
+
+    @property
+    def file_count(self):
+        return len(self.file_nodes)
+
+    def add_name(self, name):
+        """
+        Filename table offset of a node name, appending the name unless
+        it is interned there already.
+        """
+        if self.name_offsets is not None:
+            offset = self.name_offsets.get(name)
+            if offset is not None:
+                self.shared_names += 1
+                self.shared_name_bytes += len(name) + 1
+                return offset
+            self.name_offsets[name] = len(self.filename_table)
+        offset = len(self.filename_table)
+        self.filename_table.append(name + b"\x00")
+        return offset
+
+    def add_node(self, name, file_id, flags, parent_index):
+        """
+        Append a node record and link it to its parent and previous sibling
+        by patching the already written records.
+        """
+        current_index = self.node_count
+        self.node_records.append(struct.pack("<IIIIIII", self.add_name(name), 0, file_id, flags, parent_index, 0, 0))
+        if parent_index != 0xffffffff:
+            children = self.dir_children[parent_index]
+            if children[2] is None:
+                children[1] = current_index
+            else:
+                # Next index of the previous sibling
+                self.node_records.patch(children[2] * 0x1c + 20, struct.pack("<I", current_index))
+            children[0] += 1
+            children[2] = current_index
+        self.node_count += 1
+        return current_index
+
+    def add_dir(self, relative_root):
+        """
+        Add a directory node; child count, next and child index are patched
+        in later.  Returns (node index, parent index).
+        """
+        if relative_root == ".":
+            parent_index = 0xffffffff
+            name = b""
+        else:
+            parent_index = self.dir_nodes[os.path.dirname(relative_root) or "."]
+            name = relative_root.split(os.sep)[-1].encode("utf-8")
+        dir_index = self.add_node(name, 0xffffffff, 0x00000000, parent_index)
+        self.dir_nodes[relative_root] = dir_index
+        self.dir_children[dir_index] = [0, 0, None]
+        return dir_index, parent_index
+
+    def add_file(self, relative_path, flags, minfootprint=False):
+        """
+        Add the node of the next file id with its flags, and its copy table
+        entry when it is in the minimum footprint.  Returns (node index,
+        parent index).
+        """
+        # Archives do not list every directory's files right after it
+        parent_index = self.dir_nodes[os.path.dirname(relative_path) or "."]
+        node_index = self.add_node(relative_path.split(os.sep)[-1].encode("utf-8"), self.file_count + 1, flags,
+                                   parent_index)
+        self.file_nodes.append(node_index)
+        if minfootprint:
+            self.gcfdircopytable.append(struct.pack("<I", node_index))
+        return node_index, parent_index
+
+    def finish(self):
+        """
+        Patch the child count and first child of every directory, fill in
+        the copy table (every file, when no footprint was given) and pad the
+        filename table to 4 bytes.
+        """
+        for dir_index, (child_count, child_index, _) in self.dir_children.items():
+            self.node_records.patch(dir_index * 0x1c + 4, struct.pack("<I", child_count))
+            self.node_records.patch(dir_index * 0x1c + 24, struct.pack("<I", child_index))
+        self.dir_nodes.clear()
+        self.dir_children.clear()
+
+        if not len(self.gcfdircopytable):
+            self.gcfdircopytable.append(uint32_le_bytes(self.file_nodes))
+        while len(self.filename_table) % 4 != 0:
+            self.filename_table.append(b"\x00")
+        if self.name_offsets is not None:
+            self.distinct_names = len(self.name_offsets)
+            self.name_offsets = None
+
+    def write(self, manifest_fname, app_id, app_version, fingerprint):
+        write_manifest(manifest_fname, app_id, app_version, fingerprint, self.node_count, self.file_count,
+                       self.node_records, self.filename_table, self.gcfdircopytable)
+
+    def close(self):
+        for buffer in (self.node_records, self.filename_table, self.gcfdircopytable):
+            buffer.close()
+
+
+def memory_share(memory_limit, fraction):
+    """
+    A build table's share of memory_limit, or None when the build is not
+    memory-bounded.
+    """
+    return None if memory_limit is None else max(0x10000, int(memory_limit * fraction))
+
+
+class PayloadTables(object):
+    """
+    Everything a build keeps per payload besides the .dat: the .index
+    entries, the .checksums table and, optionally, the strong-hash table
+    of the .hashes and the file list of the .paths sidecar.  Payloads can
+    be recorded in any file id order (layouts, resumed builds); the tables
+    are indexed by file id.
+
+    The index, checksum and block digest tables are SpillBuffers that take
+    their share of memory_limit, like the manifest tables.  chunk_align,
+    sharded, pack_ref and zdict add the matching fields to the index
+    entries.
+    """
+
+    def __init__(self, chunk_size, memory_limit=None, spill_dir=None, strong_hash=None, path_index=False,
+                 chunk_align=None, sharded=False, pack_ref=None, zdict=None):
+        self.chunk_size = chunk_size
+        self.chunk_align = chunk_align
+        self.sharded = sharded
+        self.pack_ref = pack_ref
+        self.zdict_id = None if zdict is None else dictionary_id(zdict)
+        self.index_buffer = SpillBuffer(memory_share(memory_limit, 0.25), spill_dir)
+        self.checksum_buffer = SpillBuffer(memory_share(memory_limit, 0.25), spill_dir)
+        self.index_pickler = StreamingDictPickler(self.index_buffer)
+        self.checksum_counts = array('I')
+        self.checksum_firsts = array('I')
+        # Strong-hash sidecar: per file digest and per 0x8000 block digests
+        self.strong_hash = strong_hash
+        self.strong_digest_size = hashlib.new(strong_hash).digest_size if strong_hash else 0
+        self.strong_block_buffer = SpillBuffer(memory_share(memory_limit, 0.0625), spill_dir)
+        self.strong_file_digests = bytearray()
+        self.strong_counts = array('I')
+        self.strong_firsts = array('I')
+        # For the .paths sidecar: relative path, node index and flags per file id,
+        # and the payload's shard, size, offset and stored length
+        self.path_entries = [] if path_index else None
+        self.payload_locations = array('Q')
+
+    def add_path(self, relative_path, node_index, flags):
+        if self.path_entries is not None:
+            self.path_entries.append((relative_path, node_index, flags))
+
+    def _grow(self, file_count):
+        # Files recorded ahead of others leave zeroed slots for them
+        missing = file_count - len(self.checksum_counts)
+        if missing <= 0:
+            return
+        self.checksum_counts.extend(array('I', [0]) * missing)
+        self.checksum_firsts.extend(array('I', [0]) * missing)
+        if self.strong_hash:
+            self.strong_counts.extend(array('I', [0]) * missing)
+            self.strong_firsts.extend(array('I', [0]) * missing)
+            self.strong_file_digests.extend(bytes(self.strong_digest_size * missing))
+        if self.path_entries is not None:
+            self.payload_locations.extend(array('Q', [0]) * (4 * missing))
+
+    def record(self, file_id, payload):
+        """
+        Add a written (or replayed) payload to the index, checksum and sidecar tables.
+        """
+        self._grow(file_id)
+        slot = file_id - 1
+        file_chunk_checksums = payload['checksums']
+        self.checksum_counts[slot] = len(file_chunk_checksums)
+        self.checksum_firsts[slot] = len(self.checksum_buffer) // 4
+        self.checksum_buffer.append(uint32_le_bytes(file_chunk_checksums))
+        if self.strong_hash:
+            digest_size = self.strong_digest_size
+            self.strong_counts[slot] = len(payload['strong_blocks']) // digest_size
+            self.strong_firsts[slot] = len(self.strong_block_buffer) // digest_size
+            self.strong_file_digests[slot * digest_size:(slot + 1) * digest_size] = payload['strong']
+            self.strong_block_buffer.append(payload['strong_blocks'])
+        if self.path_entries is not None:
+            self.payload_locations[4 * slot:4 * slot + 4] = array(
+                'Q', (payload['shard'], payload['size'], payload['offset'], payload['length']))
+
+        index_entry = payload_index_entry(payload['offset'], payload['length'], payload['chunk_lengths'],
+                                          self.chunk_size, self.chunk_align, payload['level'])
+        if self.sharded:
+            index_entry['shard'] = payload['shard']
+        if self.pack_ref is not None:
+            index_entry['pack'] = self.pack_ref
+        if payload.get('zdict'):
+            index_entry['zdict'] = self.zdict_id
+        self.index_pickler.add(file_id, index_entry)
+
+    def finish(self):
+        self.index_pickler.finish()
+
+    def write_index(self, f):
+        for block in self.index_buffer.iter_blocks():
+            f.write(block)
+
+    def write_checksums(self, output, app_id, app_version):
+        write_checksums_stream(app_id, app_version, self.checksum_counts, self.checksum_buffer, int(app_version),
+                               checksum_firsts=self.checksum_firsts, output=output)
+
+    def write_hashes(self, f):
+        write_hashes_stream(f, self.strong_hash, self.strong_digest_size, self.strong_counts, self.strong_firsts,
+                            self.strong_file_digests, self.strong_block_buffer)
+
+    def write_paths(self, paths_fname):
+        write_path_index(paths_fname, (
+            (relative_path, node, file_id, self.payload_locations[4 * file_id - 4], flags)
+            + tuple(self.payload_locations[4 * file_id - 3:4 * file_id])
+            for file_id, (relative_path, node, flags) in enumerate(self.path_entries, 1)))
+        self.path_entries = None
+
+    def close(self):
+        for buffer in (self.index_buffer, self.checksum_buffer, self.strong_block_buffer):
+            buffer.close()
+
+
+def read_pipeline(events, source, chunk_size, prefetch_workers=2, prefetch_files=32):
+    """
+    (event, chunks) for every walk event, chunks being an iterator over a
+    'file' event's content.  With prefetch_workers the upcoming files are
+    read on background threads while the current one is checksummed and
+    written.
+    """
+    if prefetch_workers:
+        return PrefetchReader(chunk_size, prefetch_workers, prefetch_files, source=source).run(events)
+    return ((event, source.iter_chunks(event[2], chunk_size) if event[0] == 'file' else None)
+            for event in events)
+
+
+def split_events(events, source, split_size):
+    # Files big enough to split go to the BlockRangeReader instead of
+    # the read pipeline, as 'split' events
+    for event in events:
+        if event[0] == 'file' and source.size(event[2]) >= split_size and source.locate(event[2]) is not None:
+            event = ('split',) + event[1:]
+        yield event
+
+
+def part_events(events, first, last):
+    # A distributed build's worker walks every file but only writes
+    # its own; the others are passed on as 'skip' events
+    file_id = 0
+    for event in events:
+        if event[0] == 'file':
+            file_id += 1
+            if not first <= file_id <= last:
+                event = ('skip',) + event[1:]
+        yield event
+
+
+def estimate_events(events):
+    # A dry run's files are 'estimate' events, which nothing reads
+    for event in events:
+        yield ('estimate',) + event[1:] if event[0] == 'file' else event
+
+
+def resume_events(events, resume_records):
+    # Files the journal already has are passed on as 'replay' events,
+    # which the read pipeline does not read
+    file_id = 0
+    for event in events:
+        if event[0] == 'file':
+            file_id += 1
+            if file_id in resume_records:
+                event = ('replay',) + event[1:]
+        yield event
+
+
+def store_chunks(file_chunks, level):
+    # Inline counterpart of BlockRangeReader.run()
+    for chunk in file_chunks:
+        if level:
+            start = time.thread_time()
+            stored = zlib.compress(chunk, level)
+            yield stored, len(chunk), time.thread_time() - start, None
+        else:
+            yield chunk, len(chunk), 0.0, None
 
-    hashtable = struct.pack("<I", 1)
-    for idx in range(manif_num_nodes - 1):
-        hashtable += struct.pack("<I", idx)
-    hashtable += struct.pack("<I", (manif_num_nodes - 1) | 0x80000000)
 
-    final_manifest = manif + manifest_data + filename_string + hashtable + gcfdircopytable
+class PayloadWriter(object):
+    """
+    The payload stage of a build: compresses, checksums and writes every
+    file's chunks to the storage as they arrive and records the payload in
+    the PayloadTables.  Files that resume_records (the journal of a
+    resumed build, or the parts of a distributed build's merge) already
+    has are replayed from their record.  A distributed build's part puts
+    its payload records in part_records instead, for the merge.
+    """
 
-    # Checksums for manifest itself (no file checksums):
-    final_manifest = final_manifest[:0x30] + '\x00' * 8 + final_manifest[0x38:]
-    checksum_value = hex_fingerprint + struct.pack("<I", zlib.adler32(str(final_manifest), 0) & 0xFFFFFFFF)
-    final_manifest = final_manifest[:0x30] + checksum_value + final_manifest[0x38:]
+    def __init__(self, source, storage, tables, chunk_size=0x10000, compress='off', compress_level=6,
+                 planner=None, zdict=None, zdict_max_file=0x4000, align=None, align_chunks=False,
+                 checksum_granularity=0x10000, strong_hash=None, block_reader=None, journal=None,
+                 resume_records=None, part_records=None):
+        self.source = source
+        self.storage = storage
+        self.tables = tables
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.compress_level = compress_level
+        self.planner = planner
+        self.zdict = zdict
+        self.zdict_max_file = zdict_max_file
+        self.align = align
+        self.align_chunks = align_chunks
+        self.checksum_granularity = checksum_granularity
+        self.strong_hash = strong_hash
+        self.block_reader = block_reader
+        self.journal = journal
+        self.resume_records = {} if resume_records is None else resume_records
+        self.part_records = part_records
+        self.pooled = isinstance(storage, PooledStorageWriter)
+        self.payload_bytes = 0
+
+    def replay(self, file_id, relative_path):
+        payload = self.resume_records.pop(file_id)
+        self.storage.padding_bytes = payload['padding_bytes']
+        if self.planner is not None:
+            self.planner.replay(relative_path, payload['level'], payload['planned_by'], payload['estimated_ratio'],
+                                payload['size'], payload['length'], payload['compress_seconds'])
+        self.tables.record(file_id, payload)
+        self.payload_bytes += payload['length']
+        print("Replayed {} chunks for file: {}".format(len(payload['chunk_lengths']), relative_path))
+
+    def write(self, file_id, relative_path, file_path, file_chunks, split=False):
+        """
+        Compress, checksum and write one file's chunks to the .dat as they
+        arrive from the reader, then record it in the index and checksum
+        tables.  A split file is read and processed by the BlockRangeReader
+        instead.  A file that the journal of a resumed build already has
+        comes without chunks and is replayed from its journal record.
+        """
+        if file_chunks is None and not split:
+            self.replay(file_id, relative_path)
+            return
+        storage = self.storage
+        planner = self.planner
+
+        size = self.source.size(file_path) if split or storage.sharded or planner is not None else 0
+        stored_chunks = None
+        if self.zdict is not None and not split and size <= self.zdict_max_file:
+            # A small file is a single chunk: deflate it against the shared
+            # dictionary, or store it if that does not save enough
+            level, planned_by, estimated_ratio = self.compress_level, 'dict', None
+            data = b''.join(file_chunks)
+            start = time.thread_time()
+            deflated = deflate_with_dictionary(data, level, self.zdict)
+            seconds = time.thread_time() - start
+            if len(deflated) > len(data) * (1.0 - planner.min_saving):
+                level, deflated = STORE, data
+            stored_chunks = [(deflated, len(data), seconds, None)] if data else []
+        elif self.compress in ('auto', 'dict'):
+            level, planned_by, estimated_ratio = planner.plan(
+                relative_path, size, lambda ranges: self.source.read_ranges(file_path, ranges))
+        else:
+            level, planned_by, estimated_ratio = (self.compress_level if self.compress == 'on' else 0), \
+                self.compress, None
+        compress_seconds = 0.0
+        shard = storage.begin_file(size)
+        if self.align:
+            storage.pad(self.align)
+        file_offset = storage.offset
+        file_length = 0
+        file_size = 0
+        chunk_lengths = array('I')
+        file_checksums = MultiChecksum(seed=0, strong_hash=self.strong_hash, strong_blocks=True)
+        if split:
+            content_path, content_offset = self.source.locate(file_path)
+            stored_chunks = self.block_reader.run(content_path, content_offset, size, level)
+        elif stored_chunks is None:
+            stored_chunks = store_chunks(file_chunks, level)
+        for compressed_chunk, raw_length, chunk_seconds, blocks in stored_chunks:
+            file_size += raw_length
+            compress_seconds += chunk_seconds
+            if self.align_chunks:
+                storage.pad(self.align)
+            storage.write(compressed_chunk)
+            file_length += len(compressed_chunk)
+            chunk_lengths.append(len(compressed_chunk))
+            # Checksum the chunk for the .checksums file as it goes by
+            if blocks is None:
+                file_checksums.update(compressed_chunk)
+            else:
+                file_checksums.add_blocks(compressed_chunk, *blocks)
+        if self.pooled:
+            # The payload lands in the pack (or is found there) once it is complete
+            file_offset = storage.end_file()
+        file_checksums.finish()
+
+        payload = {
+            'shard': shard,
+            'offset': file_offset,
+            'length': file_length,
+            'size': file_size,
+            'chunk_lengths': chunk_lengths,
+            'checksums': file_checksums.checksums(self.checksum_granularity),
+            'strong': file_checksums.strong,
+            'strong_blocks': file_checksums.strong_blocks,
+            'level': level,
+            'planned_by': planned_by,
+            'estimated_ratio': estimated_ratio,
+            'compress_seconds': compress_seconds,
+            'zdict': planned_by == 'dict' and level != STORE,
+        }
+        # A part's payloads are only recorded by the merge
+        if self.part_records is None:
+            self.tables.record(file_id, payload)
+        self.payload_bytes += file_length
+        if planner is not None:
+            planner.record(relative_path, level, planned_by, estimated_ratio, file_size, file_length,
+                           compress_seconds)
+        if self.journal is not None:
+            self.journal.add(file_id, relative_path,
+                             dict(payload, end=storage.offset, padding_bytes=storage.padding_bytes))
+        if self.part_records is not None:
+            self.part_records[file_id] = dict(payload, end=storage.offset, padding_bytes=storage.padding_bytes)
+
+        print("Processed {} chunks for file: {}".format(len(chunk_lengths), relative_path))
+
+
+class PayloadEstimator(object):
+    """
+    Dry-run counterpart of PayloadWriter: places every file's payload in a
+    SizingStorage and records it in the PayloadTables from the file's size
+    alone, compressed by a sampled ratio (sample, with a planner) or not at
+    all, and adds up what the build would read, compress and checksum.
+    """
 
-    with open("{}_{}.manifest".format(app_id, app_version), "wb") as f:
-        f.write(final_manifest)
+    def __init__(self, source, storage, tables, chunk_size=0x10000, compress='off', compress_level=6,
+                 planner=None, sample=False, align=None, align_chunks=False, checksum_granularity=0x10000):
+        self.source = source
+        self.storage = storage
+        self.tables = tables
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.compress_level = compress_level
+        self.planner = planner
+        self.sample = sample
+        self.align = align
+        self.align_chunks = align_chunks
+        self.checksum_granularity = checksum_granularity
+        # Sampled input and compressed bytes per (extension, level), whose
+        # quotient is the ratio of the files the planner decides by
+        # extension, and up to 4 MB of sampled content
+        self.extension_samples = {}
+        self.samples = bytearray()
+        self.totals = {'content': 0, 'compressed': 0, 'chunks': 0, 'checksums': 0, 'sampling': 0.0}
+        self.payload_bytes = 0
+
+    def sampled_ratio(self, relative_path, file_path, size):
+        """
+        (level, ratio) the planner picks for a file from its sample blocks.
+        """
+        sampled_bytes = 0
+
+        def sampled(ranges):
+            nonlocal sampled_bytes
+            for data in self.source.read_ranges(file_path, ranges):
+                sampled_bytes += len(data)
+                if len(self.samples) < 0x400000:
+                    self.samples.extend(data)
+                yield data
+
+        start = time.perf_counter()
+        level, _, ratio = self.planner.plan(relative_path, size, sampled)
+        self.totals['sampling'] += time.perf_counter() - start
+        key = (os.path.splitext(relative_path)[1].lower(), level)
+        raw, compressed = self.extension_samples.get(key, (0, 0.0))
+        if ratio is None:
+            ratio = compressed / raw if raw else 1.0
+        elif sampled_bytes:
+            self.extension_samples[key] = (raw + sampled_bytes, compressed + ratio * sampled_bytes)
+        return level, 1.0 if level == STORE else ratio
+
+    def write(self, file_id, relative_path, file_path, file_chunks=None, split=False):
+        """
+        Record the payload of a file as the build would write it.
+        """
+        storage = self.storage
+        chunk_size = self.chunk_size
+        size = self.source.size(file_path)
+        level, ratio = STORE, 1.0
+        if self.compress != 'off':
+            level = self.compress_level
+            if self.sample and size:
+                level, ratio = self.sampled_ratio(relative_path, file_path, size)
+
+        chunk_lengths = array('I', (min(chunk_size, size - position) for position in range(0, size, chunk_size)))
+        if level:
+            chunk_lengths = array('I', (max(1, int(length * ratio)) for length in chunk_lengths))
+        shard = storage.begin_file(size)
+        if self.align:
+            storage.pad(self.align)
+        file_offset = storage.offset
+        for length in chunk_lengths:
+            if self.align_chunks:
+                storage.pad(self.align)
+            storage.reserve(length)
+        file_length = sum(chunk_lengths)
+        blocks = -(-file_length // 0x8000)
+        checksum_count = 1 if self.checksum_granularity == "file" else -(-file_length // self.checksum_granularity)
+        self.totals['content'] += size
+        self.totals['compressed'] += size if level else 0
+        self.totals['chunks'] += len(chunk_lengths)
+        self.totals['checksums'] += checksum_count
+        digest_size = self.tables.strong_digest_size
+        self.tables.record(file_id, {
+            'shard': shard,
+            'offset': file_offset,
+            'length': file_length,
+            'size': size,
+            'chunk_lengths': chunk_lengths,
+            'checksums': array('I', [0]) * checksum_count,
+            'strong': bytes(digest_size),
+            'strong_blocks': bytes(digest_size * blocks),
+            'level': level,
+        })
+        self.payload_bytes += file_length
+
+    def estimate(self, manifest_tables, app_id, app_version, fingerprint, seconds, pooled=False, read_rate=None,
+                 write_rate=None, iops=None):
+        """
+        The dry run's result once the tables are finished: the tree counts,
+        the size of every artifact, produced as by a build into byte
+        counters, and a rough build time (seconds is how long the dry run
+        took).  See print_dry_run().
+        """
+        storage = self.storage
+        tables = self.tables
+        artifacts = {'dat': storage.size, 'index': len(tables.index_buffer)}
+        counter = ByteCounter()
+        manifest_tables.write(counter, app_id, app_version, fingerprint)
+        artifacts['manifest'] = counter.count
+        counter = ByteCounter()
+        tables.write_checksums(counter, app_id, app_version)
+        artifacts['checksums'] = counter.count
+        if tables.strong_hash:
+            counter = ByteCounter()
+            tables.write_hashes(counter)
+            artifacts['hashes'] = counter.count
+        if self.compress == 'off':
+            dat_estimate = "exact"
+        elif self.sample:
+            dat_estimate = "compressed size estimated from samples"
+        else:
+            dat_estimate = "uncompressed upper bound (use dry_run='sample' to estimate compression)"
+        if pooled:
+            dat_estimate += ", before deduplication against the pool"
+        elif storage.sharded:
+            dat_estimate += ", over {} shards".format(len(storage.shard_sizes))
+        totals = self.totals
+        return {
+            'directories': manifest_tables.node_count - manifest_tables.file_count,
+            'files': manifest_tables.file_count,
+            'nodes': manifest_tables.node_count,
+            'copy_entries': len(manifest_tables.gcfdircopytable) // 4,
+            'content_bytes': totals['content'],
+            'chunks': totals['chunks'],
+            'checksum_entries': totals['checksums'],
+            'checksum_granularity': self.checksum_granularity,
+            'filename_table_bytes': len(manifest_tables.filename_table),
+            'padding_bytes': storage.padding_bytes,
+            'dat_estimate': dat_estimate,
+            'artifacts': artifacts,
+            'seconds': estimate_build_seconds(
+                seconds - totals['sampling'], manifest_tables.file_count, totals['chunks'], totals['content'],
+                storage.size, totals['compressed'], self.samples, self.compress_level, tables.strong_hash,
+                read_rate, write_rate, iops),
+        }
+
+
+def write_build_outputs(base_fname, app_id, app_version, fingerprint, manifest_tables, tables, storage, sinks=None,
+                        planner=None, zdict=None):
+    """
+    Write a finished build's .manifest, .index and .checksums (and its
+    .compression.csv, .zdict, .hashes and .paths when it has them), each to
+    base_fname plus its extension or to the caller's sink for it, which is
+    written to but left open.  Closes the tables.  Returns the files
+    written, the storage's .dat shards included.
+    """
+    sinks = sinks or {}
+    outputs = []
+
+    def output(kind, filename):
+        if kind in sinks:
+            return contextlib.nullcontext(sinks[kind])
+        outputs.append(filename)
+        return open_output(filename)
+
+    manifest_fname = base_fname + ".manifest"
+    if 'manifest' not in sinks:
+        outputs.append(manifest_fname)
+    manifest_tables.write(sinks.get('manifest', manifest_fname), app_id, app_version, fingerprint)
+    outputs.extend(storage.shard_files())
+
+    with output('index', base_fname + ".index") as f:
+        tables.write_index(f)
+
+    tables.write_checksums(sinks.get('checksums', base_fname + ".checksums"), app_id, app_version)
+    if 'checksums' not in sinks:
+        outputs.append(base_fname + ".checksums")
+
+    if planner is not None:
+        report_fname = base_fname + ".compression.csv"
+        planner.write_report(report_fname)
+        outputs.append(report_fname)
+        planner.print_summary()
+        print("Compression report written to {}".format(report_fname))
+    if zdict is not None:
+        with output('zdict', base_fname + ".zdict") as f:
+            f.write(zdict)
+    if tables.strong_hash:
+        with output('hashes', base_fname + ".hashes") as f:
+            tables.write_hashes(f)
+
+    manifest_tables.close()
+    tables.close()
+
+    if tables.path_entries is not None:
+        paths_fname = base_fname + ".paths"
+        tables.write_paths(paths_fname)
+        outputs.append(paths_fname)
+    return outputs
+
+
+def generate_gcf(directory_path, app_id, app_version, fingerprint, memory_limit=None, spill_dir=None,
+                 checksum_granularity=0x10000, prefetch_workers=2, prefetch_files=32,
+                 layout='walk', access_profile=None, align=None, align_chunks=False,
+                 shard_size=None, shards=1, cache_dir=None, cache_size=None, path_index=False,
+                 strong_hash=None, pool_dir=None, compress='off', compress_level=6, journal=False,
+                 checkpoint_interval=30.0, output_dir=None, sinks=None, special_flags=None, minfootprint=None,
+                 split_size=0x4000000, split_workers=4, read_rate=None, write_rate=None, iops=None,
+                 drop_cache=False, nice=None, zdict_size=0x8000, zdict_max_file=0x4000, zdict_file=None,
+                 part=None, payload_records=None, dedupe_names=False, dry_run=False):
+    """
+    Generate the .manifest, .dat, .index and .checksums files for a directory.
+
+    directory_path may also be a .zip or .tar(.gz/.bz2/.xz) archive, whose
+    members are built straight from the archive without unpacking it, or a
+    content source object (see content_source.py).  A compressed tar is
+    read in one pass as a stream, so it only supports the 'walk' layout and
+    not compress='auto'.
+
+    memory_limit (bytes) turns on the memory-bounded build: node records, the
+    filename table, the copy table, the index and the chunk checksums are kept
+    in SpillBuffers that move to temporary files (in spill_dir) once they pass
+    their share of the limit, and the final artifacts are assembled by
+    streaming those buffers.  Only a few bytes per file (file id, checksum
+    count) and one small record per directory stay in memory.
+
+    checksum_granularity picks what goes in the .checksums file: one adler32
+    per 0x10000 chunk (default), per 0x8000 block, or per "file".  All of them
+    come from the same pass over the data (see checksum_engine.MultiChecksum).
+
+    prefetch_workers reader threads read up to prefetch_files files ahead of
+    the checksum/write stage (see PrefetchReader); 0 reads every file in
+    line on the main thread.
+
+    Files of split_size bytes or more (64 MB by default) that are plain
+    files on disk (or members of an uncompressed tar) are not read by the
+    prefetch readers: split_workers threads pread, compress and checksum
+    their chunks in parallel and the chunks are written back in order (see
+    BlockRangeReader), so one huge file does not serialize the build.  The
+    outputs are the same either way; 0 for either turns it off.
+
+    For builds next to live serving (see io_throttle.py): read_rate and
+    write_rate cap the content reads and the .dat writes in bytes per
+    second and iops the chunk reads and writes per second; drop_cache
+    drops the read content and the written .dat from the page cache as
+    the build goes; nice lowers the priority of the calling thread and the
+    build's threads by that much.
+
+    layout decides the order of the payloads in the .dat (file ids and the
+    manifest are not affected):
+      'walk'      - os.walk order, as the files are found
+      'directory' - minfootprint files first, then files explicitly flagged
+                    executable/launch in special_file_flags.ini, then the
+                    rest grouped by directory
+      'profile'   - the same hot files first, then everything by descending
+                    hit count from the access_profile file
+    Any layout other than 'walk' keeps one small record per file in memory
+    until the tree has been walked.
+
+    align pads the .dat so every file payload (and, with align_chunks, every
+    chunk) starts on a multiple of that many bytes, e.g. 4096 for page-cache
+    and O_DIRECT friendly reads; the .dat end is padded too.  The index keeps
+    the padded offsets; chunk positions follow from 'chunk_align'
+    (see storage_extract.chunk_location).
+
+    shard_size / shards split the storage over several .dat shards of at
+    most shard_size bytes, `shards` of them written in parallel (see
+    StorageWriter); each index entry then records its 'shard'.
+
+    cache_dir enables the build cache (see build_cache.py): when the input
+    fingerprint was built before, its outputs are hard-linked into place
+    without building; otherwise the new outputs are added to the cache,
+    which is kept under cache_size bytes by LRU eviction.
+
+    path_index also writes <app_id>_<version>.paths, a sorted path -> file id
+    sidecar with each file's node index, flags, size and .dat location, for
+    binary-search lookups without parsing the manifest (see path_index.py).
+    Its records are kept in memory (about 40 bytes plus the path per file)
+    until the build ends.
+
+    strong_hash ('sha1', 'sha256', 'blake2b', ...) also writes
+    <app_id>_<version>.hashes with that digest of every file and of every
+    0x8000 block of its stored payload, computed in the same pass as the
+    adler32 checksums (see checksum_engine.write_hashes_stream).
+
+    pool_dir stores the payloads in the app's shared, content-addressed pack
+    in that directory instead of a .dat of their own: only files whose
+    content is not in the pack yet (from earlier versions) are appended, and
+    the index entries point into the pack (see storage_pool.py).  It cannot
+    be combined with sharding, alignment or the build cache.
+
+    compress picks how payload chunks are stored: 'off' (as is, default),
+    'on' (every chunk zlib-compressed at compress_level) or 'auto', where
+    compress_planner.CompressionPlanner samples each file and decides per
+    file (or per extension) between storing and a zlib level.  Compressed
+    files are marked with 'compressed' in their index entry.  'on' and
+    'auto' also write <app_id>_<version>.compression.csv with the size,
+    decision and CPU time of every file, and print a summary.  'dict' is
+    'auto' plus a shared preset dictionary for the many small files that
+    do not compress well on their own (see zlib_dictionary.py): a
+    dictionary of up to zdict_size bytes is trained from a sample of the
+    files of at most zdict_max_file bytes (or read from zdict_file, e.g.
+    the .zdict of an earlier version), each of those files is deflated
+    against it unless that saves too little, and it is written to
+    <app_id>_<version>.zdict; their index entries carry 'zdict', the
+    dictionary's adler32.
+
+    journal makes the build resumable: every finished payload is recorded
+    in <app_id>_<version>.journal, checkpointed (after syncing the .dat)
+    every checkpoint_interval seconds.  A build of the same inputs that
+    finds the journal of an interrupted run truncates the .dat to the last
+    checkpoint and replays the journaled files instead of reading them
+    again (see build_journal.py).  Not available for sharded or pooled
+    storage.
+
+    Outputs are written to output_dir (default: the working directory),
+    except the artifacts that sinks maps to a writable file object
+    ('manifest', 'dat', 'index', 'checksums', 'hashes', 'zdict'): those are streamed
+    to it and left open (see build_api.py).  The .dat can only go to a sink
+    when it is a single, unjournaled file, and the build cache needs every
+    artifact on disk.  special_flags ({relative path: flags}) and
+    minfootprint (relative paths) replace special_file_flags.ini and
+    minfootprint(_temp).txt of the working directory.
+
+    dedupe_names interns node names in the manifest's filename table: every
+    node with the same name ('models', 'sound', 'readme.txt') points at a
+    single copy of it, which shrinks the manifest of large trees.  The
+    distinct names are kept in memory until the walk ends.
+
+    part and payload_records are the two halves of a distributed build (see
+    distributed_build.py).  With part=(first, last) this is one of its
+    workers: the whole tree is walked, but only the payloads of file ids
+    first..last are read and written, to <app_id>_<version>.part<first>.dat,
+    and their payload records (as journaled) are added to the
+    payload_records dict; no other output is written.  Given payload_records
+    without part this is the merge: every file is replayed from its record
+    onto the .dat the parts were concatenated into, and the manifest, index,
+    checksums and sidecars are written as by a single build.  Both need the
+    'walk' layout and a single, unpooled, unjournaled .dat, and cannot use
+    compress='auto'/'dict', whose decisions depend on the files before.
+
+    dry_run plans the build without reading any payload or writing
+    anything: the tree is walked and the manifest, index and checksum
+    tables are built as usual, but from every file's size alone, and the
+    node and copy table counts, the size of every artifact and a rough
+    build time are printed and returned as a dict; the per-file lines of a
+    build are left out.  Without compression the sizes are exact, sharded
+    storage included (files are placed in shards as by StorageWriter and
+    the .dat size is the total of the shards); pooled storage is counted as
+    a .dat of its own, before deduplication against the pack, and without
+    the index entries' pack references.  With compression the .dat is its
+    uncompressed upper bound, or with dry_run='sample' estimated by reading
+    the compression planner's sample blocks: files decided by extension get
+    the ratio of all the bytes sampled for that extension and level.
+
+    Returns the list of written (or restored) output files.
+    """
+    if layout not in ('walk', 'directory', 'profile'):
+        raise ValueError("Unknown payload layout: {}".format(layout))
+    sinks = dict(sinks or {})
+    unknown_sinks = set(sinks) - {'manifest', 'dat', 'index', 'checksums', 'hashes', 'zdict'}
+    if unknown_sinks:
+        raise ValueError("Unknown output sinks: {}".format(", ".join(sorted(unknown_sinks))))
+    if sinks and cache_dir:
+        raise ValueError("The build cache needs the outputs on disk, not in sinks")
+    if 'dat' in sinks and (pool_dir or shard_size is not None or shards > 1 or journal):
+        raise ValueError("Only a single, unjournaled .dat can be written to a sink")
+    if dry_run and (part is not None or payload_records is not None):
+        raise ValueError("A dry run cannot be part of a distributed build")
+    if dry_run:
+        # Nothing is restored, journaled or written
+        cache_dir, journal, sinks = None, False, {}
+        dry_run_start = time.perf_counter()
+    source = open_source(directory_path)
+    owned_source = source is not directory_path
+    if (part is not None or payload_records is not None) and (
+            layout != 'walk' or pool_dir or shard_size is not None or shards > 1 or journal or cache_dir
+            or sinks or compress in ('auto', 'dict')):
+        raise ValueError("Distributed builds need the 'walk' layout, a single .dat and no cache, journal, sinks "
+                         "or compress='auto'/'dict'")
+    if source.sequential and (layout != 'walk' or compress in ('auto', 'dict')
+                              or (dry_run == 'sample' and compress != 'off')):
+        raise ValueError("{} can only be read in order: use the 'walk' layout, no compress='auto'/'dict' and no "
+                         "dry_run='sample' with compression".format(directory_path))
+
+    build_cache = None
+    input_key = None
+    if cache_dir or journal:
+        input_key = input_fingerprint(
+            source, app_id, app_version, fingerprint,
+            config_files=(() if minfootprint is not None else ("minfootprint_temp.txt", "minfootprint.txt"))
+            + (() if special_flags is not None else ("special_file_flags.ini",)) + (access_profile,),
+            options={
+                'minfootprint': None if minfootprint is None else sorted(minfootprint),
+                'special_flags': None if special_flags is None else sorted(special_flags.items()),
+                'generator': file_digest(__file__),
+                'checksum_granularity': checksum_granularity,
+                'layout': layout,
+                'align': align,
+                'align_chunks': align_chunks,
+                'shard_size': shard_size,
+                'shards': shards,
+                'path_index': path_index,
+                'strong_hash': strong_hash,
+                'compress': compress,
+                'compress_level': compress_level,
+                'dedupe_names': dedupe_names,
+                'zdict': None if compress != 'dict' else (
+                    zdict_size, zdict_max_file, file_digest(zdict_file) if zdict_file else None),
+            })
+    if cache_dir:
+        build_cache = BuildCache(cache_dir, cache_size)
+        restored = build_cache.restore(input_key, output_dir or '.')
+        if restored is not None:
+            print("Build cache hit ({}): restored {}".format(input_key[:16], ", ".join(restored)))
+            if owned_source:
+                source.close()
+            # The same paths a build writes, under output_dir
+            return [os.path.join(output_dir or "", name) for name in restored]
+        print("Build cache miss ({})".format(input_key[:16]))
+
+    throttle = None
+    if not dry_run and (read_rate or write_rate or iops or drop_cache or nice):
+        throttle = IOThrottle(read_rate, write_rate, iops, drop_cache, nice)
+        throttle.lower_priority()
+        source = ThrottledSource(source, throttle)
+        build_start = time.monotonic()
+
+    if align_chunks and not align:
+        raise ValueError("align_chunks needs an alignment boundary (align)")
+    if strong_hash and (strong_hash not in hashlib.algorithms_available or len(strong_hash) > 16):
+        raise ValueError("Unknown strong hash: {}".format(strong_hash))
+    if pool_dir and (shard_size is not None or shards > 1 or align or build_cache is not None):
+        raise ValueError("A pooled storage cannot be sharded, aligned or cached")
+    if compress not in ('off', 'on', 'auto', 'dict'):
+        raise ValueError("Unknown compression mode: {}".format(compress))
+    if journal and (pool_dir or shard_size is not None or shards > 1):
+        raise ValueError("Journaled builds need a single, non-pooled .dat")
+    if compress == 'dict' and zdict_max_file > 0x10000:
+        raise ValueError("zdict_max_file cannot be more than one chunk (0x10000 bytes)")
+    planner = CompressionPlanner() if compress != 'off' else None
+    if dry_run == 'sample' and compress != 'off':
+        # More sample blocks per file than a build takes, as the estimate
+        # is all a dry run reads for; with 'on', of the one level every file gets
+        planner = CompressionPlanner(samples=DRY_RUN_SAMPLES) if compress != 'on' else \
+            CompressionPlanner(levels=(compress_level,), min_saving=float('-inf'), samples=DRY_RUN_SAMPLES)
+    zdict = None
+    if compress == 'dict' and not dry_run:
+        if zdict_file:
+            with open(zdict_file, 'rb') as f:
+                zdict = f.read()[-MAX_DICTIONARY_SIZE:]
+        else:
+            zdict = train_dictionary(sample_small_files(source, zdict_max_file), zdict_size)
+        print("Compression dictionary: {} bytes{}".format(
+            len(zdict), " from " + zdict_file if zdict_file else " trained on files of up to {} bytes".format(
+                zdict_max_file)))
+        zdict = zdict or None
+    if special_flags is None:
+        special_flags = load_special_flags()
+    profile_hits = load_access_profile(access_profile) if layout == 'profile' else {}
+
+    manifest_tables = ManifestTables(SpillBuffer(memory_share(memory_limit, 0.25), spill_dir),
+                                     SpillBuffer(memory_share(memory_limit, 0.125), spill_dir),
+                                     SpillBuffer(memory_share(memory_limit, 0.0625), spill_dir), dedupe_names)
+    payload_jobs = []
+    hot_files = 0
+    hot_bytes = 0
 
-    # Saving the .dat file and .index file
-    with open("{}_{}.dat".format(app_id, app_version), "wb") as f:
-        f.write(dat_file_data)
+    file_count = 0  # Initialize file count
+    chunk_size = 0x10000
 
-    with open("{}_{}.index".format(app_id, app_version), "wb") as f:
-        pickle.dump(index_data, f)
+    # Load the list of file paths from "minfootprint.txt"
+    # First check to see if there is an expanded wildcard temporary footprint file
+    if minfootprint is not None:
+        minfootprint_file_paths = set(minfootprint)
+    elif os.path.isfile("minfootprint_temp.txt"):
+        minfootprint_file_paths = set(parse_minfootprint_file("minfootprint_temp.txt"))
+    else:
+        minfootprint_file_paths = set(parse_minfootprint_file())
+
+    base_fname = os.path.join(output_dir or "", f"{app_id}_{app_version}")
+    dat_fname = base_fname + ".dat" if part is None else "{}.part{}.dat".format(base_fname, part[0])
+    build_journal = None
+    resume_records = {}
+    resume_offset = None
+    if journal:
+        build_journal = BuildJournal(base_fname + ".journal", input_key, checkpoint_interval)
+        resume_records = build_journal.load()
+        if resume_records and os.path.exists(dat_fname):
+            resume_offset = max(payload['end'] for payload in resume_records.values())
+            print("Resuming from checkpoint: {} files already written, {} bytes of {}".format(
+                len(resume_records), resume_offset, dat_fname))
+        else:
+            resume_records = {}
+        build_journal.open(resume_records)
+    elif payload_records is not None and part is None:
+        # Merge of a distributed build: the parts' payloads are all in the .dat
+        resume_records = payload_records
+        resume_offset = max([payload['end'] for payload in resume_records.values()] + [0])
+
+    # In 'walk' layout payloads are read during the walk; otherwise the walk
+    # only builds the manifest and payloads are written afterwards in layout order
+    events = resume_events(source.events(), resume_records) if resume_records else source.events()
+    if part is not None:
+        events = part_events(events, *part)
+    if dry_run:
+        events = estimate_events(events)
+    block_reader = None
+    if split_size and split_workers:
+        block_reader = BlockRangeReader(chunk_size, split_workers, strong_hash=strong_hash, throttle=throttle)
+        events = split_events(events, source, split_size)
+    if layout == 'walk':
+        pipeline = read_pipeline(events, source, chunk_size, prefetch_workers, prefetch_files)
+    else:
+        pipeline = ((event, None) for event in events)
 
-    ###################################
-    # NEW CALL: write the .checksums file
-    ###################################
-    write_checksums_file(
-        app_id=app_id,
-        app_version=app_version,
-        file_index_list=file_index,
-        chunk_checksum_map=chunk_checksum_map,
-        manifest_app_version=manif_appversion
-    )
+    if dry_run:
+        storage = SizingStorage(shard_size, shards, align)
+    elif pool_dir:
+        storage = PooledStorageWriter(pool_dir, app_id, index_dir=output_dir or '.', spill_dir=spill_dir)
+    else:
+        storage = StorageWriter(dat_fname, shard_size, shards, align, resume_offset=resume_offset,
+                                dat_file=sinks.get('dat'), throttle=throttle)
+    if build_journal is not None:
+        build_journal.before_checkpoint = storage.sync
+    payload_tables = PayloadTables(chunk_size, memory_limit, spill_dir, strong_hash, path_index,
+                                   chunk_align=align if align_chunks else None, sharded=storage.sharded,
+                                   pack_ref=storage.pack_ref if pool_dir else None, zdict=zdict)
+    if dry_run:
+        payloads = PayloadEstimator(source, storage, payload_tables, chunk_size, compress, compress_level,
+                                    planner, sample=dry_run == 'sample', align=align, align_chunks=align_chunks,
+                                    checksum_granularity=checksum_granularity)
+    else:
+        payloads = PayloadWriter(source, storage, payload_tables, chunk_size, compress, compress_level, planner,
+                                 zdict=zdict, zdict_max_file=zdict_max_file, align=align,
+                                 align_chunks=align_chunks, checksum_granularity=checksum_granularity,
+                                 strong_hash=strong_hash, block_reader=block_reader, journal=build_journal,
+                                 resume_records=resume_records,
+                                 part_records=payload_records if part is not None else None)
+    try:
+        for event, file_chunks in pipeline:
+            if event[0] == 'dir':
+                relative_root = event[1]
+                # Add directory to manifest; child count, next and child index are patched in later
+                dir_index, parent_index = manifest_tables.add_dir(relative_root)
+                if not dry_run:
+                    print("Processed directory: {}, Index: {}, Parent Index: {}".format(
+                        relative_root, dir_index, parent_index))
+                continue
+
+            relative_path = event[1]
+            file_count += 1
+            flag = special_flags.get(relative_path, 0x0000400a)
+
+            # Add file to manifest using the special flag (and to the gcfdircopytable)
+            in_footprint = relative_path in minfootprint_file_paths
+            node_index, current_dir_index = manifest_tables.add_file(relative_path, flag, in_footprint)
+            payload_tables.add_path(relative_path, node_index, flag)
+
+            # A dry run of a large tree is not held up by a line per file
+            if not dry_run:
+                if in_footprint:
+                    print("file {} added to minfootprint table!".format(relative_path))
+                print("Processing file: {}, Index: {}, Parent Index: {}, File Count: {}".format(
+                    relative_path, node_index, current_dir_index, file_count))
+
+            if event[0] == 'skip':
+                pass
+            elif layout == 'walk':
+                payloads.write(file_count, relative_path, event[2], file_chunks, split=event[0] == 'split')
+            else:
+                # Hot files (minfootprint, explicitly executable/launch flagged) go first
+                explicit_flag = special_flags.get(relative_path)
+                is_hot = relative_path in minfootprint_file_paths or \
+                    (explicit_flag is not None and explicit_flag & LAUNCH_FLAGS)
+                tier = 0 if relative_path in minfootprint_file_paths else 1 if is_hot else 2
+                if is_hot:
+                    hot_files += 1
+                    hot_bytes += source.size(event[2])
+                if layout == 'profile':
+                    group = (-profile_hits.get(relative_path, 0), file_count)
+                else:
+                    group = (os.path.dirname(relative_path), os.path.basename(relative_path))
+                payload_jobs.append(((tier, group, file_count), (event[0], relative_path, event[2], file_count)))
+
+        if layout != 'walk':
+            payload_jobs.sort(key=lambda job: job[0])
+            for event, file_chunks in read_pipeline((job[1] for job in payload_jobs), source, chunk_size,
+                                                    prefetch_workers, prefetch_files):
+                payloads.write(event[3], event[1], event[2], file_chunks, split=event[0] == 'split')
+            payload_jobs = []
+            print("Payload layout '{}': {} hot files ({} bytes) at the start of the .dat".format(
+                layout, hot_files, hot_bytes))
+
+    finally:
+        if build_journal is not None:
+            build_journal.checkpoint()
+        storage.close()
+        if owned_source:
+            source.close()
+
+    if align:
+        print("Alignment to {:#x}{}: {} padding bytes on {} payload bytes ({:.2f}% overhead)".format(
+            align, " (per chunk)" if align_chunks else "", storage.padding_bytes, payloads.payload_bytes,
+            100.0 * storage.padding_bytes / payloads.payload_bytes if payloads.payload_bytes else 0.0))
+    if storage.sharded:
+        print("Storage written to {} shards: {}".format(len(storage.shard_sizes), ", ".join(storage.shard_files())))
+    if part is not None:
+        manifest_tables.close()
+        payload_tables.close()
+        print("Part {}-{}: {} payloads, {} bytes written to {}".format(
+            part[0], part[1], len(payload_records), storage.offset, dat_fname))
+        return [dat_fname]
+
+    payload_tables.finish()
+
+    manifest_tables.finish()
+    if dedupe_names:
+        print("Filename table: {} bytes, {} distinct names; {} nodes share a name ({} bytes saved)".format(
+            len(manifest_tables.filename_table), manifest_tables.distinct_names, manifest_tables.shared_names,
+            manifest_tables.shared_name_bytes))
+
+    if dry_run:
+        estimate = payloads.estimate(manifest_tables, app_id, app_version, fingerprint,
+                                     time.perf_counter() - dry_run_start, pooled=bool(pool_dir),
+                                     read_rate=read_rate, write_rate=write_rate, iops=iops)
+        manifest_tables.close()
+        payload_tables.close()
+        print_dry_run(estimate)
+        return estimate
+
+    outputs = write_build_outputs(base_fname, app_id, app_version, fingerprint, manifest_tables, payload_tables,
+                                  storage, sinks, planner, zdict)
+    if build_cache is not None:
+        build_cache.store(input_key, outputs)
+    if build_journal is not None:
+        build_journal.close(completed=True)
+    if throttle is not None:
+        throttle.print_summary(time.monotonic() - build_start)
+    return outputs
+
+
+def parse_cli_options(argv):
+    """
+    Split "--name=value" options out of the argument list.
+    Returns (positional arguments, {name: value}) with dashes in names turned into underscores.
+    """
+    positional = []
+    options = {}
+    for arg in argv:
+        if arg.startswith("--"):
+            name, _, value = arg[2:].partition("=")
+            options[name.replace("-", "_")] = value
+        else:
+            positional.append(arg)
+    return positional, options
 
 
 if __name__ == "__main__":
     import sys
 
+    sys.argv, cli_options = parse_cli_options(sys.argv)
+
     if (len(sys.argv) < 2 or (len(sys.argv) < 5 and sys.argv[1].lower() != "help")):
         print("Usage: python manifest_generator.py <directory_path> <app_id> <app version> <unique 4 character fingerprint>")
         print("Or for general usage and help use: python manifest_generator.py help")
@@ -496,18 +2132,132 @@ if __name__ == "__main__":
         print("For help related to the different flags (special_file_flags.ini) use the command help flags")
         print("")
         print("------------------------------------------------------------------------------------------------------------")
-        print("Usage: python manifest_generator.py <directory_path> <app_id> <app version> <unique 4 character fingerprint>")
+        print("Usage: python manifest_generator.py <directory_path> <app_id> <app version> <unique 4 character fingerprint> [options]")
         print("Or for help use: python manifest_generator.py help")
+        print("<directory_path> may also be a .zip or .tar(.gz/.bz2/.xz) archive, built without unpacking it")
+        print("")
+        print("Options:")
+        print(" --memory-limit=<size>  Memory-bounded build: keep at most about <size> (e.g. 512M, 4G) of build tables in memory,")
+        print("                        spilling node records, filenames, index and checksums to temporary files")
+        print(" --spill-dir=<dir>      Directory for the temporary spill files (default: system temp directory)")
+        print(" --checksum-granularity=<0x10000|0x8000|file>")
+        print("                        One .checksums entry per 64 KB chunk (default), per 32 KB block or per whole file")
+        print(" --prefetch-workers=<n> Reader threads prefetching upcoming files while the current one is written (default 2, 0 = off)")
+        print(" --prefetch-files=<n>   How many files may be read ahead (default 32)")
+        print(" --split-size=<size>    Files of at least <size> are read, compressed and checksummed in parallel")
+        print("                        block ranges (default 64M, 0 = never)")
+        print(" --split-workers=<n>    Threads per split file (default 4)")
+        print(" --read-rate=<size>     Cap content reads at <size> bytes per second (e.g. 50M)")
+        print(" --write-rate=<size>    Cap .dat writes at <size> bytes per second")
+        print(" --iops=<n>             Cap chunk reads and writes at <n> per second")
+        print(" --drop-cache           Drop the read content and the written .dat from the page cache as the build goes")
+        print(" --nice[=<n>]           Run the build at a lower CPU/IO priority (default 10)")
+        print(" --layout=<walk|directory|profile>")
+        print("                        Order of payloads in the .dat: as walked (default), minfootprint/launch files first")
+        print("                        then grouped by directory, or hot files first then by access profile hit count")
+        print(" --access-profile=<file> Access-frequency profile, one <relative path>=<hits> per line (implies --layout=profile)")
+        print(" --align=<size>         Start every file payload in the .dat on a multiple of <size> (e.g. 4096)")
+        print(" --align-chunks         Also start every chunk on that boundary")
+        print(" --shard-size=<size>    Split the storage into .dat shards of at most <size> (e.g. 2G)")
+        print(" --shards=<n>           Number of shards written in parallel (default 1, or 4 with --shard-size)")
+        print(" --cache-dir=<dir>      Reuse the outputs of an earlier build with identical inputs and options")
+        print(" --cache-size=<size>    Evict least recently used cache entries beyond <size> (default 20G)")
+        print(" --path-index           Also write a sorted path -> file id sidecar (.paths) for fast lookups, see path_index.py")
+        print(" --dedupe-names         Store each distinct file/directory name once in the manifest's filename table")
+        print(" --dry-run[=sample]     Print the node counts, artifact sizes and a build time estimate from the tree scan")
+        print("                        only, writing nothing; =sample reads sample blocks to estimate compression")
+        print(" --strong-hash=<sha1|sha256|blake2b|...>")
+        print("                        Also write a .hashes sidecar with that digest per file and per 32 KB block")
+        print(" --compress=<off|on|auto|dict>")
+        print("                        Store chunks as is (default), zlib-compress every file, or let a sampling planner")
+        print("                        decide per file / extension (writes a .compression.csv report); dict also deflates")
+        print("                        small files against a shared dictionary written to a .zdict file")
+        print(" --compress-level=<n>   zlib level for --compress=on and dictionary-compressed files (default 6)")
+        print(" --zdict-size=<size>    Size of the trained dictionary (default and most 32K)")
+        print(" --zdict-max-file=<size> Files of at most <size> use the dictionary (default 16K, at most 64K)")
+        print(" --zdict-file=<file>    Use this dictionary (e.g. an earlier version's .zdict) instead of training one")
+        print(" --journal              Checkpoint progress to a .journal so an interrupted build resumes where it stopped")
+        print(" --checkpoint-interval=<seconds>  Time between checkpoints (default 30)")
+        print(" --pool=<dir>           Store payloads in the app's shared pack in <dir> instead of a .dat, appending only")
+        print("                        content earlier versions did not have (compact with storage_pool.py)")
         sys.exit(1)
 
-    print("...Expanding Wildcard (*) entries (if any) in minfootprint.txt...")
-    expand_wildcards_in_minfootprint()
-
     directory_path = sys.argv[1]
 
+    print("...Expanding Wildcard (*) entries (if any) in minfootprint.txt...")
+    if os.path.isdir(directory_path):
+        expand_wildcards_in_minfootprint(directory_path)
+
     app_id = int(sys.argv[2], 16)  # Taking app_id in hex format from command line argument
 
     app_version = "".join(re.findall(r'\d', sys.argv[3]))  # Extracting only numbers from app_version
     fingerprint = sys.argv[4]
 
-    generate_gcf(directory_path, app_id, app_version, fingerprint)
+    build_options = {}
+    if "memory_limit" in cli_options:
+        build_options["memory_limit"] = parse_size(cli_options["memory_limit"])
+    if "spill_dir" in cli_options:
+        build_options["spill_dir"] = cli_options["spill_dir"]
+    if "checksum_granularity" in cli_options:
+        build_options["checksum_granularity"] = parse_granularity(cli_options["checksum_granularity"])
+    if "prefetch_workers" in cli_options:
+        build_options["prefetch_workers"] = int(cli_options["prefetch_workers"])
+    if "prefetch_files" in cli_options:
+        build_options["prefetch_files"] = int(cli_options["prefetch_files"])
+    if "split_size" in cli_options:
+        build_options["split_size"] = parse_size(cli_options["split_size"])
+    if "split_workers" in cli_options:
+        build_options["split_workers"] = int(cli_options["split_workers"])
+    if "read_rate" in cli_options:
+        build_options["read_rate"] = parse_size(cli_options["read_rate"])
+    if "write_rate" in cli_options:
+        build_options["write_rate"] = parse_size(cli_options["write_rate"])
+    if "iops" in cli_options:
+        build_options["iops"] = int(cli_options["iops"])
+    if "drop_cache" in cli_options:
+        build_options["drop_cache"] = True
+    if "nice" in cli_options:
+        build_options["nice"] = int(cli_options["nice"] or 10)
+    if "layout" in cli_options:
+        build_options["layout"] = cli_options["layout"]
+    if "access_profile" in cli_options:
+        build_options["access_profile"] = cli_options["access_profile"]
+        build_options.setdefault("layout", "profile")
+    if "align" in cli_options:
+        build_options["align"] = parse_size(cli_options["align"])
+    if "align_chunks" in cli_options:
+        build_options["align_chunks"] = True
+    if "shard_size" in cli_options:
+        build_options["shard_size"] = parse_size(cli_options["shard_size"])
+        build_options["shards"] = 4
+    if "shards" in cli_options:
+        build_options["shards"] = int(cli_options["shards"])
+    if "cache_dir" in cli_options:
+        build_options["cache_dir"] = cli_options["cache_dir"]
+        build_options["cache_size"] = parse_size(cli_options.get("cache_size", "20G"))
+    if "path_index" in cli_options:
+        build_options["path_index"] = True
+    if "strong_hash" in cli_options:
+        build_options["strong_hash"] = cli_options["strong_hash"].lower()
+    if "pool" in cli_options:
+        build_options["pool_dir"] = cli_options["pool"]
+    if "compress" in cli_options:
+        build_options["compress"] = cli_options["compress"].lower()
+    if "compress_level" in cli_options:
+        build_options["compress_level"] = int(cli_options["compress_level"])
+    if "zdict_size" in cli_options:
+        build_options["zdict_size"] = parse_size(cli_options["zdict_size"])
+    if "zdict_max_file" in cli_options:
+        build_options["zdict_max_file"] = parse_size(cli_options["zdict_max_file"])
+    if "zdict_file" in cli_options:
+        build_options["zdict_file"] = cli_options["zdict_file"]
+    if "dedupe_names" in cli_options:
+        build_options["dedupe_names"] = True
+    if "dry_run" in cli_options:
+        build_options["dry_run"] = "sample" if cli_options["dry_run"].lower() == "sample" else True
+    if "journal" in cli_options:
+        build_options["journal"] = True
+    if "checkpoint_interval" in cli_options:
+        build_options["checkpoint_interval"] = float(cli_options["checkpoint_interval"])
+
+    generate_gcf(directory_path, app_id, app_version, fingerprint, **build_options)
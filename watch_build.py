@@ -0,0 +1,424 @@
+##############################################################################
+# Watch mode for the threaded manifest generator.
+#
+# Keeps a content tree "hot": after one full build the tree listing, the
+# flag/footprint resolution and every file's payload location, chunk
+# lengths and checksums stay in memory.  Filesystem changes are picked up
+# with inotify (Linux) or by polling the tree's stat data, and only what
+# they affect is redone:
+#   - a changed or new file is read once and its payload appended to the
+#     .dat (the old bytes become garbage until the next compaction)
+#   - the .manifest is only rewritten when files/directories are added,
+#     removed or renamed, or a config file changes (it holds no sizes or
+#     checksums, so content edits never touch it)
+#   - the .index and .checksums are re-emitted from memory
+# The .dat is compacted (rewritten in walk order) once its garbage passes
+# compact_ratio of the live payload bytes.
+#
+# Usage: python watch_build.py <directory_path> <app_id> <app version> <fingerprint> [options]
+##############################################################################
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from array import array
+
+from checksum_engine import MultiChecksum, parse_granularity
+from checksum_generator import uint32_le_bytes
+from content_source import iter_file_chunks, walk_tree
+from threaded_manifest_generator import (ManifestTables, SpillBuffer, StreamingDictPickler, load_special_flags,
+                                         open_output, parse_cli_options, parse_minfootprint_file, parse_size,
+                                         payload_index_entry, write_checksums_stream)
+
+CONFIG_FILES = ("minfootprint_temp.txt", "minfootprint.txt", "special_file_flags.ini")
+
+
+def file_stamp(filename):
+    """
+    (size, mtime_ns) of a file, or None if it does not exist.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class InotifyWatcher(object):
+    """
+    Recursive inotify watch on a directory tree (through libc with ctypes).
+
+    wait(timeout) returns None when nothing happened, otherwise a
+    (changed relative paths, structural) pair; structural is True when
+    entries were created, deleted or moved, i.e. the tree listing changed.
+    """
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0x80000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+        IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    STRUCTURAL = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | \
+        IN_Q_OVERFLOW
+
+    def __init__(self, directory_path, settle=0.1):
+        self.directory_path = directory_path
+        self.settle = settle
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches = {}
+        self.add_tree(".")
+
+    def add_tree(self, relative_root):
+        for root, dirs, files in os.walk(os.path.join(self.directory_path, relative_root)):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, "inotify_add_watch {}: {}".format(root, os.strerror(errno)))
+            self.watches[wd] = os.path.relpath(root, self.directory_path)
+
+    def _read_events(self, changed):
+        structural = False
+        data = os.read(self.fd, 0x10000)
+        pos = 0
+        while pos + 16 <= len(data):
+            wd, mask, cookie, name_len = struct.unpack_from("iIII", data, pos)
+            name = data[pos + 16:pos + 16 + name_len].rstrip(b"\0")
+            pos += 16 + name_len
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if mask & self.STRUCTURAL:
+                structural = True
+            root = self.watches.get(wd)
+            if root is None or not name:
+                continue
+            relative_path = os.path.normpath(os.path.join(root, os.fsdecode(name)))
+            changed.add(relative_path)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self.add_tree(relative_path)
+        return structural
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return None
+        changed = set()
+        structural = self._read_events(changed)
+        # Let a burst of events (an editor save, a copy) settle into one rebuild
+        deadline = time.monotonic() + 5 * self.settle
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([self.fd], [], [], self.settle)
+            if not readable:
+                break
+            structural = self._read_events(changed) or structural
+        return changed, structural
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Fallback for platforms without inotify: every wait() asks for a full
+    stat-only rescan of the tree.
+    """
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return set(), True
+
+    def close(self):
+        pass
+
+
+class WatchBuilder(object):
+    """
+    In-memory build state of one content tree.  refresh() brings the four
+    output files up to date with the tree and returns True if anything
+    was re-emitted.
+    """
+
+    def __init__(self, directory_path, app_id, app_version, fingerprint, checksum_granularity=0x10000,
+                 align=None, compact_ratio=0.5):
+        self.directory_path = directory_path
+        self.app_id = app_id
+        self.app_version = app_version
+        self.fingerprint = fingerprint
+        self.checksum_granularity = checksum_granularity
+        self.align = align
+        self.compact_ratio = compact_ratio
+        self.chunk_size = 0x10000
+        self.base_name = "{}_{}".format(app_id, app_version)
+        self.dat_fname = self.base_name + ".dat"
+
+        self.listing = None         # walk_tree() events of the last scan
+        self.payloads = {}          # relative path -> payload record
+        self.config_stamps = None
+        self.special_flags = {}
+        self.minfootprint_file_paths = set()
+        self.dat_size = 0
+        self.garbage_bytes = 0
+
+    def load_config(self):
+        """
+        (Re)load special_file_flags.ini and the minfootprint file if they
+        changed; returns True when they did.
+        """
+        stamps = [file_stamp(name) for name in CONFIG_FILES]
+        if stamps == self.config_stamps:
+            return False
+        self.config_stamps = stamps
+        self.special_flags = load_special_flags()
+        if os.path.isfile("minfootprint_temp.txt"):
+            self.minfootprint_file_paths = set(parse_minfootprint_file("minfootprint_temp.txt"))
+        elif os.path.isfile("minfootprint.txt"):
+            self.minfootprint_file_paths = set(parse_minfootprint_file())
+        else:
+            self.minfootprint_file_paths = set()
+        return True
+
+    def read_payload(self, relative_path, file_path, stamp):
+        """
+        Append one file's payload to the end of the .dat and return its
+        record: stat stamp, offset, length, chunk lengths and checksums.
+        """
+        with open(self.dat_fname, 'r+b') as dat:
+            dat.seek(self.dat_size)
+            if self.align:
+                padding = -self.dat_size % self.align
+                dat.write(bytes(padding))
+                self.dat_size += padding
+                self.garbage_bytes += padding
+            offset = self.dat_size
+            chunk_lengths = array('I')
+            file_checksums = MultiChecksum(seed=0)
+            for chunk in iter_file_chunks(file_path, self.chunk_size):
+                dat.write(chunk)
+                chunk_lengths.append(len(chunk))
+                file_checksums.update(chunk)
+            length = sum(chunk_lengths)
+            self.dat_size += length
+        print("Processed {} chunks for file: {}".format(len(chunk_lengths), relative_path))
+        return {
+            'stamp': stamp,
+            'offset': offset,
+            'length': length,
+            'chunk_lengths': chunk_lengths,
+            'checksums': file_checksums.finish().checksums(self.checksum_granularity),
+        }
+
+    def update_payloads(self, paths):
+        """
+        Re-read the files among paths whose stat data changed.
+        Returns the number of payloads rewritten.
+        """
+        rewritten = 0
+        for relative_path in paths:
+            file_path = os.path.join(self.directory_path, relative_path)
+            stamp = file_stamp(file_path)
+            old = self.payloads.get(relative_path)
+            if stamp is None or (old is not None and old['stamp'] == stamp):
+                continue
+            record = self.read_payload(relative_path, file_path, stamp)
+            if old is not None:
+                self.garbage_bytes += old['length']
+            self.payloads[relative_path] = record
+            rewritten += 1
+        return rewritten
+
+    def compact(self):
+        """
+        Rewrite the .dat with only the live payloads, in walk order.
+        """
+        temp_fname = self.dat_fname + ".compact"
+        offset = 0
+        with open(self.dat_fname, 'rb') as old_dat, open_output(temp_fname) as new_dat:
+            for event in self.listing:
+                if event[0] != 'file':
+                    continue
+                record = self.payloads[event[1]]
+                if self.align:
+                    padding = -offset % self.align
+                    new_dat.write(bytes(padding))
+                    offset += padding
+                old_dat.seek(record['offset'])
+                remaining = record['length']
+                while remaining:
+                    block = old_dat.read(min(0x100000, remaining))
+                    if not block:
+                        raise IOError("{} is shorter than its index".format(self.dat_fname))
+                    new_dat.write(block)
+                    remaining -= len(block)
+                record['offset'] = offset
+                offset += record['length']
+        os.replace(temp_fname, self.dat_fname)
+        print("Compacted {}: dropped {} garbage bytes".format(self.dat_fname, self.dat_size - offset))
+        self.dat_size = offset
+        self.garbage_bytes = 0
+
+    def emit_manifest(self):
+        """
+        Build the manifest tables from the listing (as generate_gcf does)
+        and write the .manifest.
+        """
+        manifest_tables = ManifestTables()
+        for event in self.listing:
+            if event[0] == 'dir':
+                manifest_tables.add_dir(event[1])
+            else:
+                relative_path = event[1]
+                manifest_tables.add_file(relative_path, self.special_flags.get(relative_path, 0x0000400a),
+                                         relative_path in self.minfootprint_file_paths)
+        manifest_tables.finish()
+        manifest_tables.write(self.base_name + ".manifest", self.app_id, self.app_version, self.fingerprint)
+        manifest_tables.close()
+
+    def emit_index_and_checksums(self):
+        """
+        Write the .index and .checksums of the current payloads in file id order.
+        """
+        index_buffer = SpillBuffer()
+        checksum_buffer = SpillBuffer()
+        index_pickler = StreamingDictPickler(index_buffer)
+        checksum_counts = array('I')
+        file_id = 0
+        for event in self.listing:
+            if event[0] != 'file':
+                continue
+            file_id += 1
+            record = self.payloads[event[1]]
+            index_pickler.add(file_id, payload_index_entry(record['offset'], record['length'],
+                                                           record['chunk_lengths'], self.chunk_size))
+            checksum_counts.append(len(record['checksums']))
+            checksum_buffer.append(uint32_le_bytes(record['checksums']))
+        index_pickler.finish()
+
+        with open_output(self.base_name + ".index") as f:
+            for block in index_buffer.iter_blocks():
+                f.write(block)
+        write_checksums_stream(self.app_id, self.app_version, checksum_counts, checksum_buffer,
+                               int(self.app_version))
+
+    def refresh(self, changed=None, structural=True):
+        """
+        Bring the outputs up to date.  changed is the set of relative paths
+        reported by the watcher; with structural (or on the first call) the
+        tree listing is rescanned with stat only and every file is checked.
+        """
+        start = time.monotonic()
+        config_changed = self.load_config()
+        manifest_dirty = config_changed
+
+        if self.listing is None:
+            with open_output(self.dat_fname):
+                pass
+            self.dat_size = 0
+            self.garbage_bytes = 0
+            self.payloads = {}
+
+        if self.listing is None or structural:
+            listing = list(walk_tree(self.directory_path))
+            paths = [event[1] for event in listing if event[0] == 'file']
+            if listing != self.listing:
+                manifest_dirty = True
+                live = set(paths)
+                for relative_path in list(self.payloads):
+                    if relative_path not in live:
+                        self.garbage_bytes += self.payloads.pop(relative_path)['length']
+            self.listing = listing
+        else:
+            known = set(self.payloads)
+            paths = [path for path in changed if path in known]
+
+        try:
+            rewritten = self.update_payloads(paths)
+        except FileNotFoundError:
+            # A file went away while it was being read; rescan everything
+            return self.refresh(structural=True)
+
+        if not (manifest_dirty or rewritten):
+            return False
+        live_bytes = self.dat_size - self.garbage_bytes
+        if self.garbage_bytes and self.garbage_bytes > live_bytes * self.compact_ratio:
+            self.compact()
+        if manifest_dirty:
+            self.emit_manifest()
+        self.emit_index_and_checksums()
+        print("Rebuilt in {:.3f}s: {} payloads rewritten, manifest {}, {} garbage bytes in {}".format(
+            time.monotonic() - start, rewritten, "rewritten" if manifest_dirty else "unchanged",
+            self.garbage_bytes, self.dat_fname))
+        return True
+
+
+def watch(directory_path, app_id, app_version, fingerprint, interval=1.0, use_inotify=True, **build_options):
+    """
+    Build once, then rebuild on every change until interrupted.
+    """
+    builder = WatchBuilder(directory_path, app_id, app_version, fingerprint, **build_options)
+    builder.refresh()
+
+    watcher = None
+    if use_inotify and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(directory_path)
+            print("Watching {} with inotify".format(directory_path))
+        except (OSError, AttributeError) as e:
+            print("inotify unavailable ({}), falling back to polling".format(e))
+    if watcher is None:
+        watcher = PollingWatcher()
+        print("Watching {} by polling every {}s".format(directory_path, interval))
+
+    try:
+        while True:
+            result = watcher.wait(interval)
+            if result is None:
+                # Config files live outside the watched tree; check them on every tick
+                builder.refresh(set(), structural=False)
+            else:
+                builder.refresh(*result)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    sys.argv, cli_options = parse_cli_options(sys.argv)
+    if len(sys.argv) < 5:
+        print("Usage: python watch_build.py <directory_path> <app_id> <app version> <unique 4 character fingerprint> [options]")
+        print("Options:")
+        print(" --interval=<seconds>   Polling interval / config check interval (default 1)")
+        print(" --poll                 Poll the tree instead of using inotify")
+        print(" --checksum-granularity=<0x10000|0x8000|file>")
+        print(" --align=<size>         Start every file payload in the .dat on a multiple of <size>")
+        print(" --compact-ratio=<r>    Compact the .dat once garbage exceeds r times the live payload bytes (default 0.5)")
+        sys.exit(1)
+
+    build_options = {}
+    if "checksum_granularity" in cli_options:
+        build_options["checksum_granularity"] = parse_granularity(cli_options["checksum_granularity"])
+    if "align" in cli_options:
+        build_options["align"] = parse_size(cli_options["align"])
+    if "compact_ratio" in cli_options:
+        build_options["compact_ratio"] = float(cli_options["compact_ratio"])
+
+    app_version = "".join(c for c in sys.argv[3] if c.isdigit())
+    watch(sys.argv[1], int(sys.argv[2], 16), app_version, sys.argv[4],
+          interval=float(cli_options.get("interval", 1)), use_inotify="poll" not in cli_options, **build_options)
@@ -0,0 +1,103 @@
+##############################################################################
+# Shared zlib preset dictionary for small files.
+#
+# Thousands of small, similar files (.cfg, .lst, .txt, scripts) compress
+# poorly one at a time because every file starts with an empty window.
+# With compress='dict' the generator trains a preset dictionary (at most
+# 32K, zlib's window) from a sample of the small files, deflates each small
+# file against it (zdict) and stores the dictionary next to the index as
+# <app_id>_<version>.zdict; index entries of those files carry 'zdict', the
+# dictionary's adler32, which is also the DICTID of their zlib streams.
+# storage_extract.StorageReader loads the .zdict to inflate them.
+#
+# Training is a greedy segment cover (like zstd's COVER): the samples are
+# cut into segments, each scored by how many samples share its k-byte
+# substrings, and the best segments are taken until the dictionary is
+# full, with the most valuable ones last (closest to the data).
+##############################################################################
+
+import heapq
+import zlib
+
+MAX_DICTIONARY_SIZE = 0x8000    # deflate only looks back 32K
+
+
+def dictionary_id(zdict):
+    return zlib.adler32(zdict) & 0xFFFFFFFF
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE, segment_size=64, k=8):
+    """
+    Build a preset dictionary of at most size bytes from a list of sample
+    file contents.
+    """
+    size = min(size, MAX_DICTIONARY_SIZE)
+    # In how many samples each k-gram occurs; a k-gram seen once is no help
+    counts = {}
+    for sample in samples:
+        for gram in {sample[i:i + k] for i in range(len(sample) - k + 1)}:
+            counts[gram] = counts.get(gram, 0) + 1
+
+    def score(segment):
+        return sum(counts.get(gram, 0) for gram in {segment[i:i + k] for i in range(len(segment) - k + 1)}
+                   if counts.get(gram, 0) > 1)
+
+    heap = []
+    for sample in samples:
+        for pos in range(0, len(sample), segment_size):
+            segment = sample[pos:pos + segment_size]
+            value = score(segment)
+            if value:
+                heap.append((-value, len(heap), segment))
+    heapq.heapify(heap)
+
+    chosen = []
+    total = 0
+    while heap and total < size:
+        value, order, segment = heapq.heappop(heap)
+        # Lazy greedy: k-grams already covered by chosen segments no longer count
+        current = score(segment)
+        if not current:
+            continue
+        if heap and -current > heap[0][0]:
+            heapq.heappush(heap, (-current, order, segment))
+            continue
+        chosen.append(segment[:size - total])
+        total += len(chosen[-1])
+        for i in range(len(segment) - k + 1):
+            counts.pop(segment[i:i + k], None)
+    return b''.join(reversed(chosen))
+
+
+def sample_small_files(source, max_file_size, sample_bytes=0x100000):
+    """
+    Contents of up to sample_bytes of the source's non-empty files of at
+    most max_file_size bytes, spread evenly over the tree.
+    """
+    candidates = [(event[2], source.size(event[2])) for event in source.events() if event[0] == 'file']
+    candidates = [(ref, size) for ref, size in candidates if 0 < size <= max_file_size]
+    total = sum(size for _, size in candidates)
+    step = max(1.0, total / float(sample_bytes)) if total else 1.0
+    samples = []
+    taken = 0
+    position = 0.0
+    for ref, size in candidates:
+        # Take the file when the running byte count passes the next step
+        position += size
+        if position >= step or taken == 0:
+            position -= step
+            samples.extend(source.read_ranges(ref, [(0, size)]))
+            taken += size
+            if taken >= sample_bytes:
+                break
+    return samples
+
+
+def deflate_with_dictionary(data, level, zdict):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    return compressor.compress(data) + compressor.flush()
+
+
+def inflate_with_dictionary(data, zdict):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict)
+    return decompressor.decompress(data) + decompressor.flush()